@@ -223,6 +223,7 @@ class Arm:
         self.vec = h.Vector()
         self.cmdmaxrate = f.cmdmaxrate # maximum spikes for motor command (normalizing value)
         self.cmdtimewin = f.cmdtimewin # spike time window for shoulder motor command (ms)
+        f.addSpikeMonitor({i: f.motorCmdCellRange[i] for i in range(f.nMuscles)}, window=self.cmdtimewin, label='motorCmd')
 
         # proprioceptive encoding
         self.numPcells = len(f.pop_sh) # number of proprioceptive cells to encode shoulder and elbow angles
@@ -309,17 +310,9 @@ class Arm:
 
         # Calculate output motor command (after initial period)
         if t > self.initArmMovement:
-            # Gather spikes from all vectors to then calculate motor command 
-            for i in range(f.nMuscles):
-                spktvec = array(f.simData['spkt'])
-                spkgids = array(f.simData['spkid'])
-                inds = nonzero((spktvec < t) * (spktvec > t-self.cmdtimewin)) # Filter
-                spktvec = spktvec[inds]
-                spkgids = spkgids[inds]
-                cmdVecs = array([spkt for spkt,spkid in zip(spktvec, spkgids) if spkid in f.motorCmdCellRange[i]]) # CK: same outcome, but much slower: cmdVecs = array([spkt for spkt,spkid in zip(f.simData['spkt'], f.simData['spkid']) if spkid in f.motorCmdCellRange[i]])
-                self.motorCmd[i] = len(cmdVecs[(cmdVecs < t) * (cmdVecs > t-self.cmdtimewin)])
-                f.pc.allreduce(self.vec.from_python([self.motorCmd[i]]), 1) # sum
-                self.motorCmd[i] = self.vec.to_python()[0]        
+            # Count spikes of each muscle group in time window (summed across all nodes) to then calculate motor command 
+            spikeCounts = f.getSpikeCounts('motorCmd')
+            self.motorCmd = [spikeCounts[i] for i in range(f.nMuscles)]
          
             # Calculate final motor command 
             if f.rank==0:  
@@ -52,7 +52,6 @@ sim.antagInh = 1  # inhibition from antagonic muscle
 
 # RL
 sim.useRL = 1
-sim.timeoflastRL = -1
 sim.RLinterval = 50
 sim.minRLerror = 0.002 # minimum error change for RL (m)
 sim.targetid = 1 # initial target 
@@ -95,32 +94,20 @@ def runArm(t):
 
     if sim.useArm:
         sim.arm.run(t, sim) # run virtual arm apparatus (calculate command, move arm, feedback)
-    if sim.useRL and (t - sim.timeoflastRL >= sim.RLinterval): # if time for next RL
-        sim.timeoflastRL = h.t
-        vec = h.Vector()
-        if sim.rank == 0:
-            critic = sim.arm.RLcritic(h.t) # get critic signal (-1, 0 or 1)
-            sim.pc.broadcast(vec.from_python([critic]), 0) # convert python list to hoc vector for broadcast data received from arm
-            
-        else: # other workers
-            sim.pc.broadcast(vec, 0)
-            critic = vec.to_python()[0]
-        if critic != 0: # if critic signal indicates punishment (-1) or reward (+1)
-            print 't=',t,'- adjusting weights based on RL critic value:', critic
-            for cell in sim.net.cells:
-                for conn in cell.conns:
-                    STDPmech = conn.get('hSTDP')  # check if has STDP mechanism
-                    if STDPmech:   # run stdp.mod method to update syn weights based on RLprint cell.gid
-                        STDPmech.reward_punish(float(critic))
-
-        # store weight changes
-        sim.allWeights.append([]) # Save this time
-        for cell in sim.net.cells:
-            for conn in cell.conns:
-                if 'hSTDP' in conn:
-                    sim.allWeights[-1].append(float(conn['hNetcon'].weight[0])) # save weight only for STDP conns
 
-    
+
+# Function to run at RL intervals during simulation
+def runRL(t):
+    if not sim.useRL: 
+        return
+    critic = sim.bcast(sim.arm.RLcritic(t) if sim.rank == 0 else None, 0) # get critic signal (-1, 0 or 1) from arm in node 0
+    if critic != 0: # if critic signal indicates punishment (-1) or reward (+1)
+        print 't=',t,'- adjusting weights based on RL critic value:', critic
+        sim.net.rewardPunish(critic, {'plastic': True})  # run stdp.mod method to update syn weights based on RL
+
+    # store weight changes
+    sim.allWeights.append(sim.net.getWeights({'plastic': True})) # save weight only for STDP conns
+
     
 def saveWeights(sim):
     ''' Save the weights for each plastic synapse '''
@@ -153,7 +140,9 @@ def plotWeights():
 # Run Network with virtual arm
 ###############################################################################
 
-sim.runSimWithIntervalFunc(sim.updateInterval, runArm)        # run parallel Neuron simulation  
+sim.addIntervalCallback(runArm, sim.updateInterval)  # arm updates
+sim.addIntervalCallback(runRL, sim.RLinterval)  # RL updates (called after arm update if both due at same time)
+sim.runSim()                      # run parallel Neuron simulation  
 sim.gatherData()                  # gather spiking data and cell info from each node
 sim.saveData()                    # save params, cell info and sim output to file (pickle,mat,txt,etc)
 sim.analysis.plotData()               # plot spike raster
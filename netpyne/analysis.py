@@ -12,6 +12,7 @@ from matplotlib import gridspec
 from scipy import size, array, linspace, ceil
 from numbers import Number
 import math
+import numpy as np
 
 import sim
 
@@ -179,11 +180,12 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
     popColors = {popLabel: colorList[ipop%len(colorList)] for ipop,popLabel in enumerate(popLabels)} # dict with color for each pop
     if len(cellGids) > 0:
         gidColors = {cell['gid']: popColors[cell['tags']['popLabel']] for cell in cells}  # dict with color for each gid
-        try:
-            spkgids,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
-        except:
+        spkts,spkgids = sim.getSpikeStore().spikesFor(cellGids, timeRange)  # indexed by gid and time
+        if len(spkts) == 0:
             print 'No spikes available to plot raster'
             return None
+        spkorder = spkts.argsort(kind='mergesort')  # time order
+        spkgids,spkts = list(spkgids[spkorder]), list(spkts[spkorder])
         spkgidColors = [gidColors[spkgid] for spkgid in spkgids]
 
     # Order by
@@ -265,7 +267,10 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
     
     # Plot stats
     totalSpikes = len(spkts)   
-    totalConnections = sum([len(cell['conns']) for cell in cells])   
+    if 'postGid' in getattr(sim.net, 'connArrays', {}):  # loaded with sim.loadLazy (avoids reading cells from file)
+        totalConnections = int(np.in1d(sim.net.connArrays['postGid'], cellGids).sum()) if len(cellGids) else 0
+    else:
+        totalConnections = sum([len(cell['conns']) for cell in cells])   
     numCells = len(cells)
     firingRate = float(totalSpikes)/numCells/(timeRange[1]-timeRange[0])*1e3 if totalSpikes>0 else 0# Calculate firing rate 
     connsPerCell = totalConnections/float(numCells) if numCells>0 else 0 # Calculate the number of connections per cell
@@ -328,7 +333,7 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
 ## Plot spike histogram
 ######################################################################################################################################################
 def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize = 5, overlay=True, graphType='line', yaxis = 'rate', 
-    figSize = (10,8), saveData = None, saveFig = None, showFig = True): 
+    spikeHistData = None, figSize = (10,8), saveData = None, saveFig = None, showFig = True): 
     ''' 
     Plot spike histogram
         - include (['all',|'allCells','allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): List of data series to include. 
@@ -338,6 +343,8 @@ def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize
         - overlay (True|False): Whether to overlay the data lines or plot in separate subplots (default: True)
         - graphType ('line'|'bar'): Type of graph to use (line graph or bar plot) (default: 'line')
         - yaxis ('rate'|'count'): Units of y axis (firing rate in Hz, or spike count) (default: 'rate')
+        - spikeHistData (None|dict): Pop histograms returned by sim.reduceSpikeHist(), calculated in each node without gathering spikes; 
+            include items can only be 'allCells', 'eachPop' or pop labels, and timeRange and binSize are taken from it (default: None)
         - figSize ((width, height)): Size of figure (default: (10,8))
         - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure;
             if set to True uses filename from simConfig (default: None)
@@ -359,7 +366,9 @@ def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize
     # Replace 'eachPop' with list of pops
     if 'eachPop' in include: 
         include.remove('eachPop')
-        for pop in sim.net.allPops: include.append(pop)
+        if spikeHistData: include.extend([pop for pop in spikeHistData['counts'] if pop != 'allCells'])
+        else: 
+            for pop in sim.net.allPops: include.append(pop)
 
     # Y-axis label
     if yaxis == 'rate': yaxisLabel = 'Avg cell firing rate (Hz)'
@@ -369,7 +378,9 @@ def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize
         return
 
     # time range
-    if timeRange is None:
+    if spikeHistData:
+        timeRange, binSize = spikeHistData['timeRange'], spikeHistData['binSize']
+    elif timeRange is None:
         timeRange = [0,sim.cfg.duration]
 
     histData = []
@@ -380,38 +391,42 @@ def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize
     
     # Plot separate line for each entry in include
     for iplot,subset in enumerate(include):
-        cells, cellGids, netStimPops = getCellsInclude([subset])
-        numNetStims = 0
-
-        # Select cells to include
-        if len(cellGids) > 0:
-            try:
-                spkinds,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
-            except:
+        if spikeHistData:  # histogram reduced across nodes
+            if subset not in spikeHistData['counts']:
+                print '  %s not available in spikeHistData'%(str(subset))
+                continue
+            histoT = spikeHistData['binCenters']
+            histoCount = spikeHistData['counts'][subset]
+            numCells = spikeHistData['numCells'][subset]
+        else:
+            # Select cells to include
+            cells, cellGids, netStimPops = getCellsInclude([subset])
+            if len(cellGids) > 0:
+                spkts,spkinds = sim.getSpikeStore().spikesFor(cellGids, timeRange)  # indexed by gid and time
+            else: 
                 spkinds,spkts = [],[]
-        else: 
-            spkinds,spkts = [],[]
-
-        # Add NetStim spikes
-        spkts, spkinds = list(spkts), list(spkinds)
-        numNetStims = 0
-        for netStimPop in netStimPops:
-            cellStims = [cellStim for cell,cellStim in sim.allSimData['stims'].iteritems() if netStimPop in cellStim]
-            if len(cellStims) > 0:
-                lastInd = max(spkinds) if len(spkinds)>0 else 0
-                spktsNew = [spkt for cellStim in cellStims for spkt in cellStim[netStimPop] ]
-                spkindsNew = [lastInd+1+i for i,cellStim in enumerate(cellStims) for spkt in cellStim[netStimPop]]
-                spkts.extend(spktsNew)
-                spkinds.extend(spkindsNew)
-                numNetStims += len(cellStims)
-
-        histo = histogram(spkts, bins = arange(timeRange[0], timeRange[1], binSize))
-        histoT = histo[1][:-1]+binSize/2
-        histoCount = histo[0] 
+
+            # Add NetStim spikes
+            spkts, spkinds = list(spkts), list(spkinds)
+            numNetStims = 0
+            for netStimPop in netStimPops:
+                cellStims = [cellStim for cell,cellStim in sim.allSimData['stims'].iteritems() if netStimPop in cellStim]
+                if len(cellStims) > 0:
+                    lastInd = max(spkinds) if len(spkinds)>0 else 0
+                    spktsNew = [spkt for cellStim in cellStims for spkt in cellStim[netStimPop] ]
+                    spkindsNew = [lastInd+1+i for i,cellStim in enumerate(cellStims) for spkt in cellStim[netStimPop]]
+                    spkts.extend(spktsNew)
+                    spkinds.extend(spkindsNew)
+                    numNetStims += len(cellStims)
+
+            histo = histogram(spkts, bins = arange(timeRange[0], timeRange[1], binSize))
+            histoT = histo[1][:-1]+binSize/2
+            histoCount = histo[0] 
+            numCells = len(cellGids)+numNetStims
 
         histData.append(histoCount)
 
-        if yaxis=='rate': histoCount = histoCount * (1000.0 / binSize) / (len(cellGids)+numNetStims) # convert to firing rate
+        if yaxis=='rate': histoCount = histoCount * (1000.0 / binSize) / numCells # convert to firing rate
 
         color = colorList[iplot%len(colorList)]
 
@@ -517,8 +532,6 @@ def plotTraces (include = None, timeRange = None, overlay = False, oneFigPer = '
     if timeRange is None:
         timeRange = [0,sim.cfg.duration]
 
-    recordStep = sim.cfg.recordStep
-
     figs = []
     tracesData = []
     # Plot one fig per cell
@@ -527,6 +540,7 @@ def plotTraces (include = None, timeRange = None, overlay = False, oneFigPer = '
             figs.append(figure()) # Open a new figure
             fontsiz = 12
             for itrace, trace in enumerate(tracesList):
+                recordStep = _traceRecordStep(trace)
                 if 'cell_'+str(gid) in sim.allSimData[trace]:
                     fullTrace = sim.allSimData[trace]['cell_'+str(gid)]
                     if isinstance(fullTrace, dict):
@@ -556,11 +570,16 @@ def plotTraces (include = None, timeRange = None, overlay = False, oneFigPer = '
     # Plot one fig per cell
     elif oneFigPer == 'trace':
         for itrace, trace in enumerate(tracesList):
+            recordStep = _traceRecordStep(trace)
             figs.append(figure()) # Open a new figure
             fontsiz = 12
             for igid, gid in enumerate(cellGids):
                 if 'cell_'+str(gid) in sim.allSimData[trace]:
-                    data = sim.allSimData[trace]['cell_'+str(gid)][int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)]
+                    fullTrace = sim.allSimData[trace]['cell_'+str(gid)]
+                    if isinstance(fullTrace, dict):  # eg. min and max envelope
+                        data = transpose(array([fullTrace[key][int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)] for key in fullTrace.keys()]))
+                    else:
+                        data = fullTrace[int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)]
                     t = arange(timeRange[0], timeRange[1]+recordStep, recordStep)
                     tracesData.append({'t': t, 'cell_'+str(gid)+'_'+trace: data})
                     color = colorList[igid]
@@ -577,6 +596,24 @@ def plotTraces (include = None, timeRange = None, overlay = False, oneFigPer = '
                 subplots_adjust(right=(0.9-0.012*maxLabelLen)) 
                 legend(fontsize=fontsiz, bbox_to_anchor=(1.04, 1), loc=2, borderaxespad=0.)
 
+    # Plot traces aggregated per population (one fig per trace)
+    for trace in tracesList:
+        popKeys = sorted([key for key in sim.allSimData[trace] if key.startswith('pop_')])
+        if not popKeys: continue
+        recordStep = _traceRecordStep(trace)
+        figs.append(figure()) # Open a new figure
+        fontsiz = 12
+        for ipop, popKey in enumerate(popKeys):
+            data = sim.allSimData[trace][popKey][int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)]
+            t = arange(timeRange[0], timeRange[1]+recordStep, recordStep)
+            tracesData.append({'t': t, popKey+'_'+trace: data})
+            plot(t[:len(data)], data, linewidth=1.5, color=colorList[ipop%len(colorList)], label='Pop %s'%(popKey[4:]))
+        xlabel('Time (ms)', fontsize=fontsiz)
+        ylabel(trace, fontsize=fontsiz)
+        xlim(timeRange)
+        title('%s (%s per population)'%(trace, sim.cfg.recordTraces[trace].get('aggregate')))
+        legend(fontsize=fontsiz)
+
     try:
         tight_layout()
     except:
@@ -603,42 +640,137 @@ def plotTraces (include = None, timeRange = None, overlay = False, oneFigPer = '
     return figs
 
 
+def _traceRecordStep (trace):
+    # recording time step of trace (can be decimated)
+    return sim.cfg.recordStep * sim.cfg.recordTraces[trace].get('decimate', 1)
+
 
 ######################################################################################################################################################
 ## Plot LFP (time-resolved or power spectra)
 ######################################################################################################################################################
-def plotLFP ():
-    print('Plotting LFP power spectral density...')
+def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD'], includePops = False, timeRange = None, maxFreq = 100, NFFT = 256, 
+    noverlap = 128, figSize = (10,8), saveData = None, saveFig = None, showFig = True): 
+    ''' 
+    Plot LFP recorded at electrodes (simConfig.recordLFP)
+        - electrodes (['avg', 'all', 0, 1, ...]): List of electrodes to plot; 'avg' is the average of all electrodes, 
+            'all' includes each electrode (default: ['avg', 'all'])
+        - plots (['timeSeries', 'PSD']): List of plots to show: LFP signal over time and/or its power spectral density 
+            (default: ['timeSeries', 'PSD'])
+        - includePops (True|False): Whether to also plot the contribution of each population; requires simConfig.saveLFPPops (default: False)
+        - timeRange ([start:stop]): Time range of LFP shown; if None shows all (default: None)
+        - maxFreq (float): Maximum frequency shown in PSD (default: 100)
+        - NFFT (int): Number of data points used in each block of the PSD FFT (default: 256)
+        - noverlap (int): Number of points of overlap between PSD blocks (default: 128)
+        - figSize ((width, height)): Size of figure (default: (10,8))
+        - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure;
+            if set to True uses filename from simConfig (default: None)
+        - saveFig (None|True|'fileName'): File name where to save the figure;
+            if set to True uses filename from simConfig (default: None)
+        - showFig (True|False): Whether to show the figure or not (default: True)
 
-    colorspsd=array([[0.42,0.67,0.84],[0.42,0.83,0.59],[0.90,0.76,0.00],[0.90,0.32,0.00],[0.34,0.67,0.67],[0.42,0.82,0.83],[0.90,0.59,0.00],[0.33,0.67,0.47],[1.00,0.85,0.00],[0.71,0.82,0.41],[0.57,0.67,0.33],[1.00,0.38,0.60],[0.5,0.2,0.0],[0.0,0.2,0.5]]) 
+        - Returns list of figure handles
+    '''
 
-    lfpv=[[] for c in range(len(sim.lfppops))]    
-    # Get last modified .mat file if no input and plot
-    for c in range(len(sim.lfppops)):
-        lfpv[c] = sim.lfps[:,c]    
-    lfptot = sum(lfpv)
-        
-    # plot pops separately
-    plotPops = 0
-    if plotPops:    
-        figure() # Open a new figure
-        for p in range(len(sim.lfppops)):
-            psd(lfpv[p],Fs=200, linewidth= 2,color=colorspsd[p])
-            xlabel('Frequency (Hz)')
-            ylabel('Power')
-            h=axes()
-            h.set_yticklabels([])
-        legend(['L2/3','L5A', 'L5B', 'L6'])
-
-    # plot overall psd
-    figure() # Open a new figure
-    psd(lfptot,Fs=200, linewidth= 2)
-    xlabel('Frequency (Hz)')
-    ylabel('Power')
-    h=axes()
-    h.set_yticklabels([])
-
-    show()
+    print('Plotting LFP...')
+
+    colorList = [[0.42,0.67,0.84], [0.90,0.76,0.00], [0.42,0.83,0.59], [0.90,0.32,0.00],
+                [0.34,0.67,0.67], [0.90,0.59,0.00], [0.42,0.82,0.83], [1.00,0.85,0.00],
+                [0.33,0.67,0.47], [1.00,0.38,0.60], [0.57,0.67,0.33], [0.5,0.2,0.0],
+                [0.71,0.82,0.41], [0.0,0.2,0.5]] 
+
+    if 'LFP' not in sim.allSimData:
+        print('  No LFP recorded; set simConfig.recordLFP to a list of electrode positions')
+        return
+
+    lfp = np.asarray(sim.allSimData['LFP'])  # (time x electrodes); nested lists if loaded from json or pickle
+
+    # electrodes
+    numElectrodes = lfp.shape[1]
+    electrodeList = []
+    for elec in electrodes:
+        if elec == 'all': electrodeList.extend(range(numElectrodes))
+        elif elec == 'avg' or (isinstance(elec, Number) and elec < numElectrodes): electrodeList.append(elec)
+
+    # time range
+    if timeRange is None:
+        timeRange = [0,sim.cfg.duration]
+    recordStep = sim.cfg.recordStep
+    indices = slice(int(timeRange[0]/recordStep), int(timeRange[1]/recordStep)+1)
+
+    # LFP signals (total and of each population)
+    signals = [('All', lfp[indices])]
+    if includePops:
+        if 'LFPPops' in sim.allSimData:
+            signals.extend([(popLabel, np.asarray(sim.allSimData['LFPPops'][popLabel])[indices]) for popLabel in sim.net.allPops if popLabel in sim.allSimData['LFPPops']])
+        else:
+            print('  Population LFP not recorded; set simConfig.saveLFPPops = True')
+
+    def electrodeSignal (data, elec):
+        return data.mean(axis=1) if elec == 'avg' else data[:, elec]
+
+    def electrodeTitle (elec):
+        return 'Electrode average' if elec == 'avg' else 'Electrode %d %s' % (elec, str(list(sim.cfg.recordLFP[elec])))
+
+    figs = []
+    lfpData = {'electrodes': electrodeList, 't': timeRange[0] + arange(len(signals[0][1]))*recordStep}
+    fontsiz = 12
+
+    # time series
+    if 'timeSeries' in plots:
+        figs.append(figure(figsize=figSize))
+        t = lfpData['t']
+        for ielec, elec in enumerate(electrodeList):
+            subplot(len(electrodeList), 1, ielec+1)
+            for isignal, (label, data) in enumerate(signals):
+                plot(t, electrodeSignal(data, elec), linewidth=1.0, color=colorList[isignal%len(colorList)] if len(signals) > 1 else 'blue', label=label)
+            ylabel('LFP (mV)', fontsize=fontsiz)
+            title(electrodeTitle(elec), fontsize=fontsiz)
+            xlim(timeRange)
+        xlabel('Time (ms)', fontsize=fontsiz)
+        if len(signals) > 1: legend(fontsize=fontsiz, bbox_to_anchor=(1.02, 1), loc=2, borderaxespad=0.)
+
+    # power spectral density
+    if 'PSD' in plots:
+        figs.append(figure(figsize=figSize))
+        lfpData['psd'] = {}
+        for ielec, elec in enumerate(electrodeList):
+            subplot(len(electrodeList), 1, ielec+1)
+            for isignal, (label, data) in enumerate(signals):
+                power, freqs = psd(electrodeSignal(data, elec), Fs=1000.0/recordStep, NFFT=NFFT, noverlap=noverlap, linewidth=1.5, 
+                    color=colorList[isignal%len(colorList)] if len(signals) > 1 else 'blue', label=label)
+                lfpData['psd']['%s_%s' % (label, elec)] = power
+                lfpData['freqs'] = freqs
+            xlim([0, maxFreq])
+            xlabel('')
+            ylabel('Power (dB/Hz)', fontsize=fontsiz)
+            title(electrodeTitle(elec), fontsize=fontsiz)
+        xlabel('Frequency (Hz)', fontsize=fontsiz)
+        if len(signals) > 1: legend(fontsize=fontsiz, bbox_to_anchor=(1.02, 1), loc=2, borderaxespad=0.)
+
+    try:
+        tight_layout()
+    except:
+        pass
+
+    # save figure data
+    if saveData:
+        figData = {'lfpData': lfpData, 'electrodes': electrodes, 'plots': plots, 'timeRange': timeRange, 'saveData': saveData, 
+            'saveFig': saveFig, 'showFig': showFig}
+    
+        _saveFigData(figData, saveData, 'LFP')
+ 
+    # save figure
+    if saveFig: 
+        if isinstance(saveFig, str):
+            filename = saveFig
+        else:
+            filename = sim.cfg.filename+'_'+'LFP.png'
+        savefig(filename)
+
+    # show fig 
+    if showFig: _showFigure()
+
+    return figs
 
 def _roundFigures(x, n):
     """Returns x rounded to n significant figures."""
@@ -647,7 +779,7 @@ def _roundFigures(x, n):
 ######################################################################################################################################################
 ## Plot connectivity
 ######################################################################################################################################################
-def plotConn (include = ['all'], feature = 'strength', orderBy = 'gid', figSize = (10,10), groupBy = 'pop', groupByInterval = None, saveData = None, saveFig = None, showFig = True): 
+def plotConn (include = ['all'], feature = 'strength', orderBy = 'gid', figSize = (10,10), groupBy = 'pop', groupByInterval = None, connData = None, saveData = None, saveFig = None, showFig = True): 
     ''' 
     Plot network connectivity
         - include (['all',|'allCells','allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): Cells to show (default: ['all'])
@@ -655,6 +787,8 @@ def plotConn (include = ['all'], feature = 'strength', orderBy = 'gid', figSize
             the only features applicable to groupBy='cell' are 'weight', 'delay' and 'numConns';  'strength' = weight * probability (default: 'strength')
         - groupBy ('pop'|'cell'|'y'|: Show matrix for individual cells, populations, or by other numeric tag such as 'y' (default: 'pop')
         - groupByInterval (int or float): Interval of groupBy feature to group cells by in conn matrix, e.g. 100 to group by cortical depth in steps of 100 um   (default: None)
+        - connData (None|dict): Pop conn matrices returned by sim.reduceConnMatrix(), calculated in each node without gathering cells; 
+            requires groupBy='pop' and include is ignored (default: None)
         - orderBy ('gid'|'y'|'ynorm'|...): Unique numeric cell property to order x and y axes by, e.g. 'gid', 'ynorm', 'y' (requires groupBy='cells') (default: 'gid')
         - figSize ((width, height)): Size of figure (default: (10,10))
         - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure; 
@@ -668,7 +802,11 @@ def plotConn (include = ['all'], feature = 'strength', orderBy = 'gid', figSize
 
     print('Plotting connectivity matrix...')
     
-    cells, cellGids, netStimPops = getCellsInclude(include)    
+    if connData is not None and groupBy == 'pop':
+        cells, cellGids, netStimPops = [], [], []  # matrices already calculated (sim.reduceConnMatrix)
+    else:
+        connData = None
+        cells, cellGids, netStimPops = getCellsInclude(include)    
 
     # Create plot
     fig = figure(figsize=figSize)
@@ -718,25 +856,32 @@ def plotConn (include = ['all'], feature = 'strength', orderBy = 'gid', figSize
     # Calculate matrix if grouped by pop
     elif groupBy == 'pop': 
         
-        # get list of pops
-        popsTemp = list(set([cell['tags']['popLabel'] for cell in cells]))
-        pops = [pop for pop in sim.net.allPops if pop in popsTemp]+netStimPops
-        popInds = {pop: ind for ind,pop in enumerate(pops)}
-        
-        # initialize matrices
-        if feature in ['weight', 'strength']: 
-            weightMatrix = zeros((len(pops), len(pops)))
-        elif feature == 'delay': 
-            delayMatrix = zeros((len(pops), len(pops)))
-        countMatrix = zeros((len(pops), len(pops)))
-        
-        # calculate max num conns per pre and post pair of pops
-        numCellsPop = {}
-        for pop in pops:
-            if pop in netStimPops:
-                numCellsPop[pop] = -1
-            else:
-                numCellsPop[pop] = len([cell for cell in cells if cell['tags']['popLabel']==pop])
+        if connData:
+            # use matrices reduced across nodes
+            pops = connData['pops']
+            popInds = {pop: ind for ind,pop in enumerate(pops)}
+            weightMatrix, delayMatrix, countMatrix = connData['weight'], connData['delay'], connData['numConns']
+            numCellsPop = dict(connData['numCells'])
+        else:
+            # get list of pops
+            popsTemp = list(set([cell['tags']['popLabel'] for cell in cells]))
+            pops = [pop for pop in sim.net.allPops if pop in popsTemp]+netStimPops
+            popInds = {pop: ind for ind,pop in enumerate(pops)}
+            
+            # initialize matrices
+            if feature in ['weight', 'strength']: 
+                weightMatrix = zeros((len(pops), len(pops)))
+            elif feature == 'delay': 
+                delayMatrix = zeros((len(pops), len(pops)))
+            countMatrix = zeros((len(pops), len(pops)))
+            
+            # calculate max num conns per pre and post pair of pops
+            numCellsPop = {}
+            for pop in pops:
+                if pop in netStimPops:
+                    numCellsPop[pop] = -1
+                else:
+                    numCellsPop[pop] = len([cell for cell in cells if cell['tags']['popLabel']==pop])
 
         maxConnMatrix = zeros((len(pops), len(pops)))
         if feature == 'convergence': maxPostConnMatrix = zeros((len(pops), len(pops)))
@@ -0,0 +1,329 @@
+"""
+batch.py
+
+Class to run batches of simulations (eg. parameter sweeps) in a local process pool or as independent MPI jobs
+
+Usage:
+    from netpyne.batch import Batch
+
+    b = Batch(netParams, simConfig, params={'netParams.connParams.E->E.weight': [0.001, 0.005], 'simConfig.seeds.stim': [1, 2, 3]})
+    summary = b.run(processes=16)
+
+Contributors: salvadordura@gmail.com
+"""
+
+import os
+import json
+from itertools import product
+from time import time
+import cPickle as pk
+from collections import OrderedDict
+from specs import NetParams, SimConfig, ODict
+
+
+###############################################################################
+### Batch class
+###############################################################################
+class Batch (object):
+
+    def __init__(self, netParams=None, simConfig=None, params=None, runs=None, method='grid', batchLabel='batch', saveFolder='batch_data',
+        runFunc=None, summaryFunc=None):
+        '''
+        netParams: base NetParams object or dict
+        simConfig: base SimConfig object or dict
+        params: dict of dotted paths to lists of values, eg. {'netParams.connParams.E->E.weight': [0.001, 0.005]}
+        runs: list of dicts of dotted paths to values, one per run (alternative to params)
+        method: how to combine params values: 'grid' (all combinations) or 'list' (i-th value of each param in run i)
+        batchLabel: label used in run and output file names
+        saveFolder: folder where each run output (and batch summary) is saved
+        runFunc: function to create, simulate and analyze network (default: sim.createSimulateAnalyze); receives (netParams, simConfig)
+        summaryFunc: function that returns dict of summary values of a run (default: numCells, numSpikes, avgRate, runTime); receives (sim)
+        (runFunc and summaryFunc need to be defined at module level so they can be sent to the worker processes; with mpiCommand they
+        need to be in an importable module, not in the batch script itself, and can also be passed as 'module:function' strings)
+        '''
+        self.netParams = netParams if netParams is not None else NetParams()
+        self.simConfig = simConfig if simConfig is not None else SimConfig()
+        self.params = params if params is not None else OrderedDict()
+        self.runs = runs
+        self.method = method
+        self.batchLabel = batchLabel
+        self.saveFolder = saveFolder
+        self.runFunc = runFunc
+        self.summaryFunc = summaryFunc
+
+
+    ###############################################################################
+    ### Return list of runs as (label, overrides) tuples
+    ###############################################################################
+    def getRuns (self):
+        if self.runs is not None:  # explicit list of runs
+            return [('%s_%d' % (self.batchLabel, irun), OrderedDict(sorted(run.items()))) for irun, run in enumerate(self.runs)]
+
+        paths = sorted(self.params.keys())
+        if self.method == 'grid':
+            runs = []
+            for indices in product(*[range(len(self.params[path])) for path in paths]):
+                label = '_'.join([self.batchLabel]+[str(i) for i in indices])
+                runs.append((label, OrderedDict([(path, self.params[path][i]) for path,i in zip(paths, indices)])))
+            return runs
+
+        elif self.method == 'list':
+            numRuns = set([len(self.params[path]) for path in paths])
+            if len(numRuns) > 1:
+                raise ValueError('Batch params must have the same number of values when using method="list"')
+            return [('%s_%d' % (self.batchLabel, irun), OrderedDict([(path, self.params[path][irun]) for path in paths]))
+                for irun in range(numRuns.pop() if numRuns else 0)]
+
+        else:
+            raise ValueError('Unknown batch method: %s' % (self.method))
+
+
+    ###############################################################################
+    ### Return dicts of netParams and simConfig with overrides applied
+    ###############################################################################
+    def getRunSpecs (self, overrides):
+        netParams = _specsToDict(self.netParams)
+        simConfig = _specsToDict(self.simConfig)
+        for path, value in overrides.iteritems():
+            setNested({'netParams': netParams, 'simConfig': simConfig, 'cfg': simConfig}, path, value)
+        return netParams, simConfig
+
+
+    ###############################################################################
+    ### Run all jobs not yet completed and save summary table
+    ###############################################################################
+    def run (self, processes=None, mpiCommand=None, overwrite=False):
+        '''
+        processes: number of runs executed at the same time (default: number of cores if mpiCommand is None, else 1)
+        mpiCommand: if set, each run is launched as an independent MPI job using this command, eg. 'mpiexec -np 4 nrniv -python -mpi'
+        overwrite: run again jobs that have already completed (default: False; completed jobs are skipped so batches can be resumed)
+        '''
+        if not os.path.exists(self.saveFolder): os.makedirs(self.saveFolder)
+        runs = self.getRuns()
+
+        jobs = []
+        for label, overrides in runs:
+            runFolder = os.path.join(self.saveFolder, label)
+            if not overwrite and os.path.exists(os.path.join(runFolder, _summaryFile)):
+                continue  # already completed
+            netParams, simConfig = self.getRunSpecs(overrides)
+            jobs.append({'label': label, 'runFolder': runFolder, 'overrides': overrides, 'netParams': netParams, 'simConfig': simConfig,
+                'runFunc': self.runFunc, 'summaryFunc': self.summaryFunc})
+
+        print('Batch %s: %d runs (%d already completed)' % (self.batchLabel, len(runs), len(runs)-len(jobs)))
+
+        start = time()
+        runJobs(jobs, processes, mpiCommand)
+        print('Batch %s: done; total time = %0.2f s' % (self.batchLabel, time()-start))
+
+        return self.saveSummary(runs)
+
+
+    ###############################################################################
+    ### Collect summary of each run and save as csv table
+    ###############################################################################
+    def saveSummary (self, runs=None):
+        if runs is None: runs = self.getRuns()
+
+        rows = []
+        for label, overrides in runs:
+            row = loadRunSummary(os.path.join(self.saveFolder, label))
+            if row is None:
+                print('  Warning: run %s did not complete' % (label))
+                continue
+            rows.append(row)
+
+        columns = ['label'] + sorted(set([key for row in rows for key in row['params']]))
+        columns += sorted(set([key for row in rows for key in row['summary']]))
+        filename = os.path.join(self.saveFolder, self.batchLabel+'_summary.csv')
+        with open(filename, 'w') as fileObj:
+            fileObj.write(','.join(columns)+'\n')
+            for row in rows:
+                values = dict(row['params'].items() + row['summary'].items() + [('label', row['label'])])
+                fileObj.write(','.join([_csvValue(values.get(col, '')) for col in columns])+'\n')
+        print('Saved batch summary to %s' % (filename))
+
+        return rows
+
+
+###############################################################################
+### Set value in nested dicts/lists using dotted path (eg. 'netParams.connParams.E->E.weight')
+###############################################################################
+def setNested (obj, path, value):
+    keys = path.split('.') if isinstance(path, str) else list(path)
+    for key in keys[:-1]:
+        obj = obj[_key(obj, key)]
+    obj[_key(obj, keys[-1])] = value
+
+
+def _key (obj, key):
+    if isinstance(obj, (list, tuple)): return int(key)  # list index
+    return key
+
+
+###############################################################################
+### Convert specs object (or Dict/ODict) to (copy of) plain dicts; keeps order of ODicts
+###############################################################################
+def _specsToDict (obj):
+    if isinstance(obj, (NetParams, SimConfig)): obj = obj.__dict__
+    return ODict().undotify(obj)
+
+
+def _csvValue (value):
+    value = str(value)
+    if ',' in value or '"' in value: value = '"%s"' % (value.replace('"', '""'))
+    return value
+
+
+_summaryFile = 'summary.json'  # saved at the end of each run; also used to check if run completed
+
+
+###############################################################################
+### Load summary of run (None if run did not complete)
+###############################################################################
+def loadRunSummary (runFolder):
+    summaryPath = os.path.join(runFolder, _summaryFile)
+    if not os.path.exists(summaryPath): return None
+    with open(summaryPath, 'r') as fileObj:
+        return json.load(fileObj, object_pairs_hook=OrderedDict)
+
+
+###############################################################################
+### Run list of jobs in local process pool or as independent MPI jobs
+###############################################################################
+def runJobs (jobs, processes=None, mpiCommand=None):
+    import multiprocessing
+
+    if not jobs: return
+    if mpiCommand:
+        _runMPIJobs(jobs, mpiCommand, processes or 1)
+    else:
+        # new process per run (maxtasksperchild=1) so each run starts with a clean NEURON instance
+        pool = multiprocessing.Pool(processes or multiprocessing.cpu_count(), maxtasksperchild=1)
+        try:
+            for label, error in pool.imap_unordered(_runJobSafe, jobs):
+                if error: print('  Run %s failed: %s' % (label, error))
+                else: print('  Finished %s' % (label))
+        finally:
+            pool.close()
+            pool.join()
+
+
+###############################################################################
+### Return function given as function or 'module:function' string
+###############################################################################
+def resolveFunc (func):
+    if isinstance(func, basestring):
+        import importlib
+        moduleName, funcName = func.split(':')
+        return getattr(importlib.import_module(moduleName), funcName)
+    return func
+
+
+###############################################################################
+### Raise error if job functions can't be loaded by a new process (functions of the batch script are saved as __main__.<name>)
+###############################################################################
+def _checkMPIFuncs (job):
+    for key in ['runFunc', 'summaryFunc']:
+        func = job.get(key)
+        funcs = [func] + (vars(func).values() if hasattr(func, '__dict__') else [])  # including wrapped functions, eg. FitnessSummary
+        for f in funcs:
+            if callable(f) and getattr(f, '__module__', None) == '__main__':
+                raise ValueError('%s %s is defined in the __main__ script and cannot be loaded by MPI jobs; move it to an importable module '
+                    'and pass it as function or \'module:function\' string' % (key, getattr(f, '__name__', repr(f))))
+
+
+###############################################################################
+### Run single job (executed in worker process)
+###############################################################################
+def runJob (job):
+    from netpyne import sim
+
+    if not os.path.exists(job['runFolder']): os.makedirs(job['runFolder'])
+    netParams = NetParams(job['netParams'])
+    simConfig = SimConfig(job['simConfig'])
+    simConfig.filename = os.path.join(job['runFolder'], job['label'])
+
+    runFunc = resolveFunc(job.get('runFunc')) or sim.createSimulateAnalyze
+    runFunc(netParams=netParams, simConfig=simConfig)
+
+    if sim.rank == 0:
+        summaryFunc = resolveFunc(job.get('summaryFunc')) or defaultSummary
+        summary = {'label': job['label'], 'params': job['overrides'], 'summary': summaryFunc(sim)}
+        tmpPath = os.path.join(job['runFolder'], _summaryFile+'.tmp')
+        with open(tmpPath, 'w') as fileObj:
+            json.dump(summary, fileObj)
+        os.rename(tmpPath, os.path.join(job['runFolder'], _summaryFile))  # only exists once run completed
+
+    return job['label']
+
+
+def _runJobSafe (job):
+    try:
+        return runJob(job), None
+    except Exception as e:  # failed runs are reported but don't stop the batch
+        import traceback
+        traceback.print_exc()
+        return job['label'], repr(e)
+
+
+###############################################################################
+### Run job saved to file (used by MPI jobs)
+###############################################################################
+def runJobFromFile (filename):
+    with open(filename, 'rb') as fileObj:
+        job = pk.load(fileObj)
+    runJob(job)
+
+
+###############################################################################
+### Default summary of run
+###############################################################################
+def defaultSummary (sim):
+    numCells = len(sim.net.allCells) if hasattr(sim.net, 'allCells') else 0
+    numSpikes = len(sim.allSimData['spkt']) if hasattr(sim, 'allSimData') and 'spkt' in sim.allSimData else 0
+    avgRate = float(numSpikes) / numCells / (sim.cfg.duration/1000.0) if numCells else 0
+    return OrderedDict([('numCells', numCells), ('numSpikes', numSpikes), ('avgRate', avgRate), ('runTime', sim.timingData.get('runTime', 0))])
+
+
+###############################################################################
+### Launch each job as independent MPI process (at most 'processes' at the same time)
+###############################################################################
+def _runMPIJobs (jobs, mpiCommand, processes):
+    import subprocess
+    from time import sleep
+
+    for job in jobs: _checkMPIFuncs(job)  # before launching any job
+
+    running = []
+    for job in jobs:
+        if not os.path.exists(job['runFolder']): os.makedirs(job['runFolder'])
+        jobFile = os.path.join(job['runFolder'], 'job.pkl')
+        with open(jobFile, 'wb') as fileObj:
+            pk.dump(job, fileObj)
+        scriptFile = os.path.join(job['runFolder'], 'run.py')
+        with open(scriptFile, 'w') as fileObj:
+            fileObj.write('from netpyne.batch import runJobFromFile\nrunJobFromFile(%r)\n' % (jobFile))
+
+        while len(running) >= processes:  # wait for a free slot
+            sleep(1)
+            running = _pollMPIJobs(running)
+        with open(os.path.join(job['runFolder'], job['label']+'.run'), 'w') as outFile:
+            proc = subprocess.Popen(mpiCommand.split() + [scriptFile], stdout=outFile, stderr=subprocess.STDOUT)
+        running.append((job['label'], proc))
+
+    while running:
+        sleep(1)
+        running = _pollMPIJobs(running)
+
+
+def _pollMPIJobs (running):
+    stillRunning = []
+    for label, proc in running:
+        if proc.poll() is None:
+            stillRunning.append((label, proc))
+        elif proc.returncode:
+            print('  Run %s failed (exit code %d)' % (label, proc.returncode))
+        else:
+            print('  Finished %s' % (label))
+    return stillRunning
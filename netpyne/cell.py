@@ -8,6 +8,7 @@ Contributors: salvadordura@gmail.com
 
 from numbers import Number
 from copy import deepcopy
+from bisect import bisect_left
 from neuron import h # Import NEURON
 from specs import Dict
 import sim
@@ -75,6 +76,7 @@ class Cell (object):
                 self.createPyStruct(prop)
             if sim.cfg.createNEURONObj:
                 self.createNEURONObj(prop)  # add sections, mechanisms, synaptic mechanisms, geometry and topolgy specified by this property set
+        return bool(conditionsMet)  # whether cell was modified
 
 
     def createPyStruct (self, prop):
@@ -237,12 +239,7 @@ class Cell (object):
                 # set 3d geometry
                 if 'pt3d' in sectParams['geom']:  
                     h.pt3dclear(sec=sec['hSec'])
-                    x = self.tags['x']
-                    if 'ynorm' in self.tags and hasattr(sim.net.params, 'sizeY'):
-                        y = self.tags['ynorm'] * sim.net.params.sizeY/1e3  # y as a func of ynorm and cortical thickness
-                    else:
-                        y = self.tags['y']
-                    z = self.tags['z']
+                    x, y, z = self._getPosition()
                     for pt3d in sectParams['geom']['pt3d']:
                         h.pt3dadd(x+pt3d[0], y+pt3d[1], z+pt3d[2], pt3d[3], sec=sec['hSec'])
 
@@ -380,6 +377,7 @@ class Cell (object):
 
 
     def modifySynMechs (self, params):
+        modified = False
         conditionsMet = 1
         if 'cellConds' in params:
             if conditionsMet:
@@ -417,6 +415,7 @@ class Cell (object):
                                 break
 
                     if conditionsMet:  # if all conditions are met, set values for this cell
+                        modified = True
                         exclude = ['conds', 'cellConds', 'label', 'mod', 'selfNetCon', 'loc']
                         for synParamName,synParamValue in {k: v for k,v in params.iteritems() if k not in exclude}.iteritems():
                             if sim.cfg.createPyStruct: 
@@ -426,6 +425,7 @@ class Cell (object):
                                     setattr(synMech['hSyn'], synParamName, synParamValue)
                                 except:
                                     print 'Error setting %s=%s on synMech' % (synParamName, str(synParamValue))
+        return modified
 
 
     
@@ -594,6 +594,7 @@ class Cell (object):
 
 
     def modifyConns (self, params):
+        modified = False
         for conn in self.conns:
             conditionsMet = 1
             
@@ -637,6 +638,7 @@ class Cell (object):
                 print 'Warning: modifyConns() does not yet support conditions of presynaptic cells'
 
             if conditionsMet:  # if all conditions are met, set values for this cell
+                modified = True
                 if sim.cfg.createPyStruct:
                     for paramName, paramValue in {k: v for k,v in params.iteritems() if k not in ['conds','preConds','postConds']}.iteritems():
                         conn[paramName] = paramValue
@@ -649,9 +651,11 @@ class Cell (object):
                                 setattr(conn['hNetcon'], paramName, paramValue)
                         except:
                             print 'Error setting %s=%s on Netcon' % (paramName, str(paramValue))
+        return modified
 
 
     def modifyStims (self, params):
+        modified = False
         conditionsMet = 1
         if 'cellConds' in params:
             if conditionsMet:
@@ -685,6 +689,7 @@ class Cell (object):
                             break
 
                 if conditionsMet:  # if all conditions are met, set values for this cell
+                    modified = True
                     if stim['type'] == 'NetStim':  # for netstims, find associated netcon
                         conn = next((conn for conn in self.conns if conn['source'] == stim['source']), None)
                     if sim.cfg.createPyStruct:
@@ -701,10 +706,15 @@ class Cell (object):
                                         conn['hNetcon'].weight[0] = paramValue
                                     elif paramName in ['delay', 'threshold']:
                                         setattr(conn['hNetcon'], paramName, paramValue)
+                                    elif paramName == 'rate':
+                                        stim['hNetStim'].interval = paramValue**-1*1e3 # inverse of the frequency and then convert from Hz^-1 to ms
+                                    elif paramName in ['noise', 'start', 'number']:
+                                        setattr(stim['hNetStim'], paramName, paramValue)
                                 else:
                                     setattr(stim['h'+stim['type']], paramName, paramValue)
                             except:
                                 print 'Error setting %s=%s on stim' % (paramName, str(paramValue))
+        return modified
 
 
     def addNetStim (self, params, stimContainer=None):
@@ -965,64 +975,27 @@ class Cell (object):
     def recordTraces (self):
         # set up voltagse recording; recdict will be taken from global context
         for key, params in sim.cfg.recordTraces.iteritems():
-            conditionsMet = 1
-            if params.has_key('conds'):
-                for (condKey,condVal) in params['conds'].iteritems():  # check if all conditions are met
-                    if condKey=='popLabel':
-                        if condVal not in self.tags['popLabel']:
-                            conditionsMet = 0
-                            break
-                    elif isinstance(condVal, list) and isinstance(condVal[0], Number):
-                        if self.tags.get(condKey) < condVal[0] or self.tags.get(condKey) > condVal[1]:
-                            conditionsMet = 0
-                            break
-                    elif isinstance(condVal, list) and isinstance(condVal[0], str):
-                        if self.tags[condKey] not in condVal:
-                            conditionsMet = 0
-                            break 
-                    elif self.tags[condKey] != condVal: 
-                        conditionsMet = 0
-                        break
+            if params.get('aggregate'): continue  # recorded per population (see sim.setupRecording)
+            conditionsMet = self._traceConditionsMet(params)
             if conditionsMet:
                 try:
-                    ptr = None
-                    if 'loc' in params:
-                        if 'mech' in params:  # eg. soma(0.5).hh._ref_gna
-                            ptr = self.secs[params['sec']]['hSec'](params['loc']).__getattribute__(params['mech']).__getattribute__('_ref_'+params['var'])
-                        elif 'synMech' in params:  # eg. soma(0.5).AMPA._ref_g
-                            sec = self.secs[params['sec']]
-                            synMech = next((synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech'] and synMech['loc']==params['loc']), None)
-                            ptr = synMech['hSyn'].__getattribute__('_ref_'+params['var'])
-                        else:  # eg. soma(0.5)._ref_v
-                            ptr = self.secs[params['sec']]['hSec'](params['loc']).__getattribute__('_ref_'+params['var'])
-                    elif 'synMech' in params:  # special case where want to record from multiple synMechs
-                        if 'sec' in params:
-                            sec = self.secs[params['sec']]
-                            synMechs = [synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech']]
-                            ptr = [synMech['hSyn'].__getattribute__('_ref_'+params['var']) for synMech in synMechs]
-                            secLocs = [params.sec+str(synMech['loc']) for synMech in synMechs]
-                        else: 
-                            ptr = []
-                            secLocs = []
-                            for secName,sec in self.secs.iteritems():
-                                synMechs = [synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech']]
-                                ptr.extend([synMech['hSyn'].__getattribute__('_ref_'+params['var']) for synMech in synMechs])
-                                secLocs.extend([secName+'_'+str(synMech['loc']) for synMech in synMechs])
-
-                    else:
-                        if 'pointp' in params: # eg. soma.izh._ref_u
-                            if params['pointp'] in self.secs[params['sec']]['pointps']:
-                                ptr = self.secs[params['sec']]['pointps'][params['pointp']]['hPointp'].__getattribute__('_ref_'+params['var'])
-
+                    ptr, secLocs = self._getTracePtr(params)
+                    recordStep = sim.cfg.recordStep * params.get('decimate', 1)  # record every n-th sample 
                     if ptr:  # if pointer has been created, then setup recording
                         if isinstance(ptr, list):
                             sim.simData[key]['cell_'+str(self.gid)] = {}
                             for ptrItem,secLoc in zip(ptr, secLocs):
-                                sim.simData[key]['cell_'+str(self.gid)][secLoc] = h.Vector(sim.cfg.duration/sim.cfg.recordStep+1).resize(0)
-                                sim.simData[key]['cell_'+str(self.gid)][secLoc].record(ptrItem, sim.cfg.recordStep)
+                                sim.simData[key]['cell_'+str(self.gid)][secLoc] = h.Vector(sim.cfg.duration/recordStep+1).resize(0)
+                                sim.simData[key]['cell_'+str(self.gid)][secLoc].record(ptrItem, recordStep)
+                        elif params.get('envelope'):  # min and max within each recordStep (sampled every cfg.recordStep)
+                            envelope = Dict({'min': h.Vector(sim.cfg.duration/recordStep+1).resize(0), 'max': h.Vector(sim.cfg.duration/recordStep+1).resize(0)})
+                            buffer = h.Vector(params.get('decimate', 1)+1).resize(0)
+                            buffer.record(ptr, sim.cfg.recordStep)
+                            sim.simData[key]['cell_'+str(self.gid)] = envelope
+                            sim.traceEnvelopes.append(Dict({'buffer': buffer, 'min': envelope['min'], 'max': envelope['max'], 'step': recordStep}))
                         else:
-                            sim.simData[key]['cell_'+str(self.gid)] = h.Vector(sim.cfg.duration/sim.cfg.recordStep+1).resize(0)
-                            sim.simData[key]['cell_'+str(self.gid)].record(ptr, sim.cfg.recordStep)
+                            sim.simData[key]['cell_'+str(self.gid)] = h.Vector(sim.cfg.duration/recordStep+1).resize(0)
+                            sim.simData[key]['cell_'+str(self.gid)].record(ptr, recordStep)
                         if sim.cfg.verbose: print '  Recording ', key, 'from cell ', self.gid, ' with parameters: ',str(params)
                 except:
                     if sim.cfg.verbose: print '  Cannot record ', key, 'from cell ', self.gid
@@ -1030,6 +1003,94 @@ class Cell (object):
             #    if sim.cfg.verbose: print '  NOT recording ', key, 'from cell ', self.gid, ' with parameters: ',str(params)
 
 
+    def _traceConditionsMet (self, params):
+        conditionsMet = 1
+        if params.has_key('conds'):
+            for (condKey,condVal) in params['conds'].iteritems():  # check if all conditions are met
+                if condKey=='popLabel':
+                    if condVal not in self.tags['popLabel']:
+                        conditionsMet = 0
+                        break
+                elif isinstance(condVal, list) and isinstance(condVal[0], Number):
+                    if self.tags.get(condKey) < condVal[0] or self.tags.get(condKey) > condVal[1]:
+                        conditionsMet = 0
+                        break
+                elif isinstance(condVal, list) and isinstance(condVal[0], str):
+                    if self.tags[condKey] not in condVal:
+                        conditionsMet = 0
+                        break 
+                elif self.tags[condKey] != condVal: 
+                    conditionsMet = 0
+                    break
+        return conditionsMet
+
+
+    def _getTracePtr (self, params):
+        # returns pointer (or list of pointers) to variable to record, and list of sec locs if multiple pointers
+        ptr = None
+        secLocs = None
+        if 'loc' in params:
+            if 'mech' in params:  # eg. soma(0.5).hh._ref_gna
+                ptr = self.secs[params['sec']]['hSec'](params['loc']).__getattribute__(params['mech']).__getattribute__('_ref_'+params['var'])
+            elif 'synMech' in params:  # eg. soma(0.5).AMPA._ref_g
+                sec = self.secs[params['sec']]
+                synMech = next((synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech'] and synMech['loc']==params['loc']), None)
+                ptr = synMech['hSyn'].__getattribute__('_ref_'+params['var'])
+            else:  # eg. soma(0.5)._ref_v
+                ptr = self.secs[params['sec']]['hSec'](params['loc']).__getattribute__('_ref_'+params['var'])
+        elif 'synMech' in params:  # special case where want to record from multiple synMechs
+            if 'sec' in params:
+                sec = self.secs[params['sec']]
+                synMechs = [synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech']]
+                ptr = [synMech['hSyn'].__getattribute__('_ref_'+params['var']) for synMech in synMechs]
+                secLocs = [params.sec+str(synMech['loc']) for synMech in synMechs]
+            else: 
+                ptr = []
+                secLocs = []
+                for secName,sec in self.secs.iteritems():
+                    synMechs = [synMech for synMech in sec['synMechs'] if synMech['label']==params['synMech']]
+                    ptr.extend([synMech['hSyn'].__getattribute__('_ref_'+params['var']) for synMech in synMechs])
+                    secLocs.extend([secName+'_'+str(synMech['loc']) for synMech in synMechs])
+
+        else:
+            if 'pointp' in params: # eg. soma.izh._ref_u
+                if params['pointp'] in self.secs[params['sec']]['pointps']:
+                    ptr = self.secs[params['sec']]['pointps'][params['pointp']]['hPointp'].__getattribute__('_ref_'+params['var'])
+        return ptr, secLocs
+
+
+    def _getPosition (self):
+        x = self.tags['x']
+        if 'ynorm' in self.tags and hasattr(sim.net.params, 'sizeY'):
+            y = self.tags['ynorm'] * sim.net.params.sizeY/1e3  # y as a func of ynorm and cortical thickness
+        else:
+            y = self.tags['y']
+        z = self.tags['z']
+        return x, y, z
+
+
+    def _getSegmentLines (self):
+        # returns list of (segment, start point, end point, diam) of each segment, used to calculate LFP (line source approximation);
+        # segments of sections without 3d points are placed at the cell position (point source)
+        lines = []
+        position = self._getPosition()
+        for secName, sec in self.secs.iteritems():
+            hSec = sec.get('hSec')
+            if not hSec: continue
+            n3d = int(h.n3d(sec=hSec))
+            if n3d > 1:
+                arcs = [h.arc3d(i, sec=hSec) for i in range(n3d)]
+                pts = [(h.x3d(i, sec=hSec), h.y3d(i, sec=hSec), h.z3d(i, sec=hSec)) for i in range(n3d)]
+            for seg in hSec:
+                if n3d > 1:
+                    start = _interpolate3d(arcs, pts, (seg.x - 0.5/hSec.nseg) * arcs[-1])
+                    end = _interpolate3d(arcs, pts, (seg.x + 0.5/hSec.nseg) * arcs[-1])
+                else:
+                    start = end = position
+                lines.append((seg, start, end, seg.diam))
+        return lines
+
+
     def recordStimSpikes (self):
         sim.simData['stims'].update({'cell_'+str(self.gid): Dict()})
         for conn in self.conns:
@@ -1047,6 +1108,17 @@ class Cell (object):
 
 
 
+###############################################################################
+### Point at arc length 'arc' of section with 3d points 'pts' at arc lengths 'arcs'
+###############################################################################
+def _interpolate3d (arcs, pts, arc):
+    i = max(1, min(bisect_left(arcs, arc), len(arcs)-1))
+    if arcs[i] == arcs[i-1]: return pts[i]
+    frac = (arc - arcs[i-1]) / (arcs[i] - arcs[i-1])
+    return tuple([p0 + frac*(p1-p0) for p0,p1 in zip(pts[i-1], pts[i])])
+
+
+
 ###############################################################################
 #
 # POINT NEURON CLASS (v not from Section)
@@ -38,6 +38,9 @@ class Network (object):
         self.lid2gid = [] # Empty list for storing local index -> GID (index = local id; value = gid)
         self.gid2lid = {} # Empty dict for storing GID -> local index (key = gid; value = local id) -- ~x6 faster than .index() 
         self.lastGid = 0  # keep track of last cell gid 
+        self._connIndex = None  # index of NetCons used by getWeights/setWeights (built when first needed)
+        self._allCellTags = None  # tags of cells in all nodes (gathered when first needed)
+        self._allCellTagsNumCells = 0  # number of cells in this node when tags were gathered
 
 
 
@@ -71,25 +74,38 @@ class Network (object):
             sim.pc.barrier()
             if sim.rank==0 and sim.cfg.verbose: print('Instantiated %d cells of population %s'%(len(newCells), ipop.tags['popLabel']))    
         print('  Number of cells on node %i: %i ' % (sim.rank,len(self.cells))) 
+        self._allCellTags = None
         sim.pc.barrier()
         sim.timing('stop', 'createTime')
         if sim.rank == 0 and sim.cfg.timing: print('  Done; cell creation time = %0.2f s.' % sim.timingData['createTime'])
 
         return self.cells
     
+    ###############################################################################
+    # Return dict with tags of cells in all nodes; gathered once (compact columnar format) and cached until cells change
+    ###############################################################################
+    def _getAllCellTags (self):
+        if sim.nhosts == 1:
+            return {cell.gid: cell.tags for cell in self.cells}
+        
+        outdated = int(self._allCellTags is None or self._allCellTagsNumCells != len(self.cells))
+        if sim.pc.allreduce(outdated, 2):  # gather again if cells changed in any node 
+            self._allCellTags = sim._gatherAllCellTags()
+            self._allCellTagsNumCells = len(self.cells)
+        return self._allCellTags
+
+
     ###############################################################################
     #  Add stims
     ###############################################################################
     def addStims (self):
         sim.timing('start', 'stimsTime')
+        self._connIndex = None  # index of NetCons used by getWeights/setWeights
         if self.params.stimSourceParams and self.params.stimTargetParams:
             if sim.rank==0: 
                 print('Adding stims...')
                 
-            if sim.nhosts > 1: # Gather tags from all cells 
-                allCellTags = sim._gatherAllCellTags()  
-            else:
-                allCellTags = {cell.gid: cell.tags for cell in self.cells}
+            allCellTags = self._getAllCellTags()  # tags of cells in all nodes
             # allPopTags = {i: pop.tags for i,pop in enumerate(self.pops)}  # gather tags from pops so can connect NetStim pops
 
             sources = self.params.stimSourceParams
@@ -298,13 +314,11 @@ class Network (object):
     def connectCells (self):
         # Instantiate network connections based on the connectivity rules defined in params
         sim.timing('start', 'connectTime')
+        self._connIndex = None  # index of NetCons used by getWeights/setWeights
         if sim.rank==0: 
             print('Making connections...')
 
-        if sim.nhosts > 1: # Gather tags from all cells 
-            allCellTags = sim._gatherAllCellTags()  
-        else:
-            allCellTags = {cell.gid: cell.tags for cell in self.cells}
+        allCellTags = self._getAllCellTags()  # tags of cells in all nodes
         allPopTags = {-i: pop.tags for i,pop in enumerate(self.pops.values())}  # gather tags from pops so can connect NetStim pops
 
         for connParamLabel,connParamTemp in self.params.connParams.iteritems():  # for each conn rule or parameter set
@@ -704,15 +718,17 @@ class Network (object):
         if sim.rank==0: 
             print('Modfying cell parameters...')
 
-        for cell in self.cells:
-            cell.modify(params)
+        modifiedGids = [cell.gid for cell in self.cells if cell.modify(params)]
+        self._allCellTags = None
 
         if hasattr(sim.net, 'allCells'): 
-            sim._gatherCells()  # update allCells
+            sim._gatherCells(modifiedGids, ['secs', 'secLists'])  # update modified cells in allCells
 
         sim.timing('stop', 'modifyCellsTime')
         if sim.rank == 0 and sim.cfg.timing: print('  Done; cells modification time = %0.2f s.' % sim.timingData['modifyCellsTime'])
 
+        return modifiedGids
+
 
     ###############################################################################
     ### Modify synMech params
@@ -723,15 +739,16 @@ class Network (object):
         if sim.rank==0: 
             print('Modfying synaptic mech parameters...')
 
-        for cell in self.cells:
-            cell.modifySynMechs(params)
+        modifiedGids = [cell.gid for cell in self.cells if cell.modifySynMechs(params)]
 
         if hasattr(sim.net, 'allCells'): 
-            sim._gatherCells()  # update allCells
+            sim._gatherCells(modifiedGids, ['secs'])  # update modified cells in allCells
 
         sim.timing('stop', 'modifySynMechsTime')
         if sim.rank == 0 and sim.cfg.timing: print('  Done; syn mechs modification time = %0.2f s.' % sim.timingData['modifySynMechsTime'])
 
+        return modifiedGids
+
 
 
     ###############################################################################
@@ -743,15 +760,16 @@ class Network (object):
         if sim.rank==0: 
             print('Modfying connection parameters...')
 
-        for cell in self.cells:
-            cell.modifyConns(params)
+        modifiedGids = [cell.gid for cell in self.cells if cell.modifyConns(params)]
 
         if hasattr(sim.net, 'allCells'): 
-            sim._gatherCells()  # update allCells
+            sim._gatherCells(modifiedGids, ['conns'])  # update modified cells in allCells
 
         sim.timing('stop', 'modifyConnsTime')
         if sim.rank == 0 and sim.cfg.timing: print('  Done; connections modification time = %0.2f s.' % sim.timingData['modifyConnsTime'])
 
+        return modifiedGids
+
 
     ###############################################################################
     ### Modify stim source params
@@ -762,16 +780,109 @@ class Network (object):
         if sim.rank==0: 
             print('Modfying stimulation parameters...')
 
-        for cell in self.cells:
-            cell.modifyStims(params)
+        modifiedGids = [cell.gid for cell in self.cells if cell.modifyStims(params)]
 
         if hasattr(sim.net, 'allCells'): 
-            sim._gatherCells()  # update allCells
+            sim._gatherCells(modifiedGids, ['stims', 'conns'])  # update modified cells in allCells
 
         sim.timing('stop', 'modifyStimsTime')
         if sim.rank == 0 and sim.cfg.timing: print('  Done; stims modification time = %0.2f s.' % sim.timingData['modifyStimsTime'])
 
+        return modifiedGids
+
+
+
+    ###############################################################################
+    ### Get weights of NetCons matching selector as numpy array
+    ###############################################################################
+    def getWeights (self, selector = None):
+        ''' selector: dict of conditions on conn tags ([min, max] range or list of values allowed), eg. {'label': 'E->E'}; 
+        use 'postGid' for the postsynaptic cell gid, 'postConds' for a dict of postsynaptic cell tags, and 
+        'plastic': True to select only conns with STDP mechanism. Returns weights of conns in this node. '''
+        selection = self._connSelection(selector)
+        return array(h.netpyneGetWeights(selection['netcons']).as_numpy())
 
 
+    ###############################################################################
+    ### Set weights of NetCons matching selector from array (or single value)
+    ###############################################################################
+    def setWeights (self, selector, weights, updatePyStruct = True):
+        selection = self._connSelection(selector)
+        vec = h.Vector(int(selection['netcons'].count()))
+        vec.as_numpy()[:] = weights
+        h.netpyneSetWeights(selection['netcons'], vec)
+        if updatePyStruct and sim.cfg.createPyStruct:
+            for conn, weight in zip(selection['conns'], vec.to_python()):
+                conn['weight'] = weight
 
 
+    ###############################################################################
+    ### Call reward_punish(value) of STDP mechanisms of conns matching selector
+    ###############################################################################
+    def rewardPunish (self, value, selector = None):
+        selection = self._connSelection(selector)
+        h.netpyneRewardPunish(selection['stdps'], float(value))
+
+
+    ###############################################################################
+    ### Return hoc Lists of NetCons and STDP mechs matching selector (cached)
+    ###############################################################################
+    def _connSelection (self, selector = None):
+        connIndex = self._getConnIndex()
+        key = repr(sorted(selector.items())) if selector else None
+        if key not in connIndex['selections']:
+            selection = {'netcons': h.List(), 'stdps': h.List(), 'conns': []}
+            for cell, conn in connIndex['conns']:
+                if selector and not self._connMatches(cell, conn, selector): continue
+                selection['netcons'].append(conn['hNetcon'])
+                selection['conns'].append(conn)
+                if 'hSTDP' in conn: selection['stdps'].append(conn['hSTDP'])
+            connIndex['selections'][key] = selection
+        return connIndex['selections'][key]
+
+
+    ###############################################################################
+    ### Index of (cell, conn) with NetCons in this node (rebuilt if number of conns changes)
+    ###############################################################################
+    def _getConnIndex (self):
+        numConns = sum([len(cell.conns) for cell in self.cells])
+        if getattr(self, '_connIndex', None) is None or self._connIndex['numConns'] != numConns:
+            if not hasattr(h, 'netpyneGetWeights'):  # hoc functions for bulk access (much faster than python loops)
+                h('''
+                obfunc netpyneGetWeights() { local i  localobj vec
+                    vec = new Vector($o1.count())
+                    for i=0, $o1.count()-1 vec.x[i] = $o1.o(i).weight
+                    return vec
+                }
+                proc netpyneSetWeights() { local i
+                    for i=0, $o1.count()-1 $o1.o(i).weight = $o2.x[i]
+                }
+                proc netpyneRewardPunish() { local i
+                    for i=0, $o1.count()-1 $o1.o(i).reward_punish($2)
+                }
+                ''')
+            conns = [(cell, conn) for cell in self.cells for conn in cell.conns if conn.get('hNetcon')]
+            self._connIndex = {'numConns': numConns, 'conns': conns, 'selections': {}}
+        return self._connIndex
+
+
+    ###############################################################################
+    ### Check if conn matches selector conditions
+    ###############################################################################
+    def _connMatches (self, cell, conn, selector):
+        for condKey, condVal in selector.iteritems():
+            if condKey == 'postConds':
+                if not all([self._valueMatches(cell.tags.get(k), v) for k,v in condVal.iteritems()]): return False
+            elif condKey == 'plastic':
+                if bool(conn.get('hSTDP')) != bool(condVal): return False
+            else:
+                compareTo = cell.gid if condKey == 'postGid' else conn.get(condKey)
+                if not self._valueMatches(compareTo, condVal): return False
+        return True
+
+    def _valueMatches (self, value, condVal):
+        if isinstance(condVal, list) and condVal and isinstance(condVal[0], Number):
+            return value is not None and condVal[0] <= value <= condVal[1]
+        elif isinstance(condVal, list):
+            return value in condVal
+        return value == condVal
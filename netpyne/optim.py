@@ -0,0 +1,216 @@
+"""
+optim.py
+
+Evolutionary optimization of network parameters; candidates are evaluated in parallel using the batch module workers
+
+Usage:
+    from netpyne.optim import Evol
+
+    def fitness(simData):  # must be defined at module level
+        return abs(len(simData['spkt']) - 1000)  # error (lower is better)
+
+    evol = Evol(netParams, simConfig, params={'netParams.connParams.E->E.weight': [0.0001, 0.01]}, fitnessFunc=fitness)
+    best = evol.run(processes=16)
+
+    # with mpiCommand, fitnessFunc must be in an importable module (eg. myfitness.py), not in the script itself
+    evol = Evol(netParams, simConfig, params={'netParams.connParams.E->E.weight': [0.0001, 0.01]}, fitnessFunc='myfitness:fitness')
+    best = evol.run(mpiCommand='mpiexec -np 4 nrniv -python -mpi', processes=4)
+
+Contributors: salvadordura@gmail.com
+"""
+
+import os
+import random
+import cPickle as pk
+from collections import OrderedDict
+from time import time
+from batch import Batch, runJobs, loadRunSummary, resolveFunc
+
+
+###############################################################################
+### Evolutionary algorithm class
+###############################################################################
+class Evol (object):
+
+    def __init__(self, netParams, simConfig, params, fitnessFunc, popSize=20, maxGenerations=10, numElites=2, tournamentSize=3,
+        crossoverRate=0.8, mutationRate=0.2, mutationStd=0.1, minimize=True, seed=1, evolLabel='evol', saveFolder='evol_data'):
+        '''
+        netParams: base NetParams object or dict
+        simConfig: base SimConfig object or dict
+        params: dict of dotted paths to [min, max] range of values to optimize, eg. {'netParams.connParams.E->E.weight': [0.0001, 0.01]}
+        fitnessFunc: function that receives sim.allSimData and returns fitness value (needs to be defined at module level; with mpiCommand,
+            in an importable module); can also be a 'module:function' string
+        popSize: number of candidates in each generation
+        maxGenerations: number of generations
+        numElites: number of best candidates copied unchanged to next generation
+        tournamentSize: number of candidates compared to select each parent
+        crossoverRate: probability of blending the 2 parents (otherwise first parent is copied)
+        mutationRate: probability of mutating each param
+        mutationStd: standard deviation of gaussian mutation, relative to param range
+        minimize: whether lower fitness values are better (eg. error); else higher values are better
+        seed: seed for the random number generator of the algorithm
+        evolLabel: label used in run and checkpoint file names
+        saveFolder: folder where the output of each candidate and checkpoints are saved
+        '''
+        self.params = OrderedDict(sorted(params.items()))
+        self.fitnessFunc = fitnessFunc
+        self.popSize = popSize
+        self.maxGenerations = maxGenerations
+        self.numElites = numElites
+        self.tournamentSize = tournamentSize
+        self.crossoverRate = crossoverRate
+        self.mutationRate = mutationRate
+        self.mutationStd = mutationStd
+        self.minimize = minimize
+        self.evolLabel = evolLabel
+        self.saveFolder = saveFolder
+        self.batch = Batch(netParams, simConfig, batchLabel=evolLabel, saveFolder=saveFolder, summaryFunc=FitnessSummary(fitnessFunc))
+        self.rand = random.Random(seed)
+
+        self.generation = 0
+        self.population = []  # list of candidates (tuples of param values)
+        self.cache = {}  # fitness of each candidate evaluated so far
+        self.history = []  # best candidate and fitness of each generation
+
+
+    ###############################################################################
+    ### Run evolutionary algorithm (resumes from last checkpoint if available)
+    ###############################################################################
+    def run (self, processes=None, mpiCommand=None):
+        '''
+        processes: number of candidates evaluated at the same time (default: number of cores if mpiCommand is None, else 1)
+        mpiCommand: if set, each candidate is evaluated as an independent MPI job using this command, eg. 'mpiexec -np 4 nrniv -python -mpi'
+        Returns best candidate as dict of param paths and values, and its fitness.
+        '''
+        if not os.path.exists(self.saveFolder): os.makedirs(self.saveFolder)
+        if self.loadCheckpoint():
+            print('Evol %s: resuming from generation %d' % (self.evolLabel, self.generation))
+        else:
+            self.population = [self.randomCandidate() for i in range(self.popSize)]
+
+        while self.generation < self.maxGenerations:
+            start = time()
+            fitness = self.evaluate(self.population, processes, mpiCommand)
+            ranked = self.rank(self.population, fitness)
+            self.history.append(ranked[0])
+            print('Evol %s: generation %d; best fitness = %s; time = %0.2f s' % (self.evolLabel, self.generation, ranked[0][1], time()-start))
+
+            self.generation += 1
+            if self.generation < self.maxGenerations:
+                self.population = self.nextGeneration(ranked)
+            self.saveCheckpoint()
+
+        bestCandidate, bestFitness = min(self.history, key=lambda x: self._sortKey(x[1]))
+        return self.toOverrides(bestCandidate), bestFitness
+
+
+    ###############################################################################
+    ### Evaluate fitness of candidates not in cache
+    ###############################################################################
+    def evaluate (self, population, processes=None, mpiCommand=None):
+        jobs = []
+        labels = {}
+        for icand, candidate in enumerate(population):
+            if candidate in self.cache or candidate in labels: continue  # identical candidates evaluated only once
+            label = '%s_gen%d_cand%d' % (self.evolLabel, self.generation, icand)
+            runFolder = os.path.join(self.saveFolder, label)
+            labels[candidate] = runFolder
+            if loadRunSummary(runFolder) is not None: continue  # evaluated before interruption
+            overrides = self.toOverrides(candidate)
+            netParams, simConfig = self.batch.getRunSpecs(overrides)
+            jobs.append({'label': label, 'runFolder': runFolder, 'overrides': overrides, 'netParams': netParams, 'simConfig': simConfig,
+                'runFunc': None, 'summaryFunc': self.batch.summaryFunc})
+
+        print('Evol %s: generation %d; evaluating %d candidates (%d from cache)' % (self.evolLabel, self.generation, len(jobs),
+            len(population)-len(jobs)))
+        runJobs(jobs, processes, mpiCommand)
+
+        for candidate, runFolder in labels.iteritems():
+            summary = loadRunSummary(runFolder)
+            self.cache[candidate] = summary['summary']['fitness'] if summary else None  # None if run failed
+
+        return [self.cache[candidate] for candidate in population]
+
+
+    ###############################################################################
+    ### Return list of (candidate, fitness) sorted from best to worst
+    ###############################################################################
+    def rank (self, population, fitness):
+        return sorted(zip(population, fitness), key=lambda x: self._sortKey(x[1]))
+
+    def _sortKey (self, fitness):
+        if fitness is None: return float('inf')  # failed runs ranked last
+        return fitness if self.minimize else -fitness
+
+
+    ###############################################################################
+    ### Create next generation using elitism, tournament selection, blend crossover and gaussian mutation
+    ###############################################################################
+    def nextGeneration (self, ranked):
+        population = [candidate for candidate, fitness in ranked[:self.numElites]]
+        while len(population) < self.popSize:
+            parent1 = self.tournament(ranked)
+            parent2 = self.tournament(ranked)
+            if self.rand.random() < self.crossoverRate:
+                alpha = self.rand.random()
+                child = [alpha*v1 + (1-alpha)*v2 for v1,v2 in zip(parent1, parent2)]
+            else:
+                child = list(parent1)
+            population.append(self.mutate(child))
+        return population
+
+    def tournament (self, ranked):
+        indices = [self.rand.randrange(len(ranked)) for i in range(self.tournamentSize)]
+        return ranked[min(indices)][0]  # ranked is sorted from best to worst
+
+    def mutate (self, candidate):
+        for i, (minVal, maxVal) in enumerate(self.params.values()):
+            if self.rand.random() < self.mutationRate:
+                candidate[i] += self.rand.gauss(0, self.mutationStd*(maxVal-minVal))
+            candidate[i] = min(max(candidate[i], minVal), maxVal)
+        return tuple(candidate)
+
+    def randomCandidate (self):
+        return tuple([self.rand.uniform(minVal, maxVal) for minVal, maxVal in self.params.values()])
+
+    def toOverrides (self, candidate):
+        return OrderedDict(zip(self.params.keys(), candidate))
+
+
+    ###############################################################################
+    ### Save and load state of algorithm after each generation
+    ###############################################################################
+    def saveCheckpoint (self):
+        filename = os.path.join(self.saveFolder, self.evolLabel+'_checkpoint.pkl')
+        state = {'generation': self.generation, 'population': self.population, 'cache': self.cache, 'history': self.history,
+            'randState': self.rand.getstate(), 'params': self.params}
+        with open(filename+'.tmp', 'wb') as fileObj:
+            pk.dump(state, fileObj)
+        os.rename(filename+'.tmp', filename)
+
+    def loadCheckpoint (self):
+        filename = os.path.join(self.saveFolder, self.evolLabel+'_checkpoint.pkl')
+        if not os.path.exists(filename): return False
+        with open(filename, 'rb') as fileObj:
+            state = pk.load(fileObj)
+        if state['params'] != self.params:
+            print('Evol %s: params differ from checkpoint %s; starting new evolution' % (self.evolLabel, filename))
+            return False
+        self.generation = state['generation']
+        self.population = state['population']
+        self.cache = state['cache']
+        self.history = state['history']
+        self.rand.setstate(state['randState'])
+        return True
+
+
+###############################################################################
+### Summary function that computes fitness of run (executed in worker process)
+###############################################################################
+class FitnessSummary (object):
+
+    def __init__(self, fitnessFunc):
+        self.fitnessFunc = fitnessFunc
+
+    def __call__(self, sim):
+        return {'fitness': resolveFunc(self.fitnessFunc)(sim.allSimData)}
@@ -13,4 +13,5 @@ import analysis
 from network import Network
 from cell import Cell, PointNeuron
 from pop import Pop 
+from spikes import SpikeStore
 import utils
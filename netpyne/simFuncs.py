@@ -8,8 +8,12 @@ Contributors: salvadordura@gmail.com
 
 __all__ = []
 __all__.extend(['initialize', 'setNet', 'setNetParams', 'setSimCfg', 'createParallelContext', 'setupRecording', 'clearAll']) # init and setup
-__all__.extend(['runSim', 'runSimWithIntervalFunc', '_gatherAllCellTags', '_gatherCells', 'gatherData'])  # run and gather
-__all__.extend(['saveData', 'loadSimCfg', 'loadNetParams', 'loadNet', 'loadSimData', 'loadAll']) # saving and loading
+__all__.extend(['runSim', 'runSimWithIntervalFunc', 'addIntervalCallback', 'clearIntervalCallbacks', 'bcast', 'rerun', '_gatherAllCellTags', '_gatherCells', 'gatherData'])  # run and gather
+__all__.extend(['saveCheckpoint', 'restore', 'intervalSave'])  # checkpointing and saving at intervals
+__all__.extend(['addSpikeMonitor', 'getSpikeCounts'])  # online spike monitoring
+__all__.extend(['reducePopRates', 'reduceSpikeHist', 'reduceConnMatrix'])  # analysis data reduced across nodes (no gather)
+__all__.extend(['getSpikeStore', 'loadSpikeStore'])  # spikes indexed by gid and time
+__all__.extend(['saveData', 'loadSimCfg', 'loadNetParams', 'loadNet', 'loadSimData', 'loadAll', 'loadHDF5', 'loadDpk', 'loadLazy', 'loadNDJson', 'iterNDJson']) # saving and loading
 __all__.extend(['popAvgRates', 'id32', 'copyReplaceItemObj', 'clearObj', 'replaceItemObj', 'replaceNoneObj', 'replaceFuncObj', 'replaceDictODict', 'readArgs', 'getCellsList', 'cellByGid',\
 'timing',  'version', 'gitversion', 'loadBalance'])  # misc/utilities
 
@@ -21,8 +25,10 @@ import hashlib
 from numbers import Number
 from copy import copy
 from specs import Dict, ODict
-from collections import OrderedDict
+from spikes import SpikeStore
+from collections import OrderedDict, deque
 import math
+import numpy as np
 from neuron import h, init # Import NEURON
 try:
     import neuroml
@@ -55,6 +61,8 @@ def initialize (netParams = None, simConfig = None, net = None):
     sim.fih = []  # list of func init handlers
     sim.rank = 0  # initialize rank
     sim.timingData = Dict()  # dict to store timing
+    sim.intervalCallbacks = []  # functions called at intervals during the simulation
+    sim.spikeMonitors = Dict()  # online spike counters of groups of cells
 
     sim.createParallelContext()  # iniitalize PC, nhosts and rank
     
@@ -136,24 +144,30 @@ def loadNetParams (filename, data=None):
 # Load cells and pops from file and create NEURON objs
 ###############################################################################
 def loadNet (filename, data=None, instantiate=True):
-    if not data: data = _loadFile(filename)
+    if not data: data = _loadFile(filename, localCells=True)  # only reads cells of this node if file format allows it
     if 'net' in data and 'cells' in data['net'] and 'pops' in data['net']:
         sim.timing('start', 'loadNetTime')
         print('Loading net...')
         sim.net.allPops = data['net']['pops']
-        sim.net.allCells = data['net']['cells']
+        if data['net'].get('localCells'):
+            cellsLoad = data['net']['cells']
+            sim.net.allCells = cellsLoad  # only cells of this node were read; gatherData rebuilds allCells with cells of all nodes
+        else:
+            sim.net.allCells = data['net']['cells']
+            cellsLoad = _localCells(data['net']['cells'])  # each node only instantiates its own cells
         if instantiate:
             if sim.cfg.createPyStruct:
+                localGids = set([cellLoad['gid'] for cellLoad in cellsLoad])
                 for popLoadLabel, popLoad in data['net']['pops'].iteritems():
                     pop = sim.Pop(popLoadLabel, popLoad['tags'])
-                    pop.cellGids = popLoad['cellGids']
+                    pop.cellGids = [gid for gid in popLoad['cellGids'] if gid in localGids]
                     sim.net.pops[popLoadLabel] = pop
-                for cellLoad in data['net']['cells']:
+                for cellLoad in cellsLoad:
                     # create new Cell object and add attributes, but don't create sections or associate gid yet
                     cell = sim.Cell(gid=cellLoad['gid'], tags=cellLoad['tags'], create=False, associateGid=False)  
-                    cell.secs = cellLoad['secs']
-                    cell.conns = cellLoad['conns']
-                    cell.stims = cellLoad['stims']
+                    cell.secs = cellLoad.get('secs', {})
+                    cell.conns = cellLoad.get('conns', [])  # not included in HDF5 files saved without conns
+                    cell.stims = cellLoad.get('stims', [])
                     sim.net.cells.append(cell)
                 print('  Created %d cells' % (len(sim.net.cells)))
                 print('  Created %d connections' % (sum([len(c.conns) for c in sim.net.cells])))
@@ -171,6 +185,8 @@ def loadNet (filename, data=None, instantiate=True):
                     for cell in sim.net.cells:
                         cell.addStimsNEURONObj()  # add stims first so can then create conns between netstims
                         cell.addConnsNEURONObj()
+                    sim.net._connIndex = None  # index of NetCons used by getWeights/setWeights
+                    sim.net._allCellTags = None  # tags of cells in all nodes
 
                     print('  Added NEURON objects to %d cells' % (len(sim.net.cells)))
 
@@ -180,6 +196,68 @@ def loadNet (filename, data=None, instantiate=True):
         print('  netCells and/or netPops not found in file %s'%(filename))
 
 
+###############################################################################
+# Distribute cells loaded from file across nodes (round-robin by gid or balancing number of segments; see simConfig.loadPartition)
+###############################################################################
+def _localCells (cells):
+    if sim.nhosts == 1: return cells
+    if sim.cfg.loadPartition == 'balanced':
+        localGids = _balancedGids([(cell['gid'], _cellCost(cell)) for cell in cells])
+        return [cell for cell in cells if cell['gid'] in localGids]
+    return [cell for cell in cells if cell['gid'] % sim.nhosts == sim.rank]
+
+
+def _balancedGids (gidCosts):
+    # gids of this node when assigning largest cells first to least loaded node (same result in all nodes)
+    import heapq
+    nodes = [(0, inode) for inode in range(sim.nhosts)]
+    localGids = set()
+    for cost, gid in sorted([(-cost, gid) for gid, cost in gidCosts]):
+        nodeCost, inode = heapq.heappop(nodes)
+        if inode == sim.rank: localGids.add(gid)
+        heapq.heappush(nodes, (nodeCost - cost, inode))
+    return localGids
+
+
+def _cellCost (cell):
+    # number of segments of saved cell (1 if no sections)
+    return sum([sec.get('geom', {}).get('nseg', 1) for sec in cell.get('secs', {}).values()]) or 1
+
+
+###############################################################################
+# Read only cells of this node from HDF5 or dpk file (None if file format doesn't allow it)
+###############################################################################
+def _loadLocalCells (filename):
+    ext = filename.split('.')[-1]
+    balanced = sim.cfg.loadPartition == 'balanced'
+    if ext in ['hdf5', 'h5']:
+        import h5py, json
+        with h5py.File(filename, 'r') as fileObj:
+            if 'net' not in fileObj or 'cells' not in fileObj['net']: return []
+            table = fileObj['net/cells']
+            gids = table['_gid'].tolist()  # only reads gid column (and sections if balanced)
+            if balanced and '_secs' in table.dtype.names:
+                localGids = _balancedGids([(gid, _cellCost({'secs': json.loads(secs) if secs else {}})) for gid, secs in zip(gids, table['_secs'])])
+            elif balanced:
+                localGids = _balancedGids([(gid, 1) for gid in gids])
+            else:
+                localGids = [gid for gid in gids if gid % sim.nhosts == sim.rank]
+        if not localGids: return []
+        return loadHDF5(filename, include=['net'], gids=sorted(localGids))['net'].get('cells', [])
+
+    elif ext == 'dpk':
+        index = _dpkIndex(filename)
+        if 'net.cells' not in index['sections']: return []
+        with open(filename, 'rb') as fileObj:
+            cells = _LazyCells(fileObj, index['sections']['net.cells'], maxChunks=1)  # one chunk in memory at a time
+            if balanced: 
+                localGids = _balancedGids([(cell['gid'], _cellCost(cell)) for cell in cells])
+                return [cell for cell in cells if cell['gid'] in localGids]
+            return [cell for cell in cells if cell['gid'] % sim.nhosts == sim.rank]
+
+    return None
+
+
 ###############################################################################
 # Load simulation config from file
 ###############################################################################
@@ -212,7 +290,7 @@ def loadSimData (filename, data=None):
 # Load all data in file
 ###############################################################################
 def loadAll (filename, data=None):
-    if not data: data = _loadFile(filename)
+    if not data: data = _loadFile(filename, localCells=True)
     loadSimCfg(filename, data=data)
     loadNetParams(filename, data=data)
     loadNet(filename, data=data)
@@ -222,32 +300,47 @@ def loadAll (filename, data=None):
 ###############################################################################
 # Load data from file
 ###############################################################################
-def _loadFile (filename):
+def _loadFile (filename, localCells=False):
+    # localCells: with multiple nodes, only read cells of this node (see simConfig.loadPartition) from shards, HDF5 and dpk files 
     
     if sim.cfg.timing: sim.timing('start', 'loadFileTime')
-    ext = filename.split('.')[1]
+    ext = filename.split('.')[-1]
+    localCells = localCells and sim.nhosts > 1
+
+    # load sharded data (index file)
+    if ext == 'shards':
+        print('Loading sharded data %s ... ' % (filename))
+        data = _loadShards(filename, cellRanks=[sim.rank] if localCells and sim.cfg.loadPartition != 'balanced' else None)
+
+    # load only cells of this node from HDF5 or dpk file
+    elif localCells and ext in ['hdf5', 'h5', 'dpk']:
+        print('Loading file %s (cells of node %d) ... ' % (filename, sim.rank))
+        if ext == 'dpk': data = loadDpk(filename, sections=['netParams', 'simConfig', 'net.pops', 'simData'])
+        else: data = loadHDF5(filename, include=['netParams', 'simConfig', 'netPops', 'simData'])
+        if 'pops' in data.get('net', {}):
+            data['net'].update({'cells': _loadLocalCells(filename), 'localCells': True})
 
     # load pickle file
-    if ext == 'pkl':
+    elif ext == 'pkl':
         import pickle
         print('Loading file %s ... ' % (filename))
         with open(filename, 'r') as fileObj:
             data = pickle.load(fileObj)
 
-    # load dpk file
+    # load dpk file (use loadDpk directly to load only some sections)
     elif ext == 'dpk':
-        import gzip
         print('Loading file %s ... ' % (filename))
-        #fn=sim.cfg.filename #.split('.')
-        #gzip.open(fn, 'wb').write(pk.dumps(dataSave)) # write compressed string
-        print('NOT IMPLEMENTED!')
+        data = loadDpk(filename)
 
     # load json file
     elif ext == 'json':
-        import json
         print('Loading file %s ... ' % (filename))
-        with open(filename, 'r') as fileObj:
-            data = json.load(fileObj, object_pairs_hook=OrderedDict)
+        data = _loadJson(filename)
+
+    # load ndjson file
+    elif ext == 'ndjson':
+        print('Loading file %s ... ' % (filename))
+        data = loadNDJson(filename)
 
     # load mat file
     elif ext == 'mat':
@@ -256,13 +349,10 @@ def _loadFile (filename):
         #savemat(sim.cfg.filename+'.mat', replaceNoneObj(dataSave))  # replace None and {} with [] so can save in .mat format
         print('Finished saving!')
 
-    # load HDF5 file (uses very inefficient hdf5storage module which supports dicts)
-    elif ext == 'saveHDF5':
-        #dataSaveUTF8 = _dict2utf8(replaceNoneObj(dataSave)) # replace None and {} with [], and convert to utf
-        import hdf5storage
+    # load HDF5 file (use loadHDF5 directly to read a time range or subset of cells)
+    elif ext in ['hdf5', 'h5']:
         print('Loading file %s ... ' % (filename))
-        #hdf5storage.writes(dataSaveUTF8, filename=sim.cfg.filename+'.hdf5')
-        print('NOT IMPLEMENTED!')
+        data = loadHDF5(filename)
 
     # load CSV file (currently only saves spikes)
     elif ext == 'csv':
@@ -443,9 +533,9 @@ def replaceNoneObj (obj):
         for key,val in obj.iteritems():
             if type(val) in [list, dict, Dict, ODict]:
                 replaceNoneObj(val)
-            if val == None:
+            if val is None:
                 obj[key] = []
-            elif val == {}:
+            elif isinstance(val, dict) and len(val) == 0:
                 obj[key] = [] # also replace empty dicts with empty list
     return obj
 
@@ -520,6 +610,8 @@ def _dict2utf8 (obj):
     import collections
     if isinstance(obj, basestring):
         return obj.decode('utf8')
+    elif isinstance(obj, np.ndarray):
+        return obj
     elif isinstance(obj, collections.Mapping):
         for key in obj.keys():
             if isinstance(key, Number):
@@ -604,6 +696,9 @@ def setupRecording ():
             cell.recordStimSpikes()
 
     # intrinsic cell variables recording
+    sim.samplerFih = OrderedDict()  # init handlers of aggregate, envelope and LFP samplers (by label)
+    sim.traceEnvelopes = []  # traces recorded as min/max envelope
+    sim.traceAggregates = []  # traces aggregated per population 
     if sim.cfg.recordTraces:
         # get list of cells from argument of plotTraces function
         if 'plotTraces' in sim.cfg.analysis and 'include' in sim.cfg.analysis['plotTraces']:
@@ -616,19 +711,201 @@ def setupRecording ():
 
         for key in sim.cfg.recordTraces.keys(): sim.simData[key] = Dict()  # create dict to store traces
         for cell in cellsRecord: cell.recordTraces()  # call recordTraces function for each cell
+        _setupAggregateTraces()  # traces aggregated per population from all cells
+        _setupTraceSamplers()
+
+    # LFP recording
+    _setupLFP()
     
     timing('stop', 'setrecordTime')
 
     return sim.simData
 
 
+###############################################################################
+### Setup recording of traces aggregated (mean or sum) across all cells of each population 
+###############################################################################
+def _setupAggregateTraces ():
+    for key, params in sim.cfg.recordTraces.iteritems():
+        if not params.get('aggregate'): continue
+        if params['aggregate'] not in ['mean', 'sum']:
+            print('  Warning: unknown aggregate method %s for trace %s' % (params['aggregate'], key))
+            continue
+        for popLabel in sim.net.pops:  # same pops in all nodes so vectors can be reduced at gather 
+            ptrs = []
+            for cell in sim.net.cells:
+                if cell.tags['popLabel'] != popLabel or not cell._traceConditionsMet(params): continue
+                try:
+                    ptr, secLocs = cell._getTracePtr(params)
+                except:
+                    ptr = None
+                if ptr and not isinstance(ptr, list): ptrs.append(ptr)
+            
+            ptrVec = None
+            if ptrs:
+                ptrVec = h.PtrVector(len(ptrs))
+                for i, ptr in enumerate(ptrs): ptrVec.pset(i, ptr)
+            recordStep = sim.cfg.recordStep * params.get('decimate', 1)
+            sim.traceAggregates.append(Dict({'key': key, 'pop': popLabel, 'method': params['aggregate'], 'numCells': len(ptrs), 
+                'step': recordStep, 'vec': h.Vector(sim.cfg.duration/recordStep+1).resize(0), 'values': h.Vector(len(ptrs))}))
+            sim.traceAggregates[-1]['ptrVec'] = ptrVec
+            if sim.cfg.verbose: print '  Recording ', key, 'aggregated (%s) from %d cells of pop %s' % (params['aggregate'], len(ptrs), popLabel)
+
+
+###############################################################################
+### Schedule sampling of aggregated and envelope traces during the simulation
+###############################################################################
+def _setupTraceSamplers ():
+    for step in set([agg['step'] for agg in sim.traceAggregates]):
+        _scheduleSampler('aggregate_%g' % (step), _aggregateSampler, [agg for agg in sim.traceAggregates if agg['step'] == step], 0, step)
+    for step in set([env['step'] for env in sim.traceEnvelopes]):
+        _scheduleSampler('envelope_%g' % (step), _envelopeSampler, [env for env in sim.traceEnvelopes if env['step'] == step], step, step)
+
+
+def _scheduleSampler (label, sampler, items, start, step):
+    # one init handler per label; setting up a sampler again replaces the previous one (so samples are not recorded twice)
+    def event ():
+        sampler(items)
+        if h.t + step <= sim.cfg.duration + h.dt/2.0:
+            sim.cvode.event(h.t + step, event)
+    def init ():  # clear vectors (as done by NEURON for Vector.record) and schedule first sample
+        for item in items:
+            for vec in [item.get(k) for k in ['vec', 'buffer', 'min', 'max']]:
+                if vec is not None: vec.resize(0)
+            if 'index' in item: item['index'] = 0  # samples stored in preallocated arrays
+        sim.cvode.event(start, event)
+    if not hasattr(sim, 'samplerFih'): sim.samplerFih = OrderedDict()
+    sim.samplerFih[label] = h.FInitializeHandler(init)  # previous handler with same label is deleted
+
+
+def _aggregateSampler (aggregates):
+    for agg in aggregates:
+        if agg['ptrVec']:
+            agg['ptrVec'].gather(agg['values'])  # copy current values of all cells
+            agg['vec'].append(agg['values'].sum())
+        else:
+            agg['vec'].append(0)
+
+
+def _envelopeSampler (envelopes):
+    for env in envelopes:
+        if env['buffer'].size():
+            env['min'].append(env['buffer'].min())
+            env['max'].append(env['buffer'].max())
+            env['buffer'].resize(0)
+
+
+###############################################################################
+### Sum aggregated traces across nodes and add to simData of node 0
+###############################################################################
+def _reduceAggregateTraces ():
+    for agg in getattr(sim, 'traceAggregates', []):
+        vec = agg['vec'].c()
+        numCells = agg['numCells']
+        if sim.nhosts > 1:
+            sim.pc.allreduce(vec, 1)  # sum
+            numCells = sim.pc.allreduce(numCells, 1)
+        if sim.rank == 0 and numCells > 0:
+            if agg['method'] == 'mean': vec.div(numCells)
+            sim.simData[agg['key']]['pop_'+agg['pop']] = vec
+
+
+###############################################################################
+### Setup LFP recording: transfer coefficients from membrane current of each segment to each electrode
+###############################################################################
+def _setupLFP ():
+    sim.lfp = None
+    if not sim.cfg.recordLFP: return
+    sim.cfg.use_fast_imem = True  # membrane current (i_membrane_) of all segments required 
+    h.CVode().use_fast_imem(1)  # needs to be active to create pointers to i_membrane_
+
+    electrodes = np.array(sim.cfg.recordLFP, dtype=float).reshape(-1, 3)
+    popLines = OrderedDict([(popLabel, []) for popLabel in sim.net.pops])  # segments ordered by pop so each pop is a block of columns
+    for cell in sim.net.cells:
+        if cell.tags['popLabel'] in popLines: popLines[cell.tags['popLabel']].extend(cell._getSegmentLines())
+
+    lines = [line for popLabel in popLines for line in popLines[popLabel]]
+    transfer = np.zeros((len(electrodes), len(lines)))  # LFP (mV) at each electrode per nA of membrane current of each segment
+    ptrVec = h.PtrVector(len(lines)) if lines else None
+    for iseg, (seg, start, end, diam) in enumerate(lines):
+        transfer[:, iseg] = _lineSourceCoefs(electrodes, np.array(start), np.array(end), diam/2.0, sim.cfg.LFPsigma)
+        ptrVec.pset(iseg, seg._ref_i_membrane_)
+
+    popRanges = OrderedDict()
+    start = 0
+    for popLabel, popSegs in popLines.iteritems():
+        popRanges[popLabel] = (start, start+len(popSegs))
+        start += len(popSegs)
+
+    numSamples = int(round(sim.cfg.duration/sim.cfg.recordStep)) + 1
+    values = h.Vector(len(lines))
+    sim.lfp = Dict({'transfer': transfer, 'ptrVec': ptrVec, 'values': values, 'currents': values.as_numpy() if lines else None, 
+        'popRanges': popRanges, 'index': 0, 'data': np.zeros((numSamples, len(electrodes)))})
+    sim.lfp['popData'] = OrderedDict([(popLabel, np.zeros((numSamples, len(electrodes)))) for popLabel in popRanges]) if sim.cfg.saveLFPPops else None
+    _scheduleSampler('LFP', _LFPSampler, [sim.lfp], 0, sim.cfg.recordStep)
+    if sim.cfg.verbose: print '  Recording LFP at %d electrodes from %d segments' % (len(electrodes), len(lines))
+
+
+###############################################################################
+### Potential (mV) at electrodes per nA of current of a segment from start to end (line source); point source if start==end 
+###############################################################################
+def _lineSourceCoefs (electrodes, start, end, radius, sigma):
+    # 1/(4*pi*sigma) * integral of 1/distance along the segment, divided by its length; distances in um and sigma in S/m give mV/nA
+    length = np.linalg.norm(end - start)
+    rel = electrodes - start
+    if length < 1e-9:
+        dist = np.maximum(np.sqrt((rel**2).sum(axis=1)), radius)
+        return 1.0 / (4 * math.pi * sigma * dist)
+    axial = rel.dot((end - start) / length)  # distance along segment axis from start
+    radial = np.sqrt(np.maximum((rel**2).sum(axis=1) - axial**2, 0))
+    radial = np.maximum(radial, max(radius, 1e-3))  # electrode can't be inside the segment
+    return (np.arcsinh(axial/radial) - np.arcsinh((axial-length)/radial)) / (4 * math.pi * sigma * length)
+
+
+def _LFPSampler (lfps):
+    for lfp in lfps:
+        i = lfp['index']
+        if i >= len(lfp['data']): continue
+        if lfp['ptrVec']:
+            lfp['ptrVec'].gather(lfp['values'])  # membrane currents (nA) of all segments in this node
+            currents = lfp['currents']
+            if lfp['popData'] is not None:
+                lfp['data'][i] = 0
+                for popLabel, (start, end) in lfp['popRanges'].iteritems():
+                    lfp['popData'][popLabel][i] = lfp['transfer'][:, start:end].dot(currents[start:end])
+                    lfp['data'][i] += lfp['popData'][popLabel][i]
+            else:
+                lfp['data'][i] = lfp['transfer'].dot(currents)
+        lfp['index'] += 1
+
+
+###############################################################################
+### Sum LFP across nodes and add to simData of node 0 (as numpy arrays of shape (time, electrodes))
+###############################################################################
+def _reduceLFP ():
+    lfp = getattr(sim, 'lfp', None)
+    if not lfp: return
+    numSamples, numElectrodes = lfp['index'], lfp['data'].shape[1]
+    items = [(('LFP',), lfp['data'])]
+    if lfp['popData'] is not None:
+        items += [(('LFPPops', popLabel), data) for popLabel, data in lfp['popData'].iteritems()]
+        sim.simData['LFPPops'] = Dict()
+    for keys, data in items:
+        vec = h.Vector(data[:numSamples].ravel())
+        if sim.nhosts > 1: sim.pc.allreduce(vec, 1)  # sum
+        if sim.rank == 0:
+            data = np.array(vec.as_numpy()).reshape(numSamples, numElectrodes)
+            if len(keys) == 1: sim.simData[keys[0]] = data
+            else: sim.simData[keys[0]][keys[1]] = data
+
+
 ###############################################################################
 ### Get cells list for recording based on set of conditions
 ###############################################################################
 def getCellsList(include):
 
     if sim.nhosts > 1 and any(isinstance(cond, tuple) for cond in include): # Gather tags from all cells 
-        allCellTags = sim._gatherAllCellTags()  
+        allCellTags = sim.net._getAllCellTags()  
     else:
         allCellTags = {cell.gid: cell.tags for cell in sim.net.cells}
 
@@ -662,10 +939,28 @@ def getCellsList(include):
 ### Commands required just before running simulation
 ###############################################################################
 def preRun():
-    if sim.cfg.cache_efficient:
-        h('objref cvode')
-        h('cvode = new CVode()')
-        h.cvode.cache_efficient(0)
+    # threads (need to be set before cache_efficient)
+    sim.pc.nthread(sim.cfg.nthreads, 1)  
+    if sim.cfg.nthreads > 1 and sim.cfg.threadPartition == 'balanced':
+        _partitionThreads()
+
+    # integration method
+    sim.cvode = h.CVode()
+    sim.cvode.active(int(sim.cfg.cvode_active))
+    sim.cvode.use_local_dt(int(sim.cfg.cvode_active and sim.cfg.cvode_local))
+    if sim.cfg.cvode_active: sim.cvode.atol(sim.cfg.cvode_atol)
+    sim.cvode.cache_efficient(int(sim.cfg.cache_efficient))
+    sim.cvode.use_fast_imem(int(sim.cfg.use_fast_imem))
+
+    # spike exchange and event queue
+    spikeCompress = _setupSpikeExchange()
+
+    sim.runSettings = Dict({'nhosts': sim.nhosts, 'nthreads': int(sim.pc.nthread()), 'threadPartition': sim.cfg.threadPartition, 
+        'cache_efficient': int(sim.cvode.cache_efficient()), 'use_fast_imem': sim.cfg.use_fast_imem, 
+        'method': ('lvardt' if sim.cfg.cvode_local else 'cvode') if sim.cfg.cvode_active else 'fixed step (dt=%g ms)' % (sim.cfg.dt),
+        'spikeCompress': spikeCompress, 'queueMode': sim.cfg.queueMode, 'exchangeTimeStart': sim.pc.send_time() + sim.pc.wait_time()})
+    if sim.rank == 0 and sim.cfg.verbose: 
+        print('Run settings: %s' % (', '.join(['%s=%s' % (k,v) for k,v in sim.runSettings.iteritems()])))
 
     h.dt = sim.cfg.dt  # set time step
     for key,val in sim.cfg.hParams.iteritems(): setattr(h, key, val) # set other h global vars (celsius, clamp_resist)
@@ -673,6 +968,8 @@ def preRun():
     mindelay = sim.pc.allreduce(sim.pc.set_maxstep(10), 2) # flag 2 returns minimum value
     if sim.rank==0 and sim.cfg.verbose: print('Minimum delay (time-step for queue exchange) is %.2f'%(mindelay))
     
+    _resetSpikeMonitors()
+
     # reset all netstims so runs are always equivalent
     for cell in sim.net.cells:
         for stim in cell.stims:
@@ -681,6 +978,62 @@ def preRun():
                 stim['hRandom'].negexp(1)
 
 
+###############################################################################
+### Configure spike exchange compression and event queue 
+###############################################################################
+def _setupSpikeExchange ():
+    spikeCompress = None
+    if sim.cfg.spikeCompress:
+        params = sim.cfg.spikeCompress if isinstance(sim.cfg.spikeCompress, dict) else {}
+        nspike = params.get('nspike', 0)  # 0 = calculate optimal number of spikes per message
+        if 'gidCompress' in params:
+            gidCompress = int(params['gidCompress'])
+        else:  # send local gid indices (1 byte) instead of gids (4 bytes); requires <256 cells in every node (same value in all nodes)
+            gidCompress = int(sim.pc.allreduce(len(sim.net.cells), 2) < 256)
+        xchng = params.get('xchng', 0)  # exchange method (0 = allgather; >0 = multisend variants)
+        nspike = int(sim.pc.spike_compress(nspike, gidCompress, xchng))  # returns actual number of spikes per message
+        spikeCompress = Dict({'nspike': nspike, 'gidCompress': gidCompress, 'xchng': xchng})
+    else:
+        sim.pc.spike_compress(0, 0)  # no compression
+
+    if sim.cfg.queueMode:
+        params = sim.cfg.queueMode if isinstance(sim.cfg.queueMode, dict) else {}
+        binQueue = int(params.get('binQueue', True))  # fixed step bin queue (events delivered at dt boundaries)
+        selfQueue = int(params.get('selfQueue', False))  # separate queue for self events (eg. NetStims)
+        sim.cvode.queue_mode(binQueue, selfQueue)
+    else:
+        sim.cvode.queue_mode(0, 0)  # default queue (reset settings of previous runs)
+    
+    return spikeCompress
+
+
+###############################################################################
+### Distribute cells across threads balancing the total number of segments 
+###############################################################################
+def _partitionThreads ():
+    nthreads = int(sim.pc.nthread())
+    cellsCost = []
+    numNoSecs = 0
+    for cell in sim.net.cells:
+        hSecs = [sec['hSec'] for sec in cell.secs.values() if sec.get('hSec')]
+        if hSecs: cellsCost.append((sum([hSec.nseg for hSec in hSecs]), cell, hSecs))
+        else: numNoSecs += 1
+    if numNoSecs:  # eg. artificial cells; only sections can be assigned to threads with pc.partition
+        print('  Warning: %d cells on node %d have no sections and are not included in the balanced thread partition' % (numNoSecs, sim.rank))
+    
+    threadCost = [0] * nthreads
+    threadSecLists = [h.SectionList() for i in range(nthreads)]
+    for cost, cell, hSecs in sorted(cellsCost, key=lambda x: -x[0]):  # assign largest cells first to least loaded thread
+        ithread = threadCost.index(min(threadCost))
+        threadCost[ithread] += cost
+        rootSec = h.SectionRef(sec=hSecs[0]).root  # partition requires root section of each cell
+        threadSecLists[ithread].append(sec=rootSec)
+    
+    for ithread, secList in enumerate(threadSecLists):
+        sim.pc.partition(ithread, secList)
+    if sim.cfg.verbose: print('  Segments per thread on node %d: %s' % (sim.rank, threadCost))
+
+
 ###############################################################################
 ### Run Simulation
 ###############################################################################
@@ -689,59 +1042,463 @@ def runSim ():
     timing('start', 'runTime')
     preRun()
     init()
+    if sim.cfg.saveFileStep: _initIntervalSave()
 
     if sim.rank == 0: print('\nRunning...')
-    sim.pc.psolve(sim.cfg.duration)
+    _psolve(sim.cfg.duration)
     
     sim.pc.barrier() # Wait for all hosts to get to this point
     timing('stop', 'runTime')
-    if sim.rank==0: 
-        print('  Done; run time = %0.2f s; real-time ratio: %0.2f.' % 
-            (sim.timingData['runTime'], sim.cfg.duration/1000/sim.timingData['runTime']))
+    _printRunSummary(sim.cfg.duration)
 
 
 ###############################################################################
 ### Run Simulation
 ###############################################################################
 def runSimWithIntervalFunc (interval, func):
+    addIntervalCallback(func, interval, label='intervalFunc')
+    remainder = math.fmod(sim.cfg.duration, interval)
+    if h.dt/2.0 < remainder < interval - h.dt/2.0:  # also call at end of run if duration is not a multiple of interval
+        addIntervalCallback(func, sim.cfg.duration, start=sim.cfg.duration, label='intervalFuncEnd')
+    try:
+        runSim()
+    finally:
+        sim.intervalCallbacks = [cb for cb in sim.intervalCallbacks if cb['label'] not in ['intervalFunc', 'intervalFuncEnd']]
+
+
+###############################################################################
+### Add function to be called at intervals during the simulation
+###############################################################################
+def addIntervalCallback (func, interval, start = None, ranks = 'all', label = None):
+    ''' Call func(t) every 'interval' ms during runSim(), starting at 'start' ms (default: interval).
+    ranks: 'all' (called on all nodes; eg. if it exchanges data using sim.bcast()), int or list of ranks where it is called 
+    label: used to store total time spent in function in sim.timingData[label+'Time'] (default: function name)
+    '''
+    if not hasattr(sim, 'intervalCallbacks'): sim.intervalCallbacks = []
+    if label is None: label = func.__name__
+    sim.intervalCallbacks.append(Dict({'func': func, 'interval': float(interval), 'start': float(interval if start is None else start), 
+        'ranks': ranks, 'label': label}))
+    return label
+
+
+###############################################################################
+### Remove interval callbacks (all or with given label)
+###############################################################################
+def clearIntervalCallbacks (label = None):
+    sim.intervalCallbacks = [cb for cb in getattr(sim, 'intervalCallbacks', []) if label is not None and cb['label'] != label]
+
+
+###############################################################################
+### Broadcast python object from root node to all nodes
+###############################################################################
+def bcast (data = None, root = 0):
+    if sim.nhosts == 1: return data
+    return sim.pc.py_broadcast(data, root)
+
+
+###############################################################################
+### Add online spike counter for groups of cells 
+###############################################################################
+def addSpikeMonitor (groups, window = None, label = 'spikeMonitor'):
+    ''' Count spikes of groups of cells during the simulation, reading only the spikes recorded since the previous update.
+    groups: dict of group labels and list of cell gids, eg. {'EXT': [0,1,2], 'FLEX': [3,4,5]}
+    window: count spikes in the last 'window' ms (if None, count spikes since previous call to getSpikeCounts)
+    label: monitor label used in getSpikeCounts()
+    '''
+    if isinstance(groups, OrderedDict): groupLabels = groups.keys()
+    else: groupLabels = sorted(groups.keys())
+    localGids = set(sim.net.lid2gid)
+    gidGroups = {}  # group indices of each local gid 
+    for igroup, groupLabel in enumerate(groupLabels):
+        for gid in groups[groupLabel]:
+            if gid in localGids: gidGroups.setdefault(int(gid), []).append(igroup)
+
+    monitor = Dict({'groups': groupLabels, 'window': window, 'counts': [0]*len(groupLabels), 'offset': 0})
+    monitor['gidGroups'] = gidGroups  
+    monitor['spikes'] = deque()  # (time, group indices) of spikes in window 
+    monitor['vec'] = h.Vector(len(groupLabels))  # used to sum counts across nodes
+    monitor['offset'] = int(sim.simData['spkt'].size()) if 'spkt' in sim.simData else 0  # index of next spike to read
+    sim.spikeMonitors[label] = monitor
+    return label
+
+
+###############################################################################
+### Return spike counts of each group (summed across all nodes); needs to be called from all nodes 
+###############################################################################
+def getSpikeCounts (label = 'spikeMonitor'):
+    monitor = sim.spikeMonitors[label]
+    _updateSpikeMonitor(monitor)
+    counts = monitor['counts']
+    if monitor['window'] is not None:  # remove spikes outside window
+        spikes = monitor['spikes']
+        while spikes and spikes[0][0] <= h.t - monitor['window']:
+            for igroup in spikes.popleft()[1]: counts[igroup] -= 1
+        counts = list(counts)
+    else:
+        monitor['counts'] = [0]*len(counts)  # start new count
+    
+    if sim.nhosts > 1:
+        monitor['vec'].from_python(counts)
+        sim.pc.allreduce(monitor['vec'], 1)  # sum across nodes
+        counts = monitor['vec'].to_python()
+    return Dict(zip(monitor['groups'], counts))
+
+
+###############################################################################
+### Count spikes recorded since last update 
+###############################################################################
+def _updateSpikeMonitor (monitor):
+    numSpikes = int(sim.simData['spkt'].size())
+    if numSpikes <= monitor['offset']: return
+    spkts = sim.simData['spkt'].c(monitor['offset'], numSpikes-1).to_python()
+    spkids = sim.simData['spkid'].c(monitor['offset'], numSpikes-1).to_python()
+    monitor['offset'] = numSpikes
+
+    gidGroups, counts, spikes, window = monitor['gidGroups'], monitor['counts'], monitor['spikes'], monitor['window']
+    for spkt, spkid in zip(spkts, spkids):
+        groups = gidGroups.get(int(spkid))
+        if groups:
+            for igroup in groups: counts[igroup] += 1
+            if window is not None: spikes.append((spkt, groups))
+
+
+def _resetSpikeMonitors ():
+    for monitor in getattr(sim, 'spikeMonitors', {}).values():
+        monitor['counts'] = [0]*len(monitor['groups'])
+        monitor['spikes'].clear()
+        monitor['offset'] = int(sim.simData['spkt'].size()) if 'spkt' in sim.simData else 0
+
+
+###############################################################################
+### Re-run instantiated network with new seeds, conn or stim params 
+###############################################################################
+def rerun (changes = None):
+    ''' Apply changes to the existing network (keeping sections, synapses and NetCons) and run again.
+    changes: dict with any of the following keys:
+        'seeds': dict of new seeds, eg. {'stim': 2} (new Random123 stream ids for NetStims without a seed in netParams)
+        'conns': modifyConns params (dict or list of dicts), eg. {'conds': {'label': 'PYR->PYR'}, 'weight': 0.01}
+        'stims': modifyStims params (dict or list of dicts), eg. {'conds': {'source': 'bkg'}, 'rate': 20}
+    '''
+    if changes is None: changes = {}
+    timing('start', 'rerunSetupTime')
+
+    if 'seeds' in changes:
+        sim.cfg.seeds.update(changes['seeds'])
+        if 'stim' in changes['seeds']:
+            for cell in sim.net.cells:
+                for stim in cell.stims:
+                    if 'hRandom' in stim and not _stimSeedInParams(stim):  # seeds set in netParams are kept
+                        stim['seed'] = sim.cfg.seeds['stim']  # applied by preRun() via Random123 
+
+    # modify cells in this node directly (no need to gather cells)
+    for key, func in [('conns', 'modifyConns'), ('stims', 'modifyStims')]:
+        paramsList = changes.get(key, [])
+        for params in paramsList if isinstance(paramsList, list) else [paramsList]:
+            for cell in sim.net.cells:
+                getattr(cell, func)(params)
+
+    # reset recording vectors
+    for keys, vec in _simDataVectors(sim.simData):
+        vec.resize(0)
+    if hasattr(sim, 'allSimData'): del sim.allSimData
+
+    timing('stop', 'rerunSetupTime')
+    if sim.rank == 0 and sim.cfg.timing: print('  Done; rerun setup time = %0.2f s.' % sim.timingData['rerunSetupTime'])
+
+    runSim()
+
+
+def _stimSeedInParams (stim):
+    # NetStim seed given explicitly in its stimSourceParams or (NetStim pop) popParams, rather than taken from cfg.seeds
+    for params in [sim.net.params.stimSourceParams, sim.net.params.popParams]:
+        if 'seed' in params.get(stim.get('source'), {}): return True
+    return False
+
+
+###############################################################################
+### Print run time, run settings and spike exchange time 
+###############################################################################
+def _printRunSummary (simTime):
+    # time spent exchanging spikes (max across nodes) since preRun()
+    exchangeTime = sim.pc.allreduce(sim.pc.send_time() + sim.pc.wait_time() - sim.runSettings['exchangeTimeStart'], 2)
+    if sim.rank==0: 
+        print('  Done; run time = %0.2f s; real-time ratio: %0.2f.' % 
+            (sim.timingData['runTime'], simTime/1000/sim.timingData['runTime']))
+        if sim.cfg.timing: 
+            print('  Run settings: %d nodes x %d threads; %s; cache_efficient=%d; spike compression: %s' % 
+                (sim.nhosts, sim.runSettings['nthreads'], sim.runSettings['method'], sim.runSettings['cache_efficient'], 
+                sim.runSettings['spikeCompress'] if sim.runSettings['spikeCompress'] else 'off'))
+            if sim.nhosts > 1:
+                exchangeStr = '  Spike exchange time = %0.2f s (%0.1f%% of run time)' % (exchangeTime, 100.0*exchangeTime/sim.timingData['runTime'])
+                if 'spikeExchangeTime' in sim.timingData:  # compare with previous run
+                    prevTime = sim.timingData['spikeExchangeTime']
+                    exchangeStr += '; change vs previous run = %+0.2f s (%+0.1f%%)' % (exchangeTime-prevTime, 100.0*(exchangeTime-prevTime)/prevTime if prevTime else 0)
+                print(exchangeStr)
+            sim.timingData['spikeExchangeTime'] = exchangeTime
+            for cb in getattr(sim, 'intervalCallbacks', []):
+                if cb['label']+'Time' in sim.timingData:
+                    print('  Interval function %s: total time = %0.2f s' % (cb['label'], sim.timingData[cb['label']+'Time']))
+
+
+###############################################################################
+### Advance simulation to tstop, stopping to save checkpoints and interval data
+###############################################################################
+def _psolve (tstop, resume = False):
+    events = _intervalEvents(resume)
+    if not events:
+        sim.pc.psolve(tstop)
+        return
+
+    tol = h.dt/2.0
+    while True:
+        for event in events:  # call functions due at this time (in order: callbacks, interval save, checkpoint)
+            if event['next'] <= h.t + tol:
+                if event['run']:
+                    start = time()
+                    event['func'](h.t)
+                    if event['label']:  # total time spent in each callback
+                        event['totalTime'] += time() - start
+                        sim.timingData[event['label']+'Time'] = event['totalTime']
+                while event['next'] <= h.t + tol: event['next'] += event['interval']
+        if h.t >= tstop - tol: break
+        sim.pc.psolve(min([tstop]+[event['next'] for event in events]))  # only stop at next event due
+
+
+###############################################################################
+### List of functions to call at intervals during run, with time of next call
+###############################################################################
+def _intervalEvents (resume = False):
+    events = []
+    for cb in getattr(sim, 'intervalCallbacks', []):
+        ranks = cb['ranks']
+        run = ranks == 'all' or sim.rank in (ranks if isinstance(ranks, (list, tuple)) else [ranks])
+        events.append(Dict({'func': cb['func'], 'interval': cb['interval'], 'start': cb['start'], 'run': run, 'label': cb['label'], 
+            'totalTime': 0.0}))
+    if sim.cfg.saveFileStep: 
+        events.append(Dict({'func': intervalSave, 'interval': sim.cfg.saveFileStep, 'start': sim.cfg.saveFileStep, 'run': True, 'label': None}))
+    if sim.cfg.checkpointStep: 
+        _checkCheckpointSupported()  # fail before running instead of at first checkpoint
+        events.append(Dict({'func': lambda t: saveCheckpoint(), 'interval': sim.cfg.checkpointStep, 'start': sim.cfg.checkpointStep, 
+            'run': True, 'label': None}))
+
+    tol = h.dt/2.0
+    for event in events:
+        if event['start'] >= h.t - tol and not (resume and event['start'] <= h.t + tol):
+            event['next'] = event['start']
+        else:  # first call after current time (when resuming, calls at current time were done before checkpoint)
+            event['next'] = event['start'] + (math.floor((h.t - event['start'])/event['interval'] + 1e-6) + 1) * event['interval']
+    return events
+
+
+###############################################################################
+### Check if object is h.Vector
+###############################################################################
+def _isVector (obj):
+    return hasattr(obj, 'hname') and obj.hname().startswith('Vector')
+
+
+###############################################################################
+### List all h.Vectors in simData as (keys, vector) tuples (eg. (('v_soma', 'cell_1'), h.Vector))
+###############################################################################
+def _simDataVectors (simData):
+    vecs = []
+    for key,val in simData.iteritems():
+        if isinstance(val, dict):
+            for cell,val2 in val.iteritems():
+                if isinstance(val2, dict):
+                    vecs.extend([((key, cell, stim), val3) for stim,val3 in val2.iteritems() if _isVector(val3)])
+                elif _isVector(val2):
+                    vecs.append(((key, cell), val2))
+        elif _isVector(val):
+            vecs.append(((key,), val))
+    return vecs
+
+
+###############################################################################
+### Save checkpoint (NEURON state + recorded data + random streams) of each node
+###############################################################################
+def saveCheckpoint (checkpointDir = None):
+    import os
+    _checkCheckpointSupported()
+    if not checkpointDir: checkpointDir = sim.cfg.checkpointDir
+    if sim.rank == 0 and not os.path.exists(checkpointDir): 
+        os.makedirs(checkpointDir)
+    sim.pc.barrier()
+
+    # NEURON state (states of all mechanisms and event queue) 
+    stateFile = os.path.join(checkpointDir, 'node%d_state.dat' % (sim.rank))
+    ss = h.SaveState()
+    ss.save()
+    f = h.File()
+    f.wopen(stateFile+'.tmp')
+    ss.fwrite(f)  # also closes file
+
+    # Python state: recorded data and position of Random123 streams used by NetStims
+    pyState = {'t': h.t, 'rank': sim.rank, 'nhosts': sim.nhosts, 'randSeq': {}}
+    pyState['simData'] = {keys: vec.to_python() for keys,vec in _simDataVectors(sim.simData)}
+    for cell in sim.net.cells:
+        for istim,stim in enumerate(cell.stims):
+            if 'hRandom' in stim:
+                pyState['randSeq'][(cell.gid, istim)] = stim['hRandom'].seq()
+    if sim.cfg.saveFileStep:  # size of interval data file, so data saved after checkpoint can be discarded
+        pyState['intervalFileSize'] = os.path.getsize(_intervalSaveFilename())
+
+    pyFile = os.path.join(checkpointDir, 'node%d_data.pkl' % (sim.rank))
+    with open(pyFile+'.tmp', 'wb') as fileObj:
+        pk.dump(pyState, fileObj, protocol=pk.HIGHEST_PROTOCOL)
+
+    # only replace previous checkpoint once new files written in all nodes
+    sim.pc.barrier()
+    os.rename(stateFile+'.tmp', stateFile)
+    os.rename(pyFile+'.tmp', pyFile)
+    if sim.rank == 0: 
+        with open(os.path.join(checkpointDir, 'checkpoint.txt'), 'w') as fileObj:
+            fileObj.write('t=%f\nnhosts=%d\n' % (h.t, sim.nhosts))
+        if sim.cfg.verbose: print('  Saved checkpoint at t = %0.1f ms in %s' % (h.t, checkpointDir))
+
+
+###############################################################################
+### Restore simulation from checkpoint and continue run until sim.cfg.duration
+###############################################################################
+def restore (checkpointDir = None):
+    ''' Restores state saved with saveCheckpoint(); the network must have been created using the same 
+    netParams, simConfig and number of nodes as the run that was checkpointed'''
+    import os
+    if not checkpointDir: checkpointDir = sim.cfg.checkpointDir
+
+    _checkCheckpointSupported()
+    pyFile = os.path.join(checkpointDir, 'node%d_data.pkl' % (sim.rank))
+    with open(pyFile, 'rb') as fileObj:
+        pyState = pk.load(fileObj)
+    if pyState['nhosts'] != sim.nhosts:
+        raise Exception('Checkpoint in %s was saved using %d nodes but running on %d nodes' % (checkpointDir, pyState['nhosts'], sim.nhosts))
+
     sim.pc.barrier()
     timing('start', 'runTime')
     preRun()
     init()
-    if sim.rank == 0: print('\nRunning...')
 
-    while round(h.t) < sim.cfg.duration:
-        sim.pc.psolve(min(sim.cfg.duration, h.t+interval))
-        func(h.t) # function to be called at intervals
+    # NEURON state
+    ss = h.SaveState()
+    f = h.File()
+    f.ropen(os.path.join(checkpointDir, 'node%d_state.dat' % (sim.rank)))
+    ss.fread(f)
+    ss.restore()
+
+    # recorded data 
+    for keys,vec in _simDataVectors(sim.simData):
+        if keys in pyState['simData']:
+            vec.from_python(pyState['simData'][keys])
+    if sim.cfg.saveFileStep: _initIntervalSave(pyState.get('intervalFileSize', 0))
+    _resetSpikeMonitors()  # only count spikes after checkpoint
+
+    # position of Random123 streams
+    for cell in sim.net.cells:
+        for istim,stim in enumerate(cell.stims):
+            if (cell.gid, istim) in pyState['randSeq']:
+                stim['hRandom'].seq(pyState['randSeq'][(cell.gid, istim)])
+
+    if sim.rank == 0: print('\nRestored checkpoint at t = %0.1f ms; running...' % (h.t))
+    _psolve(sim.cfg.duration, resume=True)
 
     sim.pc.barrier() # Wait for all hosts to get to this point
     timing('stop', 'runTime')
-    if sim.rank==0: 
-        print('  Done; run time = %0.2f s; real-time ratio: %0.2f.' % 
-            (sim.timingData['runTime'], sim.cfg.duration/1000/sim.timingData['runTime']))
-                
+    _printRunSummary(sim.cfg.duration-pyState['t'])
+
 
 ###############################################################################
-### Gather tags from cells
+### Raise error if recording uses samplers whose buffers are not saved in checkpoints
 ###############################################################################
-def _gatherAllCellTags ():
-    data = [{cell.gid: cell.tags for cell in sim.net.cells}]*sim.nhosts  # send cells data to other nodes
-    gather = sim.pc.py_alltoall(data)  # collect cells data from other nodes (required to generate connections)
+def _checkCheckpointSupported ():
+    # LFP, aggregated and envelope traces are sampled by cvode events into python buffers that are not part of the checkpoint
+    if sim.cfg.recordLFP or getattr(sim, 'traceAggregates', None) or getattr(sim, 'traceEnvelopes', None):
+        raise Exception('Checkpoints are not supported with recordLFP or recordTraces using aggregate or envelope')
+
+
+###############################################################################
+### Filename where node saves data at intervals
+###############################################################################
+def _intervalSaveFilename ():
+    return '%s_intervalData/node%d.pkl' % (sim.cfg.filename, sim.rank)
+
+
+###############################################################################
+### Create (or truncate to fileSize) file where node saves data at intervals
+###############################################################################
+def _initIntervalSave (fileSize = 0):
+    import os
+    filename = _intervalSaveFilename()
+    if sim.rank == 0 and not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
     sim.pc.barrier()
-    allCellTags = {}
-    for dataNode in gather:         
-        allCellTags.update(dataNode)
+    with open(filename, 'ab') as fileObj:
+        fileObj.truncate(fileSize)
+
+
+###############################################################################
+### Append recorded spikes and traces to file and clear vectors (called every saveFileStep ms)
+###############################################################################
+def intervalSave (t = None):
+    timing('start', 'intervalSaveTime')
+    for monitor in sim.spikeMonitors.values(): _updateSpikeMonitor(monitor)  # count spikes before clearing vectors
+    vecs = _simDataVectors(sim.simData)
+    chunk = {'t': h.t, 'simData': {keys: vec.to_python() for keys,vec in vecs}}
+    with open(_intervalSaveFilename(), 'ab') as fileObj:
+        pk.dump(chunk, fileObj, protocol=pk.HIGHEST_PROTOCOL)
+    for keys,vec in vecs: 
+        vec.resize(0)
+    for monitor in sim.spikeMonitors.values(): monitor['offset'] = 0
     
-    # clean to avoid mem leaks
-    for node in gather: 
-        if node:
-            node.clear()
-            del node
-    for item in data:
-        if item: 
-            item.clear()
-            del item
+    if sim.rank == 0 and sim.cfg.timing: 
+        sim.timingData['intervalSaveTotalTime'] = sim.timingData.get('intervalSaveTotalTime', 0) + time() - sim.timingData['intervalSaveTime']
+        del sim.timingData['intervalSaveTime']
+    if sim.rank == 0 and sim.cfg.verbose: print('  Saved data at t = %0.1f ms' % (h.t))
+
+
+###############################################################################
+### Load data saved at intervals back into simData vectors (before gathering)
+###############################################################################
+def _mergeIntervalData ():
+    import os
+    filename = _intervalSaveFilename()
+    if not os.path.exists(filename): return
+
+    vecs = _simDataVectors(sim.simData)
+    merged = _readIntervalData([keys for keys,vec in vecs])
+    for keys,vec in vecs:  # prepend saved data to data recorded since last interval
+        merged[keys].extend(vec.to_python())
+        vec.from_python(merged[keys])
+        del merged[keys]
+    os.remove(filename)
+
+
+def _readIntervalData (keysList):
+    # data of each simData vector (keys as in _simDataVectors) saved to interval file so far (file and vectors are not modified)
+    import os
+    filename = _intervalSaveFilename()
+    data = {keys: [] for keys in keysList}
+    if not os.path.exists(filename): return data
+
+    with open(filename, 'rb') as fileObj:
+        while True:
+            try:
+                chunk = pk.load(fileObj)
+            except EOFError:
+                break
+            for keys,values in chunk['simData'].iteritems():
+                if keys in data: data[keys].extend(values)
+    return data
+
 
+###############################################################################
+### Gather tags from cells
+###############################################################################
+def _gatherAllCellTags ():
+    # tags of each node sent to all nodes as columnar table (numeric columns and category codes in a single buffer)
+    rows = _allgatherColumns([dict(cell.tags, gid=cell.gid) for cell in sim.net.cells])
+    allCellTags = {}
+    for row in rows:
+        allCellTags[row.pop('gid')] = row
     return allCellTags
 
 
@@ -754,8 +1511,12 @@ def gatherData ():
     if sim.rank==0: 
         print('\nGathering data...')
 
-    simDataVecs = ['spkt','spkid','stims']+sim.cfg.recordTraces.keys()
-    if sim.nhosts > 1:  # only gather if >1 nodes 
+    _completeSimData()
+    simDataVecs = _simDataVecKeys()
+    if sim.nhosts > 1 and sim.cfg.gatherMethod == 'arrays':  # numeric buffers and columnar cell data (no pickling of cells and Vectors)
+        _gatherDataArrays(simDataVecs)
+
+    elif sim.nhosts > 1:  # only gather if >1 nodes 
         netPopsCellGids = {popLabel: list(pop.cellGids) for popLabel,pop in sim.net.pops.iteritems()}
         nodeData = {'netCells': [c.__getstate__() for c in sim.net.cells], 'netPopsCellGids': netPopsCellGids, 'simData': sim.simData} 
         data = [None]*sim.nhosts
@@ -770,31 +1531,11 @@ def gatherData ():
             allPops = ODict()
             for popLabel,pop in sim.net.pops.iteritems(): allPops[popLabel] = pop.__getstate__() # can't use dict comprehension for OrderedDict
             allPopsCellGids = {popLabel: [] for popLabel in netPopsCellGids}
-            sim.allSimData = Dict()
-
-            for k in gather[0]['simData'].keys():  # initialize all keys of allSimData dict
-                sim.allSimData[k] = {}
-
-            # fill in allSimData taking into account if data is dict of h.Vector (code needs improvement to be more generic)
             for node in gather:  # concatenate data from each node
                 allCells.extend(node['netCells'])  # extend allCells list
                 for popLabel,popCellGids in node['netPopsCellGids'].iteritems():
                     allPopsCellGids[popLabel].extend(popCellGids)
-                    
-                for key,val in node['simData'].iteritems():  # update simData dics of dics of h.Vector 
-                    if key in simDataVecs:          # simData dicts that contain Vectors
-                        if isinstance(val,dict):                
-                            for cell,val2 in val.iteritems():
-                                if isinstance(val2,dict):       
-                                    sim.allSimData[key].update(Dict({cell:Dict()}))
-                                    for stim,val3 in val2.iteritems():
-                                        sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
-                                else:
-                                    sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
-                        else:                                   
-                            sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                    else: 
-                        sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
+            sim.allSimData = _combineSimData([node['simData'] for node in gather], simDataVecs)
 
             sim.net.allCells =  sorted(allCells, key=lambda k: k['gid']) 
             
@@ -820,23 +1561,7 @@ def gatherData ():
             sim.net.allCells = [c.__dict__ for c in sim.net.cells]
         sim.net.allPops = ODict()
         for popLabel,pop in sim.net.pops.iteritems(): sim.net.allPops[popLabel] = pop.__getstate__() # can't use dict comprehension for OrderedDict
-        sim.allSimData = Dict() 
-        for k in sim.simData.keys():  # initialize all keys of allSimData dict
-                sim.allSimData[k] = Dict()
-        for key,val in sim.simData.iteritems():  # update simData dics of dics of h.Vector 
-                if key in simDataVecs:          # simData dicts that contain Vectors
-                    if isinstance(val,dict):                
-                        for cell,val2 in val.iteritems():
-                            if isinstance(val2,dict):       
-                                sim.allSimData[key].update(Dict({cell:Dict()}))
-                                for stim,val3 in val2.iteritems():
-                                    sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
-                            else:
-                                sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
-                    else:                                   
-                        sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                else: 
-                    sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
+        sim.allSimData = _combineSimData([sim.simData], simDataVecs)
 
     ## Print statistics
     if sim.rank == 0:
@@ -868,27 +1593,414 @@ def gatherData ():
 
 
 ###############################################################################
-### Calculate and print avg pop rates
+### Add data saved to file during simulation and data reduced across nodes (aggregated traces, LFP) to simData
 ###############################################################################
-def popAvgRates(trange = None, show = True):
+def _completeSimData ():
+    if sim.cfg.saveFileStep: _mergeIntervalData()  # load data saved to file during simulation
+    _reduceAggregateTraces()  # traces aggregated per population 
+    _reduceLFP()
+
+
+def _simDataVecKeys ():
+    # simData keys that contain Vectors or arrays (concatenated or merged across nodes)
+    return ['spkt','spkid','stims','LFP','LFPPops']+sim.cfg.recordTraces.keys()
+
+
+###############################################################################
+### Combine simData of each node converting h.Vectors to numpy arrays
+###############################################################################
+def _combineSimData (nodesSimData, simDataVecs):
+    allSimData = Dict()
+    for simData in nodesSimData:  # initialize all keys of allSimData dict
+        for k in simData.keys(): allSimData.setdefault(k, Dict())
+
+    vecParts = {}  # arrays of each node for simData that are Vectors (eg. spkt), concatenated at the end
+    for simData in nodesSimData:
+        for key,val in simData.iteritems():  # update simData dics of dics of h.Vector 
+            if key in simDataVecs:          # simData dicts that contain Vectors
+                if isinstance(val,dict):                
+                    for cell,val2 in val.iteritems():
+                        if isinstance(val2,dict):       
+                            allSimData[key].update(Dict({cell:Dict()}))
+                            for stim,val3 in val2.iteritems():
+                                allSimData[key][cell].update({stim:_vecToArray(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                        else:
+                            allSimData[key].update({cell:_vecToArray(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                else:                                   
+                    vecParts.setdefault(key, []).append(_vecToArray(val)) # udpate simData dicts which are Vectors
+            else: 
+                allSimData[key].update(val)           # update simData dicts which are not Vectors
+
+    for key, parts in vecParts.iteritems():
+        allSimData[key] = np.concatenate(parts)
+    return allSimData
+
+
+###############################################################################
+### Copy h.Vector to numpy array (single memory copy, no python floats)
+###############################################################################
+def _vecToArray (vec):
+    if _isVector(vec): 
+        return np.array(vec.as_numpy())
+    return np.array(vec)
+
+
+###############################################################################
+### Convert numpy arrays and scalars to lists/floats when saving to json
+###############################################################################
+def _jsonDefault (obj):
+    if hasattr(obj, 'tolist'): 
+        return obj.tolist()
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+
+###############################################################################
+### Gather cells and simData to node 0 as numeric buffers: spikes, traces and columnar cell data 
+###############################################################################
+def _gatherDataArrays (simDataVecs):
+    include = sim.cfg.gatherCells or []
+
+    # cell data (tags and conns as columns; other cell data only if requested)
+    cellRows = [dict(cell.tags, gid=cell.gid) if 'tags' in include else {'gid': cell.gid, 'popLabel': cell.tags['popLabel']} 
+        for cell in sim.net.cells]
+    cellRows = _gatherColumns(cellRows)
+    connRows = _gatherColumns([dict(copyReplaceItemObj(conn, keystart='h', newval=None), postGid=cell.gid) 
+        for cell in sim.net.cells for conn in cell.conns]) if 'conns' in include else []
+    otherKeys = [key for key in include if key not in ['tags', 'conns']]
+    otherRows = _gatherColumns([dict([(key, copyReplaceItemObj(getattr(cell, key, {}), keystart='h', newval=None)) for key in otherKeys], 
+        gid=cell.gid) for cell in sim.net.cells]) if otherKeys else []
+
+    # spikes and recorded Vectors (concatenated in a single buffer per node)
+    spkt = _gatherVector(sim.simData['spkt'])
+    spkid = _gatherVector(sim.simData['spkid'])
+    vecs = [(keys, vec) for keys, vec in _simDataVectors(sim.simData) if keys[0] in simDataVecs and keys[0] not in ['spkt', 'spkid']]
+    buffer = h.Vector(sum([vec.size() for keys, vec in vecs]) or 1).resize(0)
+    for keys, vec in vecs: buffer.append(vec)
+    layouts = _gatherObject([(keys, int(vec.size())) for keys, vec in vecs])  # keys and length of each Vector (small)
+    data = _gatherVector(buffer)
+    others = _gatherObject({key: val for key, val in sim.simData.iteritems() if key not in simDataVecs})  # non-Vector data 
+
+    if sim.rank == 0:
+        allSimData = Dict()
+        for key in sim.simData: allSimData[key] = Dict()
+        for nodeOthers in others:
+            for key, val in nodeOthers.iteritems(): allSimData.setdefault(key, Dict()).update(val)
+        allSimData['spkt'] = _vecToArray(spkt)
+        allSimData['spkid'] = _vecToArray(spkid)
+        data = _vecToArray(data)
+        offset = 0
+        for layout in layouts:
+            for keys, size in layout:
+                value = data[offset:offset+size]
+                offset += size
+                if len(keys) == 1: allSimData[keys[0]] = value
+                elif len(keys) == 2: allSimData[keys[0]][keys[1]] = value
+                else: allSimData[keys[0]].setdefault(keys[1], Dict())[keys[2]] = value
+        for key, val in sim.simData.iteritems():  # arrays reduced to node 0 (eg. LFP)
+            if isinstance(val, np.ndarray): allSimData[key] = val
+            elif isinstance(val, dict): allSimData[key].update({k: v for k,v in val.iteritems() if isinstance(v, np.ndarray)})
+        sim.allSimData = allSimData
+
+        # rebuild allCells and pops cellGids
+        allCells = {}
+        popLabels = {}
+        for row in cellRows:
+            gid = row.pop('gid')
+            popLabels[gid] = row.get('popLabel')
+            allCells[gid] = {'gid': gid, 'tags': row if 'tags' in include else {}, 'conns': []}
+        for row in connRows: 
+            allCells[row.pop('postGid')]['conns'].append(row)
+        for row in otherRows:
+            allCells[row.pop('gid')].update(row)
+        sim.net.allCells = [allCells[gid] for gid in sorted(allCells)]
+
+        allPops = ODict()
+        for popLabel,pop in sim.net.pops.iteritems(): allPops[popLabel] = pop.__getstate__() # can't use dict comprehension for OrderedDict
+        for popLabel in allPops: allPops[popLabel]['cellGids'] = []
+        for gid in sorted(allCells):
+            if popLabels[gid] in allPops: allPops[popLabels[gid]]['cellGids'].append(gid)
+        sim.net.allPops = allPops
+
+
+###############################################################################
+### Gather Vector of each node to node 0, concatenated in rank order (Vector alltoall; no pickling)
+###############################################################################
+def _gatherVector (vec):
+    counts = h.Vector(sim.nhosts)
+    counts.x[0] = vec.size()  # all data sent to node 0
+    dest = h.Vector()
+    sim.pc.alltoall(vec, counts, dest)
+    return dest
+
+
+###############################################################################
+### Send Vector of each node to all nodes, concatenated in rank order (Vector alltoall; no pickling)
+###############################################################################
+def _allgatherVector (vec):
+    counts = h.Vector(sim.nhosts).fill(vec.size())
+    src = h.Vector(vec.size()*sim.nhosts).resize(0)
+    for i in range(sim.nhosts): src.append(vec)  # same data sent to each node
+    dest = h.Vector()
+    sim.pc.alltoall(src, counts, dest)
+    return dest
+
+
+###############################################################################
+### Gather (small) python object of each node to node 0; returns list of objects in node 0
+###############################################################################
+def _gatherObject (obj):
+    data = [None]*sim.nhosts
+    data[0] = obj
+    gather = sim.pc.py_alltoall(data)
+    return gather if sim.rank == 0 else []
+
+
+###############################################################################
+### Gather list of dicts (rows) of each node to node 0 using columnar encoding 
+###############################################################################
+def _gatherColumns (rows):
+    schema, data = _encodeColumns(rows)
+    schemas = _gatherObject(schema)  # column names, categories and non-numeric values 
+    data = _gatherVector(h.Vector(data) if len(data) else h.Vector())  # numeric columns and category codes
+    allRows = []
+    if sim.rank == 0:
+        data = _vecToArray(data)
+        offset = 0
+        for schema in schemas:
+            allRows.extend(_decodeColumns(schema, data[offset:offset+schema['size']]))
+            offset += schema['size']
+    return allRows
+
+
+###############################################################################
+### Send list of dicts (rows) of each node to all nodes using columnar encoding 
+###############################################################################
+def _allgatherColumns (rows):
+    schema, data = _encodeColumns(rows)
+    schemas = sim.pc.py_allgather(schema)  # column names, categories and non-numeric values 
+    data = _vecToArray(_allgatherVector(h.Vector(data) if len(data) else h.Vector()))  # numeric columns and category codes
+    allRows = []
+    offset = 0
+    for schema in schemas:
+        allRows.extend(_decodeColumns(schema, data[offset:offset+schema['size']]))
+        offset += schema['size']
+    return allRows
+
+
+###############################################################################
+### Encode list of dicts as columns: numeric values, codes of categories (str, bool, None, etc), or list of other objects
+###############################################################################
+def _encodeColumns (rows):
+    numRows = len(rows)
+    keys = sorted(set([key for row in rows for key in row]))
+    columns = []
+    parts = []
+    for key in keys:
+        present = [key in row for row in rows]
+        values = [row.get(key) for row in rows]
+        missing = not all(present)
+        presentValues = [val for val, isPresent in zip(values, present) if isPresent] if missing else values
+
+        if all([isinstance(val, Number) and not isinstance(val, bool) for val in presentValues]):
+            isInt = all([isinstance(val, (int, long)) for val in presentValues])
+            columns.append((key, 'num', isInt, missing))
+            parts.append(np.array([0 if val is None else val for val in values], dtype=float))
+        else:
+            try:
+                index = OrderedDict()
+                codes = [index.setdefault((type(val), val), len(index)) for val in values]
+                columns.append((key, 'cat', [val for valType, val in index], missing))
+                parts.append(np.array(codes, dtype=float))
+            except TypeError:  # unhashable (eg. dict, list)
+                columns.append((key, 'obj', values, missing))
+        if missing: parts.append(np.array(present, dtype=float))
+
+    data = np.concatenate(parts) if parts else np.zeros(0)
+    return {'numRows': numRows, 'columns': columns, 'size': len(data)}, data
+
+
+def _decodeColumns (schema, data):
+    numRows = schema['numRows']
+    rows = [{} for i in range(numRows)]
+    offset = 0
+    for key, kind, extra, missing in schema['columns']:
+        if kind == 'obj': 
+            values = extra
+        else:
+            column = data[offset:offset+numRows]
+            offset += numRows
+            if kind == 'num': values = [int(val) for val in column] if extra else column.tolist()
+            else: values = [extra[int(code)] for code in column]
+        if missing:
+            present = data[offset:offset+numRows]
+            offset += numRows
+            for row, val, isPresent in zip(rows, values, present):
+                if isPresent: row[key] = val
+        else:
+            for row, val in zip(rows, values): row[key] = val
+    return rows
+
+
+###############################################################################
+### Spikes of sim.allSimData indexed by gid and time (SpikeStore); rebuilt only if spikes changed
+###############################################################################
+def getSpikeStore ():
     if not hasattr(sim, 'allSimData') or 'spkt' not in sim.allSimData:
         print 'Error: sim.allSimData not available; please call sim.gatherData()'
         return None
 
-    spkts = sim.allSimData['spkt']
-    spkids = sim.allSimData['spkid']
+    spkt = sim.allSimData['spkt']
+    if getattr(sim, '_spikeStoreSrc', None) is not spkt or sim._spikeStoreLen != len(spkt):  # keeps reference so id is not reused
+        sim._spikeStore = SpikeStore(spkt, sim.allSimData['spkid'])
+        sim._spikeStoreSrc, sim._spikeStoreLen = spkt, len(spkt)
+    return sim._spikeStore
+
+
+###############################################################################
+### Load SpikeStore from .npz or HDF5 file (eg. saved with simConfig.saveSpikeStore)
+###############################################################################
+def loadSpikeStore (filename):
+    print('Loading spikes from %s ... ' % (filename))
+    return SpikeStore.load(filename)
+
+
+###############################################################################
+### Analysis data calculated from the spikes and conns of each node and summed across nodes (must be called from all nodes)
+###############################################################################
+def reducePopRates (trange = None, show = True):
+    ''' Returns Dict with avg firing rate (Hz) of each pop (in all nodes) '''
+    if not trange: trange = [0, sim.cfg.duration]
+    pops = _cellPops()
+    spkt, popInds = _localSpikePops(pops)
+    inRange = (spkt >= trange[0]) & (spkt <= trange[1]) & (popInds >= 0)
+    counts = np.bincount(popInds[inRange], minlength=len(pops)).astype(float)
+    counts, numCells = _allreduceArray(np.vstack([counts, _localPopCounts(pops)]))
+
+    avgRates = Dict()
+    tsecs = float((trange[1]-trange[0]))/1000.0
+    for ipop, pop in enumerate(pops):
+        if numCells[ipop] > 0:
+            avgRates[pop] = counts[ipop]/numCells[ipop]/tsecs
+            if show and sim.rank == 0: print '%s : %.3f Hz'%(pop, avgRates[pop])
+    return avgRates
+
+
+def reduceSpikeHist (binSize = 5, timeRange = None):
+    ''' Returns dict with 'binCenters', spike 'counts' per bin (ODict of arrays) and 'numCells' of each pop and of 'allCells' 
+    (same bins as analysis.plotSpikeHist; can be passed to plotSpikeHist as spikeHistData) '''
+    if timeRange is None: timeRange = [0, sim.cfg.duration]
+    pops = _cellPops()
+    stimPops = [pop for pop in sim.net.pops if pop not in pops]  # NetStim pops (spikes recorded in simData['stims'])
+    spkt, popInds = _localSpikePops(pops)
+    bins = np.arange(timeRange[0], timeRange[1], binSize)
+    hist = np.zeros((len(pops)+len(stimPops), max(len(bins)-1, 0)))
+    numCells = np.zeros(len(pops)+len(stimPops))
+    for ipop in range(len(pops)):
+        hist[ipop] = np.histogram(spkt[popInds == ipop], bins=bins)[0]
+    numCells[:len(pops)] = _localPopCounts(pops)
+    for istim, pop in enumerate(stimPops):
+        cellStims = [cellStim[pop] for cellStim in sim.simData.get('stims', {}).values() if pop in cellStim]
+        stimSpikes = np.concatenate([_vecToArray(vec) for vec in cellStims]) if cellStims else np.zeros(0)
+        hist[len(pops)+istim] = np.histogram(stimSpikes, bins=bins)[0]
+        numCells[len(pops)+istim] = len(cellStims)
+    hist = _allreduceArray(hist)
+    numCells = _allreduceArray(numCells)
+
+    labels = pops + stimPops
+    counts = ODict([(pop, hist[i]) for i, pop in enumerate(labels)])
+    counts['allCells'] = hist[:len(pops)].sum(axis=0)
+    numCellsPop = dict(zip(labels, numCells.tolist()))
+    numCellsPop['allCells'] = numCells[:len(pops)].sum()
+    return {'binCenters': bins[:-1]+binSize/2.0, 'counts': counts, 'numCells': numCellsPop, 'binSize': binSize, 'timeRange': timeRange}
+
+
+def reduceConnMatrix ():
+    ''' Returns dict with list of 'pops' (followed by NetStim sources), 'numCells' of each (-1 for NetStims), and matrices (pre x post) 
+    with the number of conns ('numConns') and sum of 'weight' and 'delay' (can be passed to analysis.plotConn as connData) '''
+    pops = _cellPops()
+    allCellTags = sim.net._getAllCellTags()  # pop of presynaptic cells
+    stimLabels = set([conn['preLabel'] for cell in sim.net.cells for conn in cell.conns if conn['preGid'] == 'NetStim'])
+    if sim.nhosts > 1: stimLabels = set([label for labels in sim.pc.py_allgather(stimLabels) for label in labels])
+    labels = pops + sorted(stimLabels)
+    inds = {label: i for i, label in enumerate(labels)}
+
+    matrices = np.zeros((3, len(labels), len(labels)))  # numConns, weight, delay
+    for cell in sim.net.cells:
+        postInd = inds[cell.tags['popLabel']]
+        for conn in cell.conns:
+            if conn['preGid'] == 'NetStim': 
+                preInd = inds[conn['preLabel']]
+            elif conn['preGid'] in allCellTags:
+                preInd = inds[allCellTags[conn['preGid']]['popLabel']]
+            else: 
+                continue
+            matrices[:, preInd, postInd] += [1, conn['weight'], conn['delay']]
+    matrices = _allreduceArray(matrices)
+    numCells = _allreduceArray(_localPopCounts(pops))
+
+    return {'pops': labels, 'numCells': dict([(label, numCells[i] if i < len(pops) else -1) for i, label in enumerate(labels)]),
+        'numConns': matrices[0], 'weight': matrices[1], 'delay': matrices[2]}
+
+
+def _cellPops ():
+    # labels of pops with cells (NetStim pops don't create cells)
+    return [label for label, pop in sim.net.pops.iteritems() if pop.tags.get('cellModel') != 'NetStim']
+
+
+def _localSpikePops (pops):
+    # spike times of this node and index of pop of each spike (-1 if not in pops)
+    spkt = _vecToArray(sim.simData['spkt'])
+    spkid = _vecToArray(sim.simData['spkid'])
+    if sim.cfg.saveFileStep:  # add spikes saved to file during simulation (without loading them back into the vectors)
+        saved = _readIntervalData([('spkt',), ('spkid',)])
+        spkt = np.concatenate((np.array(saved[('spkt',)], dtype=float), spkt))
+        spkid = np.concatenate((np.array(saved[('spkid',)], dtype=float), spkid))
+    spkid = spkid.astype(int)
+    gids = [cell.gid for cell in sim.net.cells]
+    popIndex = np.zeros(max(gids)+1 if gids else 1, dtype=int) - 1  # pop index of each gid in this node
+    for cell in sim.net.cells: 
+        if cell.tags['popLabel'] in pops: popIndex[cell.gid] = pops.index(cell.tags['popLabel'])
+    popInds = popIndex[spkid] if len(spkid) else np.zeros(0, dtype=int)
+    return spkt, popInds
+
+
+def _localPopCounts (pops):
+    # number of cells of each pop in this node
+    popInds = [pops.index(cell.tags['popLabel']) for cell in sim.net.cells if cell.tags['popLabel'] in pops]
+    return np.bincount(np.array(popInds, dtype=int), minlength=len(pops)).astype(float)
+
+
+def _allreduceArray (array, op = 1):
+    # sum (op=1), max (op=2) or min (op=3) of numpy array across nodes
+    array = np.asarray(array, dtype=float)
+    if sim.nhosts == 1 or array.size == 0: return array
+    vec = h.Vector(array.ravel())
+    sim.pc.allreduce(vec, op)
+    return np.array(vec.as_numpy()).reshape(array.shape)
+
+
+###############################################################################
+### Calculate and print avg pop rates
+###############################################################################
+def popAvgRates(trange = None, show = True, distributed = False):
+    if distributed: return reducePopRates(trange, show)  # computed in each node and reduced (call from all nodes)
+
+    if not hasattr(sim, 'allSimData') or 'spkt' not in sim.allSimData:
+        print 'Error: sim.allSimData not available; please call sim.gatherData()'
+        return None
 
+    store = getSpikeStore()
+    counts = store.countsPerGid(trange)  # spikes of each gid in store.gids
+    gidPops = np.array([sim.net.allCells[int(gid)]['tags']['popLabel'] for gid in store.gids], dtype=object)
     if not trange: 
         trange = [0, sim.cfg.duration]
-    else:
-        spkids,spkts = zip(*[(spkid,spkt) for spkid,spkt in zip(spkids,spkts) if trange[0] <= spkt <= trange[1]])
 
     avgRates = Dict()
     for pop in sim.net.allPops:
         numCells = float(len(sim.net.allPops[pop]['cellGids']))
         if numCells > 0:
             tsecs = float((trange[1]-trange[0]))/1000.0
-            avgRates[pop] = len([spkid for spkid in spkids if sim.net.allCells[int(spkid)]['tags']['popLabel']==pop])/numCells/tsecs
+            avgRates[pop] = counts[gidPops==pop].sum()/numCells/tsecs
             print '%s : %.3f Hz'%(pop, avgRates[pop])
     return avgRates
 
@@ -917,7 +2029,10 @@ def loadBalance():
 ###############################################################################
 ### Gather data from nodes
 ###############################################################################
-def _gatherCells ():
+def _gatherCells (gids = None, keys = None):
+    ''' Update sim.net.allCells in node 0; if gids is set, only the data ('keys', eg. ['conns']) of those cells is sent (gids in this node) '''
+    if gids is not None: return _gatherCellsDelta(gids, keys)
+
     ## Pack data from all hosts
     if sim.rank==0: 
         print('\nUpdating sim.net.allCells...')
@@ -952,10 +2067,40 @@ def _gatherCells ():
         sim.net.allCells = [c.__getstate__() for c in sim.net.cells]
       
 
+def _gatherCellsDelta (gids, keys = None):
+    gids = set(gids)
+    deltas = []
+    for cell in sim.net.cells:
+        if cell.gid in gids:
+            state = cell.__dict__ if keys is None else {key: getattr(cell, key) for key in keys if hasattr(cell, key)}
+            deltas.append(copyReplaceItemObj(dict(state, gid=cell.gid), keystart='h', newval=None))  # remove h objects
+
+    numModified = sim.pc.allreduce(len(deltas), 1) if sim.nhosts > 1 else len(deltas)
+    if sim.rank == 0: 
+        print('\nUpdating %d modified cells in sim.net.allCells...' % (numModified))
+    if numModified == 0: return
+
+    allDeltas = [delta for nodeDeltas in _gatherObject(deltas) for delta in nodeDeltas] if sim.nhosts > 1 else deltas
+    if sim.rank == 0:
+        cellIndex = {cell['gid']: i for i, cell in enumerate(sim.net.allCells)}
+        for delta in allDeltas:
+            if delta['gid'] in cellIndex: 
+                sim.net.allCells[cellIndex[delta['gid']]].update(delta)  # patch in place
+            else:
+                sim.net.allCells.append(delta)
+        if len(sim.net.allCells) > len(cellIndex): sim.net.allCells.sort(key=lambda k: k['gid'])
+
+
 ###############################################################################
 ### Save data
 ###############################################################################
 def saveData (include = None):
+    if sim.cfg.saveDistributed:  # each node saves its own data (no gather); other formats require gathered data
+        if sim.rank == 0:
+            for option in ['savePickle', 'saveJson', 'saveNDJson', 'saveMat', 'saveCSV', 'saveDpk', 'saveHDF5', 'saveDat', 'saveSpikeStore', 'saveTiming']:
+                if getattr(sim.cfg, option, False): 
+                    print('  Warning: %s is ignored when saveDistributed is True (only shard files are saved)' % (option))
+        return _saveShards(include)
 
     if sim.rank == 0 and not getattr(sim.net, 'allCells', None): needGather = True
     else: needGather = False
@@ -991,21 +2136,22 @@ def saveData (include = None):
                     pickle.dump(dataSave, fileObj)
                 print('Finished saving!')
 
-            # Save to dpk file
+            # Save to dpk file (sections written incrementally as compressed chunks)
             if sim.cfg.saveDpk:
-                import gzip
                 print('Saving output as %s ... ' % (sim.cfg.filename+'.dpk'))
-                fn=sim.cfg.filename #.split('.')
-                gzip.open(fn, 'wb').write(pk.dumps(dataSave)) # write compressed string
+                _saveDpk(dataSave, sim.cfg.filename+'.dpk')
                 print('Finished saving!')
 
-            # Save to json file
+            # Save to json file (written incrementally; numpy arrays saved as lists)
             if sim.cfg.saveJson:
-                import json
-                #dataSave = replaceDictODict(dataSave)  # not required since json saves as dict
                 print('Saving output as %s ... ' % (sim.cfg.filename+'.json '))
-                with open(sim.cfg.filename+'.json', 'w') as fileObj:
-                    json.dump(dataSave, fileObj)
+                _saveJsonStream(dataSave, sim.cfg.filename+'.json')
+                print('Finished saving!')
+
+            # Save to ndjson file (one item per line)
+            if sim.cfg.saveNDJson:
+                print('Saving output as %s ... ' % (sim.cfg.filename+'.ndjson '))
+                _saveNDJson(dataSave, sim.cfg.filename+'.ndjson')
                 print('Finished saving!')
 
             # Save to mat file
@@ -1015,14 +2161,18 @@ def saveData (include = None):
                 savemat(sim.cfg.filename+'.mat', tupleToStr(replaceNoneObj(dataSave)))  # replace None and {} with [] so can save in .mat format
                 print('Finished saving!')
 
-            # Save to HDF5 file (uses very inefficient hdf5storage module which supports dicts)
+            # Save to HDF5 file (spikes and traces as chunked compressed datasets, cells and conns as tables)
             if sim.cfg.saveHDF5:
-                dataSaveUTF8 = _dict2utf8(replaceNoneObj(dataSave)) # replace None and {} with [], and convert to utf
-                import hdf5storage
                 print('Saving output as %s... ' % (sim.cfg.filename+'.hdf5'))
-                hdf5storage.writes(dataSaveUTF8, filename=sim.cfg.filename+'.hdf5')
+                _saveHDF5(dataSave, sim.cfg.filename+'.hdf5')
                 print('Finished saving!')
 
+            # Save spikes indexed by gid and time
+            if sim.cfg.saveSpikeStore and 'simData' in dataSave:
+                ext = 'hdf5' if sim.cfg.saveSpikeStore == 'hdf5' else 'npz'
+                print('Saving spikes as %s ... ' % (sim.cfg.filename+'_spikes.'+ext))
+                getSpikeStore().save(sim.cfg.filename+'_spikes.'+ext)
+
             # Save to CSV file (currently only saves spikes)
             if sim.cfg.saveCSV:
                 if 'simData' in dataSave:
@@ -1036,16 +2186,7 @@ def saveData (include = None):
 
             # Save to Dat file(s) 
             if sim.cfg.saveDat:
-                traces = sim.cfg.recordTraces
-                for ref in traces.keys():
-                    for cellid in sim.allSimData[ref].keys():
-                        dat_file_name = '%s_%s.dat'%(ref,cellid)
-                        dat_file = open(dat_file_name, 'w')
-                        trace = sim.allSimData[ref][cellid]
-                        print("Saving %i points of data on: %s:%s to %s"%(len(trace),ref,cellid,dat_file_name))
-                        for i in range(len(trace)):
-                            dat_file.write('%s\t%s\n'%((i*sim.cfg.dt/1000),trace[i]/1000))
-
+                _saveDat()
                 print('Finished saving!')
 
             # Save timing
@@ -1054,7 +2195,9 @@ def saveData (include = None):
                 print('  Done; saving time = %0.2f s.' % sim.timingData['saveTime'])
             if sim.cfg.timing and sim.cfg.saveTiming: 
                 import pickle
-                with open('timing.pkl', 'wb') as file: pickle.dump(sim.timing, file)
+                timingSave = dict(sim.timingData)
+                if hasattr(sim, 'runSettings'): timingSave['runSettings'] = dict(sim.runSettings)
+                with open('timing.pkl', 'wb') as file: pickle.dump(timingSave, file)
 
 
             # clean to avoid mem leaks
@@ -1070,6 +2213,831 @@ def saveData (include = None):
             print('Nothing to save')
 
 
+###############################################################################
+### Save data of each node to its own shard file, and index of shards (without gathering data to node 0)
+###############################################################################
+def _saveShards (include = None):
+    import os, json
+    timing('start', 'saveTime')
+    if not include: include = sim.cfg.saveDataInclude
+    _completeSimData()
+
+    shardDir = sim.cfg.filename+'_shards'
+    if sim.rank == 0 and not os.path.exists(shardDir): os.makedirs(shardDir)
+    sim.pc.barrier()
+
+    shard = {'rank': sim.rank, 'nhosts': sim.nhosts}
+    if 'net' in include or 'netCells' in include: shard['cells'] = [c.__getstate__() for c in sim.net.cells]
+    if 'simData' in include: shard['simData'] = _combineSimData([sim.simData], _simDataVecKeys())  # Vectors as numpy arrays
+    shardFile = 'shard_%d.pkl' % (sim.rank)
+    with open(os.path.join(shardDir, shardFile), 'wb') as fileObj:
+        pk.dump(ODict().undotify(shard), fileObj, protocol=pk.HIGHEST_PROTOCOL)  # plain dicts (Dict can't be pickled with protocol 2)
+
+    gids = [c.gid for c in sim.net.cells]
+    shardsInfo = _gatherObject({'file': shardFile, 'rank': sim.rank, 'numCells': len(gids), 'gidRange': [min(gids), max(gids)] if gids else None, 
+        'numSpikes': int(sim.simData['spkt'].size()) if 'spkt' in sim.simData else 0})
+    
+    if sim.rank == 0:
+        meta = {}  # data common to all nodes 
+        if 'netParams' in include: meta['netParams'] = replaceFuncObj(sim.net.params.__dict__)
+        if 'net' in include or 'netPops' in include: 
+            meta['pops'] = ODict()
+            for popLabel,pop in sim.net.pops.iteritems(): meta['pops'][popLabel] = pop.__getstate__()
+        if 'simConfig' in include: meta['simConfig'] = sim.cfg.__dict__
+        meta['simDataVecs'] = _simDataVecKeys()
+        with open(os.path.join(shardDir, 'meta.pkl'), 'wb') as fileObj:
+            pk.dump(ODict().undotify(meta), fileObj, protocol=pk.HIGHEST_PROTOCOL)
+
+        index = {'format': 'netpyne_shards', 'version': 1, 'nhosts': sim.nhosts, 'shardDir': os.path.basename(shardDir), 'meta': 'meta.pkl', 
+            'shards': shardsInfo}
+        with open(sim.cfg.filename+'.shards', 'w') as fileObj:
+            json.dump(index, fileObj, indent=1)
+        print('Saved %d shards to %s (index: %s)' % (sim.nhosts, shardDir, sim.cfg.filename+'.shards'))
+
+    sim.pc.barrier()  # all shards written
+    if sim.rank == 0 and sim.cfg.timing: 
+        timing('stop', 'saveTime')
+        print('  Done; saving time = %0.2f s.' % sim.timingData['saveTime'])
+    return os.path.abspath(sim.cfg.filename+'.shards')
+
+
+###############################################################################
+### Load sharded data (saved with simConfig.saveDistributed) in same format as single file
+###############################################################################
+def _loadShards (filename, ranks = None, cellRanks = None):
+    # cellRanks: only keep cells of these ranks (if saved with the same number of nodes), eg. to load the cells of each node
+    import os, json
+    with open(filename, 'r') as fileObj:
+        index = json.load(fileObj)
+    shardDir = os.path.join(os.path.dirname(filename), index['shardDir'])
+    with open(os.path.join(shardDir, index['meta']), 'rb') as fileObj:
+        meta = pk.load(fileObj)
+
+    if cellRanks is not None and index['nhosts'] != sim.nhosts: cellRanks = None  # cells need to be redistributed
+    cells = []
+    nodesSimData = []
+    for shardInfo in index['shards']:
+        if ranks is not None and shardInfo['rank'] not in ranks: continue
+        with open(os.path.join(shardDir, shardInfo['file']), 'rb') as fileObj:
+            shard = pk.load(fileObj)
+        if cellRanks is None or shardInfo['rank'] in cellRanks: cells.extend(shard.get('cells', []))
+        if 'simData' in shard: nodesSimData.append(shard['simData'])
+
+    data = {}
+    if 'simConfig' in meta: data['simConfig'] = meta['simConfig']
+    data['net'] = {}
+    if 'netParams' in meta: data['net']['params'] = meta['netParams']
+    if cells or 'pops' in meta:
+        data['net']['cells'] = sorted(cells, key=lambda k: k['gid'])
+        pops = meta.get('pops', OrderedDict())
+        for pop in pops.values(): pop['cellGids'] = []
+        for cell in data['net']['cells']:
+            if cell['tags'].get('popLabel') in pops: pops[cell['tags']['popLabel']]['cellGids'].append(cell['gid'])
+        data['net']['pops'] = pops
+        if cellRanks is not None: data['net']['localCells'] = True
+    if nodesSimData:
+        data['simData'] = _combineSimData(nodesSimData, meta['simDataVecs'])
+    return data
+
+
+###############################################################################
+### Save data to json file written incrementally, one item (cell, pop, trace...) per line, instead of encoding the whole document at once
+###############################################################################
+def _saveJsonStream (dataSave, filename):
+    import json
+    encode = json.JSONEncoder(default=_jsonDefault).encode  # (fast) C encoder used for each item
+
+    def write (fileObj, obj, depth):
+        if _isJsonStreamDict(obj, depth):
+            fileObj.write('{')
+            for i, (key, value) in enumerate(obj.iteritems()):
+                fileObj.write((',' if i else '') + '\n' + encode(str(key)) + ': ')
+                write(fileObj, value, depth+1)
+            fileObj.write('\n}')
+        elif _isJsonStreamList(obj, depth):
+            fileObj.write('[')
+            for i, value in enumerate(obj):
+                fileObj.write((',' if i else '') + '\n' + encode(value))
+            fileObj.write('\n]')
+        else:
+            fileObj.write(encode(obj))
+
+    with open(filename, 'w') as fileObj:
+        write(fileObj, dataSave, 0)
+        fileObj.write('\n')
+
+
+###############################################################################
+### Save recorded traces to .dat files: one per cell and trace (time and value columns), or one per trace with a column per cell
+###############################################################################
+def _saveDat ():
+    from multiprocessing.pool import ThreadPool
+
+    jobs = []
+    for ref in sim.cfg.recordTraces.keys():
+        if ref not in sim.allSimData: continue
+        cellids = sim.allSimData[ref].keys()
+        if sim.cfg.saveDat == 'combined':
+            jobs.append(('%s.dat'%(ref), ref, cellids))
+        else:
+            jobs.extend([('%s_%s.dat'%(ref,cellid), ref, [cellid]) for cellid in cellids])
+        print('Saving trace %s of %d cells to %s ... ' % (ref, len(cellids), '%s.dat'%(ref) if sim.cfg.saveDat == 'combined' else '%s_*.dat'%(ref)))
+
+    pool = ThreadPool(max(sim.cfg.saveDatThreads, 1))  # file writes run in parallel (formatting holds the GIL)
+    try:
+        pool.map(_writeDat, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _writeDat (job):
+    filename, ref, cellids = job
+    traces = [np.asarray(sim.allSimData[ref][cellid], dtype=np.float64) for cellid in cellids]
+    numSamples = max([len(trace) for trace in traces]) if traces else 0
+    data = np.full((numSamples, len(traces)+1), np.nan)  # shorter traces padded with nan
+    data[:,0] = np.arange(numSamples) * sim.cfg.recordStep / 1000  # time (s) of each recorded sample
+    for i, trace in enumerate(traces):
+        data[:len(trace),i+1] = trace / 1000
+
+    if sim.cfg.saveDatBinary:  # raw float64 samples x columns (C order)
+        data.tofile(filename[:-4]+'.bin')
+        return
+
+    with open(filename, 'w') as fileObj:
+        if sim.cfg.saveDat == 'combined':
+            fileObj.write('# t\t%s\n' % ('\t'.join([str(cellid) for cellid in cellids])))
+        rowFormat = '\t'.join(['%.12g']*data.shape[1]) + '\n'
+        blockRows = max(_datChunkValues // data.shape[1], 1)  # rows per block so each block has at most _datChunkValues values
+        for start in range(0, numSamples, blockRows):  # format block of rows with a single string operation
+            block = data[start:start+blockRows]
+            fileObj.write((rowFormat*len(block)) % tuple(block.ravel()))
+
+_datChunkValues = 20000  # values formatted and written at a time by _writeDat
+
+
+###############################################################################
+### Save data to newline-delimited json (ndjson) file; each line is [path, 'v', value] or [path, 'a', item appended to list at path]
+###############################################################################
+def _saveNDJson (dataSave, filename):
+    import json
+    encode = json.JSONEncoder(default=_jsonDefault).encode
+
+    def write (fileObj, path, obj, depth):
+        if _isJsonStreamDict(obj, depth):
+            for key, value in obj.iteritems(): 
+                write(fileObj, path + [str(key)], value, depth+1)
+        elif _isJsonStreamList(obj, depth):
+            fileObj.write(encode([path, 'v', []]) + '\n')
+            for value in obj: 
+                fileObj.write(encode([path, 'a', value]) + '\n')
+        else:
+            fileObj.write(encode([path, 'v', obj]) + '\n')
+
+    with open(filename, 'w') as fileObj:
+        write(fileObj, [], dataSave, 0)
+
+
+def _isJsonStreamDict (obj, depth):
+    # dicts written item by item (eg. dataSave, net, simData, pops, traces)
+    return isinstance(obj, dict) and len(obj) > 0 and depth < 3
+
+
+def _isJsonStreamList (obj, depth):
+    # lists of dicts/lists written item by item (eg. cells)
+    return isinstance(obj, list) and len(obj) > 0 and isinstance(obj[0], (dict, list)) and depth < 3
+
+
+###############################################################################
+### Load json file; files saved incrementally are parsed one line at a time (other json files are parsed at once)
+###############################################################################
+def _loadJson (filename):
+    import json
+    with open(filename, 'r') as fileObj:
+        if fileObj.readline().strip() == '{':  # may have been saved incrementally (one item per line)
+            try:
+                return _loadJsonLines(fileObj)
+            except ValueError:  # other json with '{' in first line (eg. indented)
+                pass
+        fileObj.seek(0)
+        return json.load(fileObj, object_pairs_hook=OrderedDict)
+
+
+def _loadJsonLines (fileObj):
+    # parse rest of json file written by _saveJsonStream line by line; raises ValueError if lines don't have that layout
+    import json
+    decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+    stack = [OrderedDict()]
+    root = None
+    for line in fileObj:
+        line = line.strip().rstrip(',')
+        if line in ['}', ']']:
+            if not stack: raise ValueError('Unexpected %s' % (line))
+            root = stack.pop()
+        elif not stack:
+            if line: raise ValueError('Data after end of json object')
+        elif line.endswith(': {') or line.endswith(': ['):
+            key = decoder.decode(line[:-3])
+            stack[-1][key] = OrderedDict() if line[-1] == '{' else []
+            stack.append(stack[-1][key])
+        elif isinstance(stack[-1], list):
+            stack[-1].append(decoder.decode(line))
+        elif line:
+            stack[-1].update(decoder.decode('{' + line + '}'))
+    if stack: raise ValueError('Unexpected end of json file')
+    return root
+
+
+###############################################################################
+### Load ndjson file; sections: list of sections to load, eg. ['simConfig', 'net.cells', 'simData.spkt'] (default: all)
+###############################################################################
+def loadNDJson (filename, sections = None):
+    data = OrderedDict()
+    for path, mode, value in iterNDJson(filename, sections):
+        container = data
+        for key in path[:-1]:
+            container = container.setdefault(key, OrderedDict())
+        if mode == 'a': container[path[-1]].append(value)
+        else: container[path[-1]] = value
+    return data
+
+
+def iterNDJson (filename, sections = None):
+    ''' Yields (path, mode, value) of each line of ndjson file, eg. (['net', 'cells'], 'a', cell) for each cell (only decodes lines in sections) '''
+    import json
+    decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+    sections = [section.split('.') for section in sections] if sections is not None else None
+    with open(filename, 'r') as fileObj:
+        for line in fileObj:
+            if sections is not None:
+                path = decoder.raw_decode(line, 1)[0]  # only decode path to check if in sections
+                if not any([path[:len(section)] == section for section in sections]): continue
+            yield decoder.decode(line)
+
+
+###############################################################################
+### Save data to dpk file: sections (netParams, simConfig, net.pops, net.cells, simData.<key>) written incrementally as 
+### independently compressed chunks, followed by an index of the chunks of each section (so only one chunk is in memory at a time);
+### numeric arrays (spikes, traces and conn columns) are written uncompressed and aligned so they can be memory-mapped
+###############################################################################
+_dpkMagic = 'NETPYDPK'
+_dpkChunkSize = 1000  # max number of cells/items per chunk
+_dpkArrayChunkSize = 1000000  # max number of array elements written at once
+
+def _saveDpk (dataSave, filename, compressLevel = 6):
+    import zlib, json, struct
+    sections = OrderedDict()
+
+    def writeChunk (fileObj, obj):
+        payload = zlib.compress(pk.dumps(ODict().undotify(obj), protocol=pk.HIGHEST_PROTOCOL), compressLevel)
+        offset = fileObj.tell()
+        fileObj.write(payload)
+        return [offset, len(payload)]
+
+    def writeRaw (fileObj, rows, dtype, shape):
+        fileObj.write('\0' * (-fileObj.tell() % 64))  # align for memory-mapping
+        offset = fileObj.tell()
+        for row in rows: 
+            fileObj.write(np.ascontiguousarray(row, dtype=dtype).tostring())
+        return {'kind': 'raw', 'offset': offset, 'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+
+    def writeSection (fileObj, name, value):
+        rows = _dpkRows(value)
+        if isinstance(value, np.ndarray) and value.ndim and value.dtype.kind in 'biuf':
+            step = max(1, _dpkArrayChunkSize // max(1, value[0].size if len(value) else 1))
+            sections[name] = writeRaw(fileObj, (value[i:i+step] for i in range(0, len(value), step)), value.dtype, value.shape)
+        elif rows is not None:  # dict of equal length arrays (eg. traces) as 2D array
+            labels, arrays = rows
+            sections[name] = writeRaw(fileObj, arrays, arrays[0].dtype, (len(arrays), len(arrays[0])))
+            sections[name].update({'kind': 'rows', 'labels': writeChunk(fileObj, labels), 'ordered': isinstance(value, OrderedDict)})
+        elif isinstance(value, list) and len(value) > _dpkChunkSize:
+            chunks = [writeChunk(fileObj, value[i:i+_dpkChunkSize]) for i in range(0, len(value), _dpkChunkSize)]
+            sections[name] = {'kind': 'list', 'chunks': chunks, 'chunkSize': _dpkChunkSize, 'length': len(value)}
+        elif isinstance(value, dict) and len(value) > _dpkChunkSize:
+            keys = value.keys()
+            chunks = [writeChunk(fileObj, [(key, value[key]) for key in keys[i:i+_dpkChunkSize]]) for i in range(0, len(keys), _dpkChunkSize)]
+            sections[name] = {'kind': 'dict', 'ordered': isinstance(value, OrderedDict), 'chunks': chunks}
+        else:
+            sections[name] = {'kind': 'value', 'chunks': [writeChunk(fileObj, value)]}
+
+    with open(filename, 'wb') as fileObj:
+        fileObj.write(_dpkMagic)
+        net = dataSave.get('net', {})
+        if 'params' in net: writeSection(fileObj, 'netParams', net['params'])
+        if 'simConfig' in dataSave: writeSection(fileObj, 'simConfig', dataSave['simConfig'])
+        if 'pops' in net: writeSection(fileObj, 'net.pops', net['pops'])
+        if 'cells' in net: 
+            writeSection(fileObj, 'net.cells', net['cells'])
+            writeSection(fileObj, 'net.cellTags', [{'gid': cell['gid'], 'tags': cell['tags']} for cell in net['cells']])  # used by loadLazy
+            for key, column in _dpkConnColumns(net['cells']).iteritems():  # conns as columns (for memory-mapping)
+                writeSection(fileObj, 'connArrays.'+key, column)
+        for key, value in dataSave.get('simData', {}).iteritems(): 
+            if not isinstance(value, dict) and _isVector(value): value = _vecToArray(value)
+            writeSection(fileObj, 'simData.'+key, value)
+
+        fileObj.write('\0' * (-fileObj.tell() % 64))
+        indexOffset = fileObj.tell()
+        fileObj.write(zlib.compress(json.dumps({'version': 1, 'sections': sections})))
+        fileObj.write(struct.pack('<Q', indexOffset) + _dpkMagic)  # footer used to find index
+
+
+def _dpkRows (value):
+    # labels and arrays of dict of equal length numeric arrays, eg. traces (None if not such a dict)
+    if not isinstance(value, dict) or not value: return None
+    arrays = [v for v in value.values() if isinstance(v, np.ndarray) and v.ndim == 1 and v.dtype.kind in 'biuf']
+    if len(arrays) < len(value) or any([a.shape != arrays[0].shape or a.dtype != arrays[0].dtype for a in arrays]): return None
+    return value.keys(), arrays
+
+
+def _dpkConnColumns (cells):
+    # postGid, preGid (-1 for NetStims), weight and delay of all conns
+    columns = OrderedDict([(key, []) for key in ['postGid', 'preGid', 'weight', 'delay']])
+    for cell in cells:
+        for conn in cell.get('conns', []):
+            columns['postGid'].append(cell['gid'])
+            columns['preGid'].append(conn['preGid'] if isinstance(conn.get('preGid'), Number) else -1)
+            columns['weight'].append(conn['weight'] if isinstance(conn.get('weight'), Number) else np.nan)
+            columns['delay'].append(conn['delay'] if isinstance(conn.get('delay'), Number) else np.nan)
+    if not columns['postGid']: return OrderedDict()
+    return OrderedDict([('postGid', np.array(columns['postGid'], dtype=np.int64)), ('preGid', np.array(columns['preGid'], dtype=np.int64)),
+        ('weight', np.array(columns['weight'], dtype=np.float64)), ('delay', np.array(columns['delay'], dtype=np.float64))])
+
+
+###############################################################################
+### Load dpk file; sections: list of sections to load, eg. ['simConfig', 'net', 'simData.spkt'] (default: all except 'connArrays')
+###############################################################################
+def loadDpk (filename, sections = None):
+    index = _dpkIndex(filename)
+    data = {}
+    with open(filename, 'rb') as fileObj:
+        for name in index['sections']:
+            if sections is None and (name.startswith('connArrays.') or name == 'net.cellTags'): continue  # same data as cells
+            if sections is not None and not any([name == s or name.startswith(s+'.') for s in sections]): continue
+            _dpkSetSection(data, name, _dpkReadSection(fileObj, index['sections'][name]))
+    return data
+
+
+def _dpkSetSection (data, name, value):
+    if name == 'netParams': data.setdefault('net', {})['params'] = value
+    elif name == 'simConfig': data['simConfig'] = value
+    elif name.startswith('net.'): data.setdefault('net', {})[name[4:]] = value
+    elif name.startswith('connArrays.'): data.setdefault('net', {}).setdefault('connArrays', Dict())[name[11:]] = value
+    elif name.startswith('simData.'): data.setdefault('simData', Dict())[name[8:]] = value
+
+
+def _dpkIndex (filename):
+    import zlib, json, struct
+    footerSize = 8 + len(_dpkMagic)
+    with open(filename, 'rb') as fileObj:
+        fileObj.seek(-footerSize, 2)
+        footerOffset = fileObj.tell()
+        footer = fileObj.read()
+        fileObj.seek(0)
+        if fileObj.read(len(_dpkMagic)) != _dpkMagic or footer[8:] != _dpkMagic:
+            raise IOError('%s is not a complete dpk file' % (filename))
+        indexOffset = struct.unpack('<Q', footer[:8])[0]
+        return json.loads(zlib.decompress(_dpkReadRange(fileObj, indexOffset, footerOffset-indexOffset)), object_pairs_hook=OrderedDict)
+
+
+def _dpkReadSection (fileObj, section, mmapFile = None):
+    # mmapFile: filename to memory-map raw arrays instead of reading them
+    import zlib
+    if section['kind'] in ['raw', 'rows']:
+        shape = tuple(section['shape'])
+        if mmapFile: 
+            array = np.memmap(mmapFile, dtype=section['dtype'], mode='r', offset=section['offset'], shape=shape) if np.prod(shape) else np.zeros(shape)
+        else:
+            fileObj.seek(section['offset'])
+            array = np.fromfile(fileObj, dtype=section['dtype'], count=int(np.prod(shape))).reshape(shape)
+        if section['kind'] == 'raw': return array
+        labels = pk.loads(zlib.decompress(_dpkReadRange(fileObj, *section['labels'])))
+        return (Dict if not section.get('ordered') else ODict)(zip(labels, array))  # rows are views of 2D array
+    chunks = (_dpkReadChunk(fileObj, chunk) for chunk in section['chunks'])
+    if section['kind'] == 'list':
+        return [item for chunk in chunks for item in chunk]
+    elif section['kind'] == 'dict':
+        value = OrderedDict() if section.get('ordered') else {}
+        for chunk in chunks: value.update(chunk)
+        return value
+    return next(chunks)
+
+
+def _dpkReadChunk (fileObj, chunk):
+    import zlib
+    return pk.loads(zlib.decompress(_dpkReadRange(fileObj, *chunk)))
+
+
+def _dpkReadRange (fileObj, offset, length):
+    fileObj.seek(offset)
+    return fileObj.read(length)
+
+
+###############################################################################
+### Load dpk file for analysis only: spikes, traces and conn arrays are memory-mapped, cells are loaded from file when accessed, and
+### other simData is loaded on first access; no Cell objects are created
+###############################################################################
+def loadLazy (filename):
+    index = _dpkIndex(filename)
+    fileObj = open(filename, 'rb')  # kept open by lazy views
+    sections = index['sections']
+    simConfig = _dpkReadSection(fileObj, sections['simConfig']) if 'simConfig' in sections else None
+    netParams = _dpkReadSection(fileObj, sections['netParams']) if 'netParams' in sections else None
+    sim.initialize(netParams, simConfig)
+    if 'net.pops' in sections: sim.net.allPops = _dpkReadSection(fileObj, sections['net.pops'])
+    if 'net.cells' in sections: 
+        cellTags = _dpkReadSection(fileObj, sections['net.cellTags']) if 'net.cellTags' in sections else None
+        sim.net.allCells = _LazyCells(fileObj, sections['net.cells'], cellTags=cellTags)
+    sim.net.connArrays = Dict([(name[11:], _dpkReadSection(fileObj, section, filename)) for name, section in sections.iteritems() 
+        if name.startswith('connArrays.')])
+    sim.allSimData = _LazyDict()
+    for name, section in sections.iteritems():
+        if not name.startswith('simData.'): continue
+        if section['kind'] in ['raw', 'rows']: 
+            sim.allSimData[name[8:]] = _dpkReadSection(fileObj, section, filename)
+        else:
+            sim.allSimData._addLoader(name[8:], lambda section=section: _dpkReadSection(fileObj, section))
+    print('  Loaded %s for analysis (%d cells)' % (filename, len(getattr(sim.net, 'allCells', []))))
+
+
+class _LazyCells (object):
+    # list of cells loaded from dpk file chunks when accessed (keeps the last chunks used)
+    # cellTags: gid and tags of each cell; if available, cells are returned as _LazyCell and only loaded when other keys are accessed
+    def __init__ (self, fileObj, section, maxChunks = 8, cellTags = None):
+        self.fileObj = fileObj
+        self.section = section
+        self.maxChunks = maxChunks
+        self.cache = OrderedDict()
+        self.cellTags = cellTags
+        if section['kind'] == 'list':
+            self.length, self.chunkSize = section['length'], section['chunkSize']
+        elif cellTags is not None:  # single chunk (read when a cell is loaded)
+            self.length = self.chunkSize = len(cellTags)
+        else:  # single chunk
+            self.cache[0] = _dpkReadSection(fileObj, section)
+            self.length = self.chunkSize = len(self.cache[0])
+
+    def _chunk (self, ichunk):
+        if ichunk not in self.cache:
+            if self.section['kind'] == 'list': self.cache[ichunk] = _dpkReadChunk(self.fileObj, self.section['chunks'][ichunk])
+            else: self.cache[ichunk] = _dpkReadSection(self.fileObj, self.section)
+            if len(self.cache) > self.maxChunks: self.cache.popitem(last=False)
+        return self.cache[ichunk]
+
+    def __len__ (self):
+        return self.length
+
+    def __getitem__ (self, i):
+        if isinstance(i, slice): return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0: i += self.length
+        if not 0 <= i < self.length: raise IndexError('cell index out of range')
+        if self.cellTags is not None: return _LazyCell(self, i)
+        return self._cell(i)
+
+    def _cell (self, i):
+        return self._chunk(i // self.chunkSize)[i % self.chunkSize]
+
+    def __iter__ (self):
+        if self.cellTags is not None:
+            for i in range(self.length): yield _LazyCell(self, i)
+            return
+        for ichunk in range((self.length + self.chunkSize - 1) // self.chunkSize if self.chunkSize else 0):
+            for cell in self._chunk(ichunk): yield cell
+
+
+class _LazyCell (dict):
+    # cell with gid and tags (from net.cellTags section); other keys (eg. secs, conns) are loaded from file on first access
+    # (C-level copies, eg. dict(cell) or json.dumps, only include the keys loaded so far)
+    def __init__ (self, cells, index):
+        dict.__init__(self, cells.cellTags[index])
+        self._cells, self._index, self._loaded = cells, index, False
+
+    def _load (self):
+        if not self._loaded:
+            self._loaded = True
+            dict.update(self, self._cells._cell(self._index))
+
+    def __missing__ (self, key):
+        self._load()
+        if dict.__contains__(self, key): return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__ (self, key):
+        if not dict.__contains__(self, key): self._load()
+        return dict.__contains__(self, key)
+
+    def get (self, key, default = None):
+        return self[key] if key in self else default
+
+    def __iter__ (self): self._load(); return dict.__iter__(self)
+    def __len__ (self): self._load(); return dict.__len__(self)
+    def keys (self): self._load(); return dict.keys(self)
+    def values (self): self._load(); return dict.values(self)
+    def items (self): self._load(); return dict.items(self)
+    def iteritems (self): self._load(); return dict.iteritems(self)
+
+
+class _LazyDict (Dict):
+    # Dict with values loaded from file on first access
+    def _addLoader (self, key, loader):
+        dict.__setitem__(self, key, _lazyValue)
+        object.__setattr__(self, '_loader_'+key, loader)
+
+    def __getitem__ (self, key):
+        value = dict.__getitem__(self, key)
+        if value is _lazyValue:
+            value = object.__getattribute__(self, '_loader_'+key)()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get (self, key, default = None):
+        return self[key] if key in self else default
+
+    def values (self): return [self[key] for key in self]
+    def items (self): return [(key, self[key]) for key in self]
+    def itervalues (self): return (self[key] for key in self)
+    def iteritems (self): return ((key, self[key]) for key in self)
+
+
+_lazyValue = object()  # placeholder of values not loaded yet
+
+
+###############################################################################
+### Save data to HDF5 file: spikes and traces as chunked, compressed datasets; cells and conns as tables; params as JSON attributes
+###############################################################################
+def _saveHDF5 (dataSave, filename):
+    import h5py, json
+    with h5py.File(filename, 'w', libver='latest') as fileObj:  # latest file format allows large attributes (netParams)
+        fileObj.attrs['_format'] = 'netpyne_hdf5'
+        fileObj.attrs['_version'] = 1
+        net = dataSave.get('net', {})
+        if 'params' in net: fileObj.attrs['netParams'] = json.dumps(net['params'], default=_jsonDefault)
+        if 'simConfig' in dataSave: fileObj.attrs['simConfig'] = json.dumps(dataSave['simConfig'], default=_jsonDefault)
+        if 'pops' in net: fileObj.attrs['pops'] = json.dumps(net['pops'], default=_jsonDefault)
+
+        if 'cells' in net:
+            cellRows, connRows = [], []
+            for cell in net['cells']:
+                row = dict(cell['tags'], _gid=cell['gid'])
+                row.update([('_'+key, value) for key, value in cell.iteritems() if key not in ['gid', 'tags', 'conns']])
+                cellRows.append(row)
+                connRows.extend([dict(conn, _postGid=cell['gid']) for conn in cell.get('conns', [])])
+            netStim = all([isinstance(row['preGid'], Number) or row['preGid'] == 'NetStim' for row in connRows if 'preGid' in row])
+            if netStim:  # keep preGid as numeric column
+                for row in connRows: 
+                    if row.get('preGid') == 'NetStim': row['preGid'] = -1
+            group = fileObj.create_group('net')
+            group.attrs['_conns'] = any(['conns' in cell for cell in net['cells']])
+            group.attrs['_netStimPreGid'] = netStim
+            if cellRows: _h5Dataset(group, 'cells', _h5Table(cellRows))
+            if connRows: _h5Dataset(group, 'conns', _h5Table(connRows))
+
+        if 'simData' in dataSave:
+            simData = dataSave['simData']
+            group = fileObj.create_group('simData')
+            for key, value in simData.iteritems():
+                if key in ['spkt', 'spkid']: continue
+                _h5Write(group, key, value, _traceSampling(key))
+            if 'spkt' in simData:
+                spkt, spkid = _vecToArray(simData['spkt']), _vecToArray(simData.get('spkid', []))
+                order = np.argsort(spkt, kind='mergesort')  # sorted by time so time windows can be read without loading all spikes
+                _h5Dataset(group, 'spkt', spkt[order])
+                if len(spkid) == len(spkt): _h5Dataset(group, 'spkid', spkid[order])
+
+
+def _traceSampling (key):
+    # time (ms) of first sample and sampling step of traces and LFP recorded in simData[key] (None if not recorded at fixed steps)
+    if key in ['LFP', 'LFPPops']: return (0.0, float(sim.cfg.recordStep))
+    params = sim.cfg.recordTraces.get(key) if isinstance(sim.cfg.recordTraces, dict) else None
+    if not isinstance(params, dict): return None
+    step = float(sim.cfg.recordStep * params.get('decimate', 1))
+    return (step if params.get('envelope') else 0.0, step)  # envelopes store min/max at the end of each step
+
+
+def _h5SetSampling (node, sampling, numSamples):
+    # mark dataset (or rows group) as time series so loadHDF5 can read only the samples within a time range
+    if sampling is None: return
+    node.attrs['_t0'], node.attrs['_step'] = sampling
+    node.attrs['_numSamples'] = numSamples
+
+
+def _h5Write (group, key, value, sampling = None):
+    # write dicts as groups, numeric arrays as datasets (dicts of equal length arrays, eg. traces, as 2D datasets) and other values as JSON attributes
+    # sampling: (t0, step) of time series samples (first axis of arrays; columns of rows)
+    import json
+    key = str(key).replace('/', '%2F')
+    if isinstance(value, dict):
+        arrays = [_h5Array(v) for v in value.values()]
+        if arrays and all([a is not None and a.ndim == 1 and len(a) == len(arrays[0]) for a in arrays]):
+            labels = [str(label) for label in value.keys()]
+            subgroup = group.create_group(key)
+            subgroup.attrs['_type'] = 'rows'
+            _h5SetSampling(subgroup, sampling, len(arrays[0]))
+            dataset = _h5Dataset(subgroup, 'data', np.vstack(arrays))
+            _h5Dataset(subgroup, 'labels', np.array(labels, dtype=object))
+            _h5Dataset(subgroup, 'gids', np.array([_labelGid(label) for label in labels], dtype=np.int64))
+        else:
+            subgroup = group.create_group(key)
+            subgroup.attrs['_type'] = 'dict'
+            for subkey, subvalue in value.iteritems():
+                _h5Write(subgroup, subkey, subvalue, sampling)
+    else:
+        array = _h5Array(value)
+        if array is not None:
+            dataset = _h5Dataset(group, key, array)
+            if array.ndim: _h5SetSampling(dataset, sampling, len(array))
+        else:
+            group.attrs[key] = json.dumps(value, default=_jsonDefault)
+
+
+def _h5Array (value):
+    # numeric array (None if value is not an array or list of numbers)
+    if isinstance(value, np.ndarray): return value if value.dtype.kind in 'biuf' else None
+    if isinstance(value, (list, tuple)) and value and all([isinstance(v, Number) and not isinstance(v, bool) for v in value]): 
+        return np.array(value)
+    if not isinstance(value, dict) and _isVector(value): return _vecToArray(value)
+    return None
+
+
+def _h5Dataset (group, key, array):
+    import h5py
+    if array.dtype == object: 
+        return group.create_dataset(key, data=array, dtype=h5py.special_dtype(vlen=str))
+    if not array.size:
+        return group.create_dataset(key, data=array)
+    if array.ndim == 2:
+        chunks = (min(array.shape[0], 8), min(array.shape[1], 8192))  # rows of cells x blocks of samples
+    else:
+        chunks = (min(array.shape[0], 65536),) + array.shape[1:]
+    return group.create_dataset(key, data=array, chunks=chunks, compression='gzip', compression_opts=4, shuffle=True)
+
+
+def _labelGid (label):
+    # gid of simData label 'cell_<gid>' (-1 if not a cell label)
+    if label.startswith('cell_') and label[5:].isdigit(): return int(label[5:])
+    return -1
+
+
+###############################################################################
+### Table (numpy structured array) from list of dicts: numeric columns as int64/float64, other columns as JSON strings ('' if missing)
+###############################################################################
+def _h5Table (rows):
+    import h5py, json
+    keys = sorted(set([key for row in rows for key in row]))
+    fields, columns = [], []
+    for key in keys:
+        values = [row.get(key, _missing) for row in rows]
+        if all([isinstance(v, Number) and not isinstance(v, (bool, np.bool_)) for v in values]):
+            dtype = np.int64 if all([isinstance(v, (int, long, np.integer)) for v in values]) else np.float64
+            columns.append(np.array(values, dtype=dtype))
+        else:
+            dtype = h5py.special_dtype(vlen=str)
+            columns.append(['' if v is _missing else json.dumps(v, default=_jsonDefault) for v in values])
+        fields.append((str(key), dtype))
+    table = np.zeros(len(rows), dtype=fields)
+    for (key, dtype), column in zip(fields, columns): 
+        table[key] = column
+    return table
+
+
+def _h5Rows (table):
+    import json
+    rows = [{} for i in range(len(table))]
+    for key in table.dtype.names:
+        if table.dtype[key].kind in 'iuf':
+            for row, value in zip(rows, table[key].tolist()): row[key] = value
+        else:
+            for row, value in zip(rows, table[key]): 
+                if value: row[key] = json.loads(value)
+    return rows
+
+
+_missing = object()  # marks missing keys in tables
+
+
+###############################################################################
+### Load data from HDF5 file saved by netpyne; only reads spikes and trace samples in timeRange, and cells, conns, traces and spikes of gids
+###############################################################################
+def loadHDF5 (filename, include = None, timeRange = None, gids = None):
+    ''' include: list with any of 'netParams', 'simConfig', 'net', 'netPops', 'simData' (default: all)
+    timeRange: [start, stop] (ms) of spikes and traces to read (default: all)
+    gids: list of gids of cells (and their conns, spikes and traces) to read (default: all) '''
+    import h5py, json
+    if include is None: include = ['netParams', 'simConfig', 'net', 'simData']
+    gids = np.unique(gids).astype(np.int64) if gids is not None else None
+    data = {}
+    with h5py.File(filename, 'r') as fileObj:
+        if 'simConfig' in include and 'simConfig' in fileObj.attrs: 
+            data['simConfig'] = json.loads(fileObj.attrs['simConfig'], object_pairs_hook=OrderedDict)
+        if 'netParams' in include and 'netParams' in fileObj.attrs: 
+            data.setdefault('net', {})['params'] = json.loads(fileObj.attrs['netParams'], object_pairs_hook=OrderedDict)
+        if 'net' in include and 'net' in fileObj:
+            data.setdefault('net', {})['cells'] = _h5ReadCells(fileObj['net'], gids)
+        if ('net' in include or 'netPops' in include) and 'pops' in fileObj.attrs:
+            pops = json.loads(fileObj.attrs['pops'], object_pairs_hook=OrderedDict)
+            if gids is not None: 
+                gidSet = set(gids.tolist())
+                for pop in pops.values(): pop['cellGids'] = [gid for gid in pop['cellGids'] if gid in gidSet]
+            data.setdefault('net', {})['pops'] = pops
+        if 'simData' in include and 'simData' in fileObj:
+            data['simData'] = _h5ReadSimData(fileObj['simData'], timeRange, gids)
+    return data
+
+
+def _h5ReadCells (group, gids = None):
+    cells = []
+    if 'cells' in group:
+        cellTable = group['cells']
+        inds = _h5RowInds(cellTable, '_gid', gids)
+        for row in _h5Rows(cellTable[inds] if inds is not None else cellTable[...]):
+            cell = {'gid': row.pop('_gid'), 'tags': {}}
+            for key, value in row.iteritems():
+                if key.startswith('_'): cell[key[1:]] = value
+                else: cell['tags'][key] = value
+            cells.append(cell)
+
+    if group.attrs.get('_conns'):
+        cellConns = {cell['gid']: cell.setdefault('conns', []) for cell in cells}
+    if 'conns' in group:
+        connTable = group['conns']
+        inds = _h5RowInds(connTable, '_postGid', gids)
+        for conn in _h5Rows(connTable[inds] if inds is not None else connTable[...]):
+            if group.attrs['_netStimPreGid'] and conn.get('preGid') == -1: conn['preGid'] = 'NetStim'
+            postGid = conn.pop('_postGid')
+            if postGid in cellConns: cellConns[postGid].append(conn)
+    return cells
+
+
+def _h5RowInds (table, column, gids):
+    # indices of rows with column value in gids (None = all rows); only the column is read
+    if gids is None or not len(table): return None
+    return np.nonzero(np.in1d(table[column], gids))[0].tolist()
+
+
+def _h5ReadSimData (group, timeRange = None, gids = None):
+    simData = Dict()
+    if 'spkt' in group:
+        spkt = group['spkt']
+        if timeRange is not None:
+            spikes = slice(_h5Bisect(spkt, timeRange[0], 'left'), _h5Bisect(spkt, timeRange[1], 'right'))
+        else: 
+            spikes = slice(None)
+        simData['spkt'] = spkt[spikes]
+        if 'spkid' in group: 
+            simData['spkid'] = group['spkid'][spikes]
+            if gids is not None:
+                mask = np.in1d(simData['spkid'].astype(np.int64), gids)
+                simData['spkt'], simData['spkid'] = simData['spkt'][mask], simData['spkid'][mask]
+
+    for key, value in _h5ReadGroup(group, timeRange, gids).iteritems():
+        if key not in ['spkt', 'spkid']: simData[key] = value
+    return simData
+
+
+def _h5Samples (node, timeRange):
+    # slice of samples of time series dataset (or rows group) within timeRange, calculated from sampling attributes
+    if timeRange is None or '_step' not in node.attrs: return slice(None)
+    t0, step, numSamples = node.attrs['_t0'], node.attrs['_step'], int(node.attrs['_numSamples'])
+    start = min(max(int(math.ceil((timeRange[0]-t0)/step - 1e-9)), 0), numSamples)
+    stop = min(max(int(math.floor((timeRange[1]-t0)/step + 1e-9)) + 1, start), numSamples)
+    return slice(start, stop)
+
+
+def _h5ReadGroup (group, timeRange, gids):
+    import json
+    data = Dict()
+    for key, value in group.attrs.iteritems():
+        if not key.startswith('_'): data[key] = json.loads(value)
+    for key, node in group.iteritems():
+        label = key.replace('%2F', '/')
+        if gids is not None and _labelGid(label) >= 0 and _labelGid(label) not in gids: continue
+        if not hasattr(node, 'shape'):  # group
+            if node.attrs.get('_type') == 'rows':
+                rowGids = node['gids'][...]
+                inds = np.nonzero((rowGids < 0) | np.in1d(rowGids, gids))[0] if gids is not None else np.arange(len(rowGids))
+                labels = node['labels'][...]
+                cols = _h5Samples(node, timeRange)
+                if gids is None: rows = node['data'][:, cols]
+                else: rows = node['data'][inds.tolist(), cols] if len(inds) else []
+                data[label] = Dict([(labels[i], row) for i, row in zip(inds, rows)])
+            else:
+                data[label] = _h5ReadGroup(node, timeRange, gids)
+        elif '_step' in node.attrs:
+            data[label] = node[_h5Samples(node, timeRange)]
+        else:
+            data[label] = node[...]
+    return data
+
+
+def _h5Bisect (dataset, value, side = 'left'):
+    # index of value in sorted 1D dataset, reading only log2(n) chunks
+    lo, hi = 0, len(dataset)
+    while hi - lo > 65536:
+        mid = (lo + hi) // 2
+        if dataset[mid] < value or (side == 'right' and dataset[mid] == value): lo = mid + 1
+        else: hi = mid
+    return lo + int(np.searchsorted(dataset[lo:hi], value, side))
+
+
 ###############################################################################
 ### Timing - Stop Watch
 ###############################################################################
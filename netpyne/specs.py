@@ -333,31 +333,53 @@ class SimConfig (object):
         self.dt = 0.025 # Internal integration timestep to use
         self.hParams = Dict({'celsius': 6.3, 'clamp_resist': 0.001})  # parameters of h module 
         self.cache_efficient = False  # use CVode cache_efficient option to optimize load when running on many cores
+        self.cvode_active = False  # use CVode variable time step (instead of fixed dt)
+        self.cvode_local = False  # use local variable time step (lvardt; one integrator per cell); requires cvode_active
+        self.cvode_atol = 0.001  # absolute error tolerance of CVode
+        self.use_fast_imem = False  # calculate membrane current (i_membrane_) of all segments during the simulation
+        self.nthreads = 1  # number of threads used by each node (pc.nthread) 
+        self.threadPartition = 'auto'  # how cells are distributed across threads ('auto': NEURON default; 'balanced': by number of segments)
+        self.spikeCompress = False  # compress spike exchange between nodes (True or dict with 'nspike', 'gidCompress' and 'xchng'; see pc.spike_compress)
+        self.queueMode = False  # event queue mode (True or dict with 'binQueue' and 'selfQueue'; see CVode.queue_mode)
         self.seeds = Dict({'conn': 1, 'stim': 1, 'loc': 1}) # Seeds for randomizers (connectivity, input stimulation and cell locations)
         self.createNEURONObj= True  # create HOC objects when instantiating network
         self.createPyStruct = True  # create Python structure (simulator-independent) when instantiating network
+        self.loadPartition = 'roundRobin'  # how cells loaded from file are distributed across nodes ('roundRobin': by gid; 'balanced': by number of segments)
         self.includeParamsLabel = True  # include label of param rule that created that cell, conn or stim
         self.timing = True  # show timing of each process
         self.saveTiming = False  # save timing data to pickle file
         self.verbose = False  # show detailed messages 
+        self.checkpointStep = None  # interval in ms between simulation checkpoints (None = no checkpoints)
+        self.checkpointDir = 'checkpoints'  # folder where each node saves its checkpoint files
+        self.gatherMethod = 'pickle'  # how data is gathered to node 0: 'pickle' (cells and simData via py_alltoall) or 'arrays' (numeric buffers via pc.alltoall)
+        self.gatherCells = ['tags', 'conns']  # cell data included in sim.net.allCells when gatherMethod = 'arrays' (any of 'tags', 'conns', 'secs', 'stims')
 
         # Recording 
         self.recordCells = []  # what cells to record from (eg. 'all', 5, or 'PYR')
         self.recordTraces = {}  # Dict of traces to record 
         self.recordStim = False  # record spikes of cell stims
         self.recordStep = 0.1 # Step size in ms to save data (eg. V traces, LFP, etc)
+        self.recordLFP = []  # list of electrode positions [x, y, z] (um) where LFP is recorded (enables use_fast_imem)
+        self.saveLFPPops = False  # also store contribution of each population to LFP
+        self.LFPsigma = 0.3  # extracellular conductivity (S/m) used to calculate LFP
 
         # Saving
         self.saveDataInclude = ['netParams', 'netCells', 'netPops', 'simConfig', 'simData']
         self.filename = 'model_output'  # Name of file to save model output
         self.timestampFilename = False  # Add timestamp to filename to avoid overwriting
+        self.saveFileStep = None  # step size in ms to save recorded data to disk during the simulation (None = keep all in memory)
         self.savePickle = False # save to pickle file
         self.saveJson = False # save to json file
+        self.saveNDJson = False # save to newline-delimited json file (one cell, pop or trace per line)
         self.saveMat = False # save to mat file
         self.saveCSV = False # save to txt file
-        self.saveDpk = False # save to .dpk pickled file
+        self.saveDpk = False # save to .dpk file (chunked, compressed sections)
         self.saveHDF5 = False # save to HDF5 file 
-        self.saveDat = False # save traces to .dat file(s)
+        self.saveDat = False # save traces to .dat file(s): True (one file per cell and trace) or 'combined' (one file per trace with a column per cell)
+        self.saveDatBinary = False # save .dat traces as raw float64 binary (.bin) files instead of text
+        self.saveDatThreads = 4 # number of threads used to write .dat files
+        self.saveSpikeStore = False # save spikes indexed by gid and time to _spikes.npz file (or _spikes.hdf5 if set to 'hdf5'); see sim.loadSpikeStore
+        self.saveDistributed = False  # each node saves its cells, spikes and traces to its own shard file, plus a .shards index (no gather)
 
         # Analysis and plotting 
         self.analysis = ODict()
@@ -0,0 +1,157 @@
+"""
+spikes.py
+
+Spikes indexed by cell gid and time, to select spikes of a subset of cells and/or a time range without scanning all spikes
+
+Usage:
+    from netpyne.spikes import SpikeStore
+
+    store = SpikeStore(sim.allSimData['spkt'], sim.allSimData['spkid'])
+    spkts, spkids = store.spikesFor([0, 1, 2], tRange=[100, 500])
+    counts = store.countsPerGid(tRange=[100, 500])
+    store.save('model_output_spikes.npz')
+    store = SpikeStore.load('model_output_spikes.npz')
+
+Contributors: salvadordura@gmail.com
+"""
+
+import numpy as np
+
+
+###############################################################################
+### Spike store class
+###############################################################################
+class SpikeStore (object):
+
+    def __init__(self, spkt=None, spkid=None, bucketSize=100.0):
+        '''
+        spkt: list or array of spike times (ms)
+        spkid: list or array of gids of cells that fired each spike
+        bucketSize: size (ms) of the time buckets indexed to find spikes in a time range
+        '''
+        spkt = np.asarray(spkt if spkt is not None else [], dtype=np.float64).ravel()
+        spkid = np.asarray(spkid if spkid is not None else [], dtype=np.float64).ravel().astype(np.int64)
+
+        # spikes sorted by gid, then time; spikes of gids[i] are times[offsets[i]:offsets[i+1]]
+        order = np.lexsort((spkt, spkid))
+        self.times = spkt[order]
+        self.gids, counts = np.unique(spkid[order], return_counts=True)
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        # spikes sorted by time (as indices into gid-sorted arrays) and first spike of each time bucket
+        self.timeOrder = np.argsort(self.times, kind='mergesort')
+        self._indexBuckets(bucketSize)
+
+
+    ###############################################################################
+    ### Index of first spike (in time order) of each time bucket
+    ###############################################################################
+    def _indexBuckets (self, bucketSize):
+        self.bucketSize = float(bucketSize)
+        sortedTimes = self.times[self.timeOrder]
+        self.tStart = sortedTimes[0] if len(sortedTimes) else 0.0
+        numBuckets = int((sortedTimes[-1]-self.tStart) // self.bucketSize) + 1 if len(sortedTimes) else 0
+        self.bucketOffsets = np.searchsorted(sortedTimes, self.tStart + np.arange(numBuckets+1)*self.bucketSize, 'left')
+        self._sortedTimes = sortedTimes
+
+
+    def __len__ (self):
+        return len(self.times)
+
+
+    ###############################################################################
+    ### Range of indices (in time order) of spikes in time range [t0, t1] (both included)
+    ###############################################################################
+    def _timeSlice (self, tRange):
+        if tRange is None: return 0, len(self.times)
+        ibucket0 = min(max(int((tRange[0]-self.tStart) // self.bucketSize), 0), len(self.bucketOffsets)-1)
+        ibucket1 = min(max(int((tRange[1]-self.tStart) // self.bucketSize) + 1, 0), len(self.bucketOffsets)-1)
+        lo, hi = self.bucketOffsets[ibucket0], self.bucketOffsets[ibucket1]
+        if ibucket1 == len(self.bucketOffsets)-1: hi = len(self.times)
+        start = lo + np.searchsorted(self._sortedTimes[lo:hi], tRange[0], 'left')
+        stop = lo + np.searchsorted(self._sortedTimes[lo:hi], tRange[1], 'right')
+        return start, max(start, stop)
+
+
+    ###############################################################################
+    ### Spike times and gids of cells in gids (None = all) within tRange [t0, t1] (None = all); sorted by gid, then time
+    ###############################################################################
+    def spikesFor (self, gids=None, tRange=None):
+        if gids is None:
+            if tRange is None:
+                return self.times.copy(), np.repeat(self.gids, np.diff(self.offsets))
+            start, stop = self._timeSlice(tRange)
+            inds = np.sort(self.timeOrder[start:stop])  # back to gid order
+            return self.times[inds], self.gids[np.searchsorted(self.offsets, inds, 'right')-1]
+
+        gids = np.unique(np.asarray(list(gids), dtype=np.int64))
+        igids = np.searchsorted(self.gids, gids)
+        found = igids < len(self.gids)
+        found[found] = self.gids[igids[found]] == gids[found]
+        gids, igids = gids[found], igids[found]
+
+        starts, stops = self.offsets[igids], self.offsets[igids+1]
+        if tRange is not None:  # spikes of each gid are sorted by time
+            for i, (start, stop) in enumerate(zip(starts, stops)):
+                starts[i] = start + np.searchsorted(self.times[start:stop], tRange[0], 'left')
+                stops[i] = start + np.searchsorted(self.times[start:stop], tRange[1], 'right')
+        counts = stops - starts
+        if not counts.sum(): return np.zeros(0), np.zeros(0, dtype=np.int64)
+        inds = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
+        return self.times[inds], np.repeat(gids, counts)
+
+
+    ###############################################################################
+    ### Number of spikes of each cell in gids (default: self.gids) within tRange [t0, t1] (None = all)
+    ###############################################################################
+    def countsPerGid (self, tRange=None, gids=None):
+        if tRange is None:
+            counts = np.diff(self.offsets)
+        else:
+            start, stop = self._timeSlice(tRange)
+            igids = np.searchsorted(self.offsets, self.timeOrder[start:stop], 'right')-1
+            counts = np.bincount(igids, minlength=len(self.gids))
+        if gids is None: return counts
+
+        gids = np.asarray(list(gids), dtype=np.int64)
+        igids = np.minimum(np.searchsorted(self.gids, gids), max(len(self.gids)-1, 0))
+        found = self.gids[igids] == gids if len(self.gids) else np.zeros(len(gids), dtype=bool)
+        return np.where(found, counts[igids] if len(counts) else 0, 0)
+
+
+    ###############################################################################
+    ### Save to .npz or HDF5 (.hdf5/.h5) file
+    ###############################################################################
+    def save (self, filename):
+        arrays = {'times': self.times, 'gids': self.gids, 'offsets': self.offsets, 'timeOrder': self.timeOrder,
+            'bucketOffsets': self.bucketOffsets, 'bucketSize': np.float64(self.bucketSize), 'tStart': np.float64(self.tStart)}
+        if filename.split('.')[-1] in ['hdf5', 'h5']:
+            import h5py
+            with h5py.File(filename, 'w') as fileObj:
+                group = fileObj.create_group('spikes')
+                for key, value in arrays.iteritems():
+                    if value.ndim and len(value): group.create_dataset(key, data=value, chunks=True, compression='gzip', shuffle=True)
+                    else: group.create_dataset(key, data=value)
+        else:
+            np.savez(filename, **arrays)
+
+
+    ###############################################################################
+    ### Load from .npz or HDF5 (.hdf5/.h5) file saved with save()
+    ###############################################################################
+    @classmethod
+    def load (cls, filename):
+        if filename.split('.')[-1] in ['hdf5', 'h5']:
+            import h5py
+            with h5py.File(filename, 'r') as fileObj:
+                arrays = {key: value[()] for key, value in fileObj['spikes'].iteritems()}
+        else:
+            with np.load(filename) as fileObj:
+                arrays = {key: fileObj[key] for key in fileObj.files}
+
+        store = cls.__new__(cls)
+        store.times, store.gids, store.offsets = arrays['times'], arrays['gids'], arrays['offsets']
+        store.timeOrder, store.bucketOffsets = arrays['timeOrder'], arrays['bucketOffsets']
+        store.bucketSize, store.tStart = float(arrays['bucketSize']), float(arrays['tStart'])
+        store._sortedTimes = store.times[store.timeOrder]
+        return store